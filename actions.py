@@ -0,0 +1,127 @@
+import random
+from typing import Any, Callable
+
+from config import Config, get_config, get_store
+from logger import reg_logger
+
+
+class ActionSpec:
+    """
+    Static description of a GoAPI button: endpoint it calls and parameters it sends
+    """
+    __slots__ = ('action', 'task_type', 'endpoint', 'params')
+
+    def __init__(self, action: str, task_type: str, endpoint: str, params: dict[str, Any]):
+        self.action = action
+        self.task_type = task_type
+        self.endpoint = endpoint
+        self.params = params
+
+
+class Action:
+    """
+    Button compiled against current config: resolved URL and ready payload, only origin task and random choices
+    are filled in per submission
+    """
+    __slots__ = ('action', 'task_type', 'url', 'base_payload', 'choices')
+
+    def __init__(self, action: str, task_type: str, url: str, base_payload: dict, choices: tuple):
+        self.action = action
+        self.task_type = task_type
+        self.url = url
+        self.base_payload = base_payload
+        self.choices = choices
+
+    def payload(self, origin_task_id: str) -> dict:
+        payload = {"origin_task_id": origin_task_id} | self.base_payload
+        for key, options in self.choices:
+            payload[key] = random.choice(options)
+        return payload
+
+    def __repr__(self):
+        return self.action
+
+
+_specs: dict[str, ActionSpec] = {}
+_registries: dict[str, 'ActionRegistry'] = {}
+
+
+def register_action(action: str, task_type: str, endpoint: str | None = None, **params) -> None:
+    """
+    Register a GoAPI action string
+
+    :param action: Action string as GoAPI lists it in task_result.actions, e.g. 'pan_left'
+    :param task_type: Task type of the created child, e.g. 'Pan'
+    :param endpoint: Key in goapi.urls, defaults to lowercase task_type
+    :param params: Payload fields. Tuple values are options, one is picked at random per submission
+    """
+    _specs[action] = ActionSpec(action, task_type, endpoint or task_type.lower(), params)
+    for registry in _registries.values():
+        registry.build()
+
+
+for _index in '1234':
+    register_action(f'upscale{_index}', 'Upscale', index=_index)
+    register_action(f'variation{_index}', 'Variation', index=_index, prompt="", aspect_ratio="")
+register_action('reroll', 'Reroll', prompt="", aspect_ratio="")
+for _direction in ('up', 'left', 'down', 'right'):
+    register_action(f'pan_{_direction}', 'Pan', direction=_direction, prompt="", aspect_ratio="")
+register_action('outpaint_1.5x', 'Outpaint', zoom_ratio="1.5", prompt="", aspect_ratio="")
+register_action('outpaint_2x', 'Outpaint', zoom_ratio="2.0", prompt="", aspect_ratio="")
+register_action('outpaint_custom', 'Outpaint', zoom_ratio=("1.25", "1.75"), prompt="", aspect_ratio="")
+
+
+class ActionRegistry:
+    """
+    GoAPI action string -> compiled Action. Built once, rebuilt only when urls or webhook settings change.
+    Actions that are not registered (e.g. high_variation) are skipped
+    """
+    logger = reg_logger('[bold blue]\[ACTIONS][/bold blue]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.actions: dict[str, Action] = {}
+        self.build()
+        get_store(config_path).subscribe(self.on_config_change)
+
+    def build(self) -> None:
+        config = get_config(self.config_path)
+        general_payload = config.webhook.payload()
+        actions = {}
+        for spec in _specs.values():
+            url = config.goapi.urls.get(spec.endpoint)
+            if not url:
+                self.logger.error(f"[bold yellow]GoAPI URL not found for {spec.action} ({spec.endpoint})")
+                continue
+
+            fixed = {k: v for k, v in spec.params.items() if not isinstance(v, tuple)}
+            choices = tuple((k, v) for k, v in spec.params.items() if isinstance(v, tuple))
+            actions[spec.action] = Action(spec.action, spec.task_type, url, fixed | general_payload, choices)
+        self.actions = actions
+
+    def on_config_change(self, old: Config, new: Config) -> None:
+        if old.goapi.urls != new.goapi.urls or old.webhook != new.webhook:
+            self.build()
+
+    def get(self, action: str) -> Action | None:
+        return self.actions.get(action)
+
+    def select(self, actions: list[str], count: int, cost: Callable[[str], float] | None = None) -> list[Action]:
+        """
+        Pick up to `count` distinct known actions at random
+
+        :param cost: Task type cost. If given, the cheapest actions are picked (at random among equal ones)
+        """
+        available = [a for a in map(self.actions.get, actions) if a is not None]
+        if cost is None:
+            return random.sample(available, min(count, len(available)))
+        random.shuffle(available)
+        available.sort(key=lambda a: cost(a.task_type))
+        return available[:count]
+
+
+def get_registry(config_path: str = 'config.yml') -> ActionRegistry:
+    registry = _registries.get(config_path)
+    if registry is None:
+        registry = _registries[config_path] = ActionRegistry(config_path)
+    return registry
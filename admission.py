@@ -0,0 +1,72 @@
+import asyncio
+
+from semaphore import ResizableSemaphore
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. rate_per_minute <= 0 disables it
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate_per_minute = rate_per_minute
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated_at: float | None = None
+
+    def configure(self, rate_per_minute: float, burst: int) -> None:
+        self.rate_per_minute = rate_per_minute
+        self.burst = max(burst, 1)
+        self.tokens = min(self.tokens, self.burst)
+
+    def refill(self, now: float) -> None:
+        if self.updated_at is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate_per_minute / 60)
+        self.updated_at = now
+
+    async def take(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.rate_per_minute > 0:
+            self.refill(loop.time())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * 60 / self.rate_per_minute)
+
+
+class AdmissionController:
+    """
+    Credit-based admission of new imagines.
+
+    Every imagine holds one credit from creation until it completes or fails,
+    the credit is returned the moment that happens and the next imagine is admitted right away.
+    """
+
+    def __init__(self, credits: int, rate_per_minute: float = 0, burst: int = 1):
+        self.credits = ResizableSemaphore(credits)
+        self.bucket = TokenBucket(rate_per_minute, burst)
+
+    @property
+    def in_use(self) -> int:
+        return self.credits.in_use
+
+    @property
+    def limit(self) -> int:
+        return self.credits.limit
+
+    async def admit(self) -> None:
+        """
+        Wait for a free credit and (if configured) a submission token
+        """
+        await self.credits.acquire()
+        try:
+            await self.bucket.take()
+        except BaseException:
+            self.credits.release()
+            raise
+
+    def release(self) -> None:
+        self.credits.release()
+
+    def resize(self, credits: int) -> None:
+        self.credits.resize(credits)
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config import ArtifactsConfig, get_config
+from goapi import TaskResult
+from http_client import HttpClient
+from logger import reg_logger
+from metrics import metrics
+from semaphore import ResizableSemaphore
+
+
+class ArtifactStore:
+    """
+    Downloads result images of completed tasks in background.
+
+    Bodies are streamed to a temp file chunk by chunk while being hashed, then moved to
+    `{directory}/{sha[:2]}/{sha}{ext}`. Identical images are stored once. Every downloaded task is
+    appended to the index as "task_id<TAB>path"
+    """
+    logger = reg_logger('[bold blue]\[ARTIFACTS][/bold blue]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.slots = ResizableSemaphore(max(self.config.concurrency, 1))
+        self.downloads: set[asyncio.Task] = set()
+        # Task ids downloaded or being downloaded in this run
+        self.submitted: set[str] = set()
+        # Task ids of the index file, read once in a thread
+        self.indexed: asyncio.Task | None = None
+
+    @property
+    def config(self) -> ArtifactsConfig:
+        return get_config(self.config_path).artifacts
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    @staticmethod
+    def read_index(path: str) -> set[str]:
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return {line.split('\t', 1)[0] for line in f}
+
+    async def read_index_or_nothing(self) -> set[str]:
+        path = self.config.index
+        try:
+            return await asyncio.to_thread(self.read_index, path)
+        except (OSError, ValueError):
+            self.logger.exception(f"[bold red]Failed to read {path}, already downloaded images may be indexed again")
+            return set()
+
+    async def load_index(self) -> set[str]:
+        if self.indexed is None:
+            self.indexed = asyncio.create_task(self.read_index_or_nothing())
+        return await asyncio.shield(self.indexed)
+
+    def submit(self, task_id: str, response: TaskResult) -> None:
+        """
+        Schedule download of the task's image_url, if it has one
+        """
+        url = response.image_url
+        if not url or task_id in self.submitted:
+            return
+        self.submitted.add(task_id)
+        download = asyncio.create_task(self.download(task_id, url))
+        self.downloads.add(download)
+        download.add_done_callback(self.downloads.discard)
+
+    @staticmethod
+    def create_temp(directory: str) -> tuple[int, str]:
+        os.makedirs(directory, exist_ok=True)
+        return tempfile.mkstemp(dir=directory, suffix='.part')
+
+    @staticmethod
+    def write_chunk(f, digest, chunk: bytes) -> None:
+        digest.update(chunk)
+        f.write(chunk)
+
+    @staticmethod
+    def remove(path: str) -> None:
+        if os.path.exists(path):
+            os.unlink(path)
+
+    @staticmethod
+    def store(config: ArtifactsConfig, task_id: str, tmp_path: str, path: str) -> str:
+        """
+        Move the temp file to its content address and index it
+        :return: 'downloaded', or 'duplicate' if the same image is stored already
+        """
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+            result = 'duplicate'
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            result = 'downloaded'
+
+        os.makedirs(os.path.dirname(config.index) or '.', exist_ok=True)
+        with open(config.index, 'a') as f:
+            f.write(f'{task_id}\t{path}\n')
+        return result
+
+    async def download(self, task_id: str, url: str) -> None:
+        if task_id in await self.load_index():
+            return
+        config = self.config
+        ext = os.path.splitext(urlsplit(url).path)[1] or '.png'
+        digest = hashlib.sha256()
+        size = 0
+
+        # File I/O runs in threads, the loop only moves chunks from the socket
+        async with self.slots:
+            fd, tmp_path = await asyncio.to_thread(self.create_temp, config.directory)
+            writing: asyncio.Future | None = None
+            try:
+                with os.fdopen(fd, 'wb', buffering=0) as f:
+                    try:
+                        timeout = aiohttp.ClientTimeout(total=config.timeout_seconds)
+                        async with HttpClient.session(self.config_path).get(url, timeout=timeout) as response:
+                            response.raise_for_status()
+                            async for chunk in response.content.iter_chunked(config.chunk_bytes):
+                                writing = asyncio.ensure_future(asyncio.to_thread(self.write_chunk, f, digest, chunk))
+                                await asyncio.shield(writing)
+                                size += len(chunk)
+                    finally:
+                        # Cancelled mid-chunk: the file is closed only once the thread is done with it
+                        if writing and not writing.done():
+                            await asyncio.gather(writing, return_exceptions=True)
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                await self.failed(task_id, url, tmp_path, e)
+                return
+            except BaseException:
+                self.submitted.discard(task_id)
+                await asyncio.to_thread(self.remove, tmp_path)
+                raise
+
+        sha = digest.hexdigest()
+        path = os.path.join(config.directory, sha[:2], sha + ext)
+        try:
+            result = await asyncio.to_thread(self.store, config, task_id, tmp_path, path)
+        except OSError as e:
+            await self.failed(task_id, url, tmp_path, e)
+            return
+        self.logger.debug("%s %s -> %s (%d bytes)", result, task_id, path, size)
+        if metrics.enabled:
+            metrics.artifacts.inc(result=result)
+            metrics.artifact_bytes.inc(size)
+
+    async def failed(self, task_id: str, url: str, tmp_path: str, error: BaseException) -> None:
+        """
+        Drop the temp file and forget the task, so a later completion of it is downloaded again
+        """
+        self.submitted.discard(task_id)
+        self.logger.warning(f"[yellow]Failed to download {url} for {task_id}: {error!r}")
+        if metrics.enabled:
+            metrics.artifacts.inc(result='failed')
+        try:
+            await asyncio.to_thread(self.remove, tmp_path)
+        except OSError:
+            self.logger.exception(f"[bold red]Failed to remove {tmp_path}")
+
+    async def stop(self) -> None:
+        """
+        Let running downloads finish for up to `stop_timeout_seconds`, cancel the rest
+        """
+        if not self.downloads:
+            return
+        pending = list(self.downloads)
+        _, pending = await asyncio.wait(pending, timeout=self.config.stop_timeout_seconds)
+        for download in pending:
+            download.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+_stores: dict[str, ArtifactStore] = {}
+
+
+def get_artifacts(config_path: str = 'config.yml') -> ArtifactStore:
+    store = _stores.get(config_path)
+    if store is None:
+        store = _stores[config_path] = ArtifactStore(config_path)
+    return store
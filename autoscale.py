@@ -0,0 +1,106 @@
+import asyncio
+import typing
+
+from config import AutoscaleConfig
+from logger import reg_logger
+from retry import get_retry_policy
+from stats import percentile
+
+if typing.TYPE_CHECKING:
+    from main import ActivityEngine
+
+
+class Autoscaler:
+    """
+    AIMD controller of engine concurrency.
+
+    Every `interval_seconds` looks at GoAPI attempts made since the previous step: if 429s, timeouts and 5xx
+    stay under `max_error_rate` and p90 latency stays within `latency_spike_ratio` of its usual value,
+    max_tasks grows by `increase` (only while every slot is actually in use). Otherwise it is multiplied by
+    `decrease_factor` and held for `cooldown_seconds`. Consumers follow max_tasks in the configured proportion
+    """
+    logger = reg_logger('[bold cyan]\[AUTOSCALE][/bold cyan]')
+
+    def __init__(self, engine: 'ActivityEngine'):
+        self.engine = engine
+        self.requests = 0
+        self.errors = 0
+        self.latencies: list[float] = []
+        # Smoothed p90 latency of healthy intervals
+        self.baseline: float | None = None
+        self.hold_until = 0.0
+        self.was_enabled = False
+        self.runner: asyncio.Task | None = None
+
+    @property
+    def config(self) -> AutoscaleConfig:
+        return self.engine.config.autoscale
+
+    def observe(self, endpoint: str, seconds: float, reason: str | None) -> None:
+        self.requests += 1
+        if reason is None:
+            self.latencies.append(seconds)
+        else:
+            self.errors += 1
+
+    def step(self, now: float) -> int | None:
+        """
+        :return: New max_tasks, None to keep the current one
+        """
+        config = self.config
+        requests, errors, latencies = self.requests, self.errors, self.latencies
+        self.requests, self.errors, self.latencies = 0, 0, []
+
+        semaphore = self.engine.semaphore
+        limit = min(max(semaphore.limit, config.min_tasks), config.max_tasks)
+        if not requests:
+            return limit if limit != semaphore.limit else None
+
+        error_rate = errors / requests
+        p90 = percentile(latencies, 90)
+        spike = self.baseline is not None and p90 is not None and p90 > self.baseline * config.latency_spike_ratio
+        if error_rate > config.max_error_rate or spike:
+            self.hold_until = now + config.cooldown_seconds
+            target = max(int(limit * config.decrease_factor), config.min_tasks)
+            if target < semaphore.limit:
+                self.logger.warning(f"[yellow]Backing off {semaphore.limit} -> {target}: "
+                                    f"{error_rate:.1%} errors, p90 {p90 or 0:.2f}s (usual {self.baseline or 0:.2f}s)")
+        else:
+            if p90 is not None:
+                self.baseline = p90 if self.baseline is None else self.baseline * 0.8 + p90 * 0.2
+            target = limit
+            if now >= self.hold_until and semaphore.in_use >= semaphore.limit:
+                target = min(limit + config.increase, config.max_tasks)
+
+        return target if target != semaphore.limit else None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.config.interval_seconds)
+            if not self.config.enabled:
+                if self.was_enabled:
+                    # Back to the configured value
+                    self.engine.apply_concurrency(self.engine.max_tasks)
+                self.was_enabled = False
+                self.requests, self.errors, self.latencies = 0, 0, []
+                continue
+
+            self.was_enabled = True
+            target = self.step(loop.time())
+            if target is not None:
+                self.logger.info(f"[cyan]max_tasks {self.engine.semaphore.limit} -> {target}")
+                self.engine.apply_concurrency(target)
+
+    def start(self) -> None:
+        get_retry_policy(self.engine.config_path).observers.append(self.observe)
+        self.runner = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        observers = get_retry_policy(self.engine.config_path).observers
+        if self.observe in observers:
+            observers.remove(self.observe)
+        if self.runner:
+            self.runner.cancel()
+            await asyncio.gather(self.runner, return_exceptions=True)
+            self.runner = None
@@ -0,0 +1,220 @@
+"""
+ActivityEngine throughput benchmark against the local GoAPI mock.
+
+Runs the engine for a fixed duration with the given capacity settings and prints
+a JSON report (chains/sec, chain latency percentiles, fetches per task, event-loop lag, peak RSS)
+
+    python bench.py --duration 60 --max-tasks 50 --consumers 50 --output bench.json
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def build_config(base_path: str, port: int, max_tasks: int, consumers: int,
+                 buttons: tuple[int, int] | None, recursive: tuple[int, int] | None,
+                 webhook: bool, log_level: str) -> dict:
+    with open(base_path) as f:
+        config = yaml.safe_load(f)
+
+    config['log_level'] = log_level
+    config['max_tasks'] = max_tasks
+    config['consumers'] = consumers
+    if buttons:
+        config['task']['use_buttons_range'] = list(buttons)
+    if recursive:
+        config['task']['use_buttons_range_recursive'] = list(recursive)
+
+    config['mock'] = (config.get('mock') or {}) | {'host': '127.0.0.1', 'port': port}
+    config['goapi']['base_url'] = f"http://127.0.0.1:{port}"
+
+    webhook_port = free_port()
+    config['webhook'] = (config.get('webhook') or {}) | {
+        'enabled': webhook,
+        'host': '127.0.0.1',
+        'port': webhook_port,
+        'public_url': f"http://127.0.0.1:{webhook_port}",
+        'secret': (config.get('webhook') or {}).get('secret') or secrets.token_urlsafe(16),
+    }
+    return config
+
+
+def run_mock(workdir: str) -> None:
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    from logger import setup_logging
+    from mock_goapi import main
+    setup_logging()
+    asyncio.run(main())
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags: list[float] = []
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(loop.time() - expected, 0))
+
+
+async def wait_ready(url: str, timeout: float = 15) -> None:
+    import aiohttp
+
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.head(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Mock GoAPI at {url} did not start")
+            await asyncio.sleep(0.1)
+
+
+async def fetch_mock_stats(url: str) -> dict:
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            return await response.json()
+
+
+async def bench(duration: float, port: int) -> dict:
+    # Imported only after chdir into the bench workdir, engine modules read ./config.yml
+    from logger import setup_logging
+    from main import ActivityEngine
+    from poller import get_poller
+    from stats import percentile
+
+    setup_logging()
+
+    base_url = f"http://127.0.0.1:{port}"
+    await wait_ready(base_url + '/')
+
+    engine = ActivityEngine()
+    monitor = LoopLagMonitor()
+    monitor_task = asyncio.create_task(monitor.run())
+    engine_task = asyncio.create_task(engine.run())
+
+    started = time.monotonic()
+    await asyncio.sleep(duration)
+    elapsed = time.monotonic() - started
+
+    mock_stats = await fetch_mock_stats(base_url + '/mock/stats')
+    for task in (engine_task, monitor_task):
+        task.cancel()
+    await asyncio.gather(engine_task, monitor_task, return_exceptions=True)
+
+    stats = engine.stats
+    poller = get_poller()
+    lags_ms = [lag * 1000 for lag in monitor.lags]
+    tasks_resolved = poller.resolved_count
+    return {
+        "duration_seconds": round(elapsed, 3),
+        "chains_started": stats.chains_started,
+        "chains_completed": stats.chains_completed,
+        "chains_failed": stats.chains_failed,
+        "chains_per_second": stats.chains_completed / elapsed,
+        "chain_latency_seconds": stats.latency(),
+        "fetch_requests": poller.fetch_count,
+        "tasks_completed": tasks_resolved,
+        "fetches_per_completed_task": poller.fetch_count / tasks_resolved if tasks_resolved else None,
+        "event_loop_lag_ms": {
+            "p50": percentile(lags_ms, 50),
+            "p99": percentile(lags_ms, 99),
+            "max": max(lags_ms, default=None),
+        },
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "mock": mock_stats,
+    }
+
+
+@click.command()
+@click.option('--config', 'config_path', default=os.path.join(REPO_DIR, 'config.yml'), show_default=True,
+              help='Base config, its mock section defines the fake backend')
+@click.option('--duration', default=60.0, show_default=True, help='Seconds to run the engine')
+@click.option('--max-tasks', default=10, show_default=True)
+@click.option('--consumers', default=10, show_default=True)
+@click.option('--buttons', nargs=2, type=int, default=None, help='use_buttons_range override')
+@click.option('--recursive', nargs=2, type=int, default=None, help='use_buttons_range_recursive override')
+@click.option('--webhook/--no-webhook', default=False, show_default=True, help='Complete tasks via webhooks')
+@click.option('--log-level', default='WARNING', show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Write JSON report here')
+def cli(config_path, duration, max_tasks, consumers, buttons, recursive, webhook, log_level, output):
+    """Benchmark the engine against the local GoAPI mock"""
+    output = output and os.path.abspath(output)
+    port = free_port()
+    config = build_config(config_path, port, max_tasks, consumers, buttons, recursive, webhook, log_level)
+
+    workdir = tempfile.mkdtemp(prefix='mj-bench-')
+    with open(os.path.join(workdir, 'config.yml'), 'w') as f:
+        yaml.safe_dump(config, f)
+    os.environ.setdefault('GOAPI_TOKEN', 'bench')
+
+    mock = multiprocessing.get_context('spawn').Process(target=run_mock, args=(workdir,), daemon=True)
+    mock.start()
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(bench(duration, port))
+    finally:
+        mock.terminate()
+        mock.join()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "params": {
+            "duration": duration,
+            "max_tasks": max_tasks,
+            "consumers": consumers,
+            "use_buttons_range": config['task']['use_buttons_range'],
+            "use_buttons_range_recursive": config['task']['use_buttons_range_recursive'],
+            "webhook": webhook,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    click.echo(text)
+
+
+if __name__ == '__main__':
+    cli()
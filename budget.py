@@ -0,0 +1,278 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+from config import BudgetConfig, Config, get_config, get_store
+from logger import reg_logger
+from metrics import metrics
+
+
+class SpendWindow:
+    """
+    Credits spent over a sliding window, kept in 60 buckets
+    """
+
+    def __init__(self, seconds: float, limit: float):
+        self.seconds = seconds
+        self.bucket_seconds = seconds / 60
+        self.limit = limit
+        # [bucket_start, spent], oldest first
+        self.buckets: deque[list[float]] = deque()
+        self.spent = 0.0
+
+    def expire(self, now: float) -> None:
+        while self.buckets and self.buckets[0][0] <= now - self.seconds:
+            self.spent -= self.buckets.popleft()[1]
+
+    def add(self, now: float, amount: float) -> None:
+        start = now - now % self.bucket_seconds
+        if self.buckets and self.buckets[-1][0] == start:
+            self.buckets[-1][1] += amount
+        else:
+            self.buckets.append([start, amount])
+        self.spent += amount
+
+    def refund(self, at: float, amount: float) -> None:
+        """
+        Take `amount` back from the bucket it was added to at `at`. Nothing to do if that bucket expired already
+        """
+        start = at - at % self.bucket_seconds
+        for bucket in reversed(self.buckets):
+            if bucket[0] == start:
+                bucket[1] -= amount
+                self.spent -= amount
+                return
+            if bucket[0] < start:
+                return
+
+    def load(self, buckets: list[list[float]], now: float) -> None:
+        self.buckets = deque([start, spent] for start, spent in buckets if start > now - self.seconds)
+        self.spent = sum(spent for _, spent in self.buckets)
+
+    def usage(self) -> float:
+        return self.spent / self.limit if self.limit else 0
+
+    def free_at(self, now: float, amount: float) -> float:
+        """
+        Moment when `amount` more fits into the window.
+        An amount over the whole limit is capped at it: it waits for the window to empty
+        """
+        amount = min(amount, self.limit)
+        if not self.limit or self.spent + amount <= self.limit:
+            return now
+        excess = self.spent + amount - self.limit
+        for start, spent in self.buckets:
+            excess -= spent
+            if excess <= 0:
+                return start + self.seconds
+        return now
+
+
+class Charge:
+    """
+    Credits charged for one submission, refunded if the submission fails
+    """
+    __slots__ = ('task_type', 'cost', 'at')
+
+    def __init__(self, task_type: str, cost: float, at: float):
+        self.task_type = task_type
+        self.cost = cost
+        self.at = at
+
+
+class Budget:
+    """
+    Spend accounting against hourly/daily credit budgets.
+
+    Every imagine and button press acquires its cost before being submitted. Past `soft_limit` of a budget
+    submissions are paced to the budget's average rate, fewer and cheaper buttons are pressed,
+    so the engine slows down gradually instead of hitting the limit and stopping.
+    Spending is timed by the wall clock and saved to `path`, so restarts don't reset the limits
+    """
+    logger = reg_logger('[bold green]\[BUDGET][/bold green]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        config = self.config
+        self.windows = [SpendWindow(3600, config.hourly), SpendWindow(86400, config.daily)]
+        # Replaced by the loop clock in simulation
+        self.clock = time.time
+        self.total_spent = 0.0
+        self.next_allowed = 0.0
+        self.was_frugal = False
+        self.saving: asyncio.Task | None = None
+        # Set by every charge or refund, cleared when a snapshot is taken for saving
+        self.dirty = False
+        self.delaying = False
+        self.oversized: set[str] = set()
+        self.load()
+        get_store(config_path).subscribe(self.on_config_change)
+
+    @property
+    def config(self) -> BudgetConfig:
+        return get_config(self.config_path).budget
+
+    def on_config_change(self, old: Config, new: Config) -> None:
+        if old.budget != new.budget:
+            self.windows[0].limit = new.budget.hourly
+            self.windows[1].limit = new.budget.daily
+
+    def load(self) -> None:
+        path = self.config.path
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            self.logger.exception(f"[bold red]Failed to load {path}, spending starts from zero")
+            return
+        now = self.clock()
+        for window in self.windows:
+            window.load(data.get(str(int(window.seconds)), []), now)
+        self.logger.info(f"[cyan]Loaded spending: {self.windows[0].spent:g} credits in the last hour, "
+                         f"{self.windows[1].spent:g} in the last day")
+
+    @staticmethod
+    def save(path: str, data: dict) -> None:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def changed(self) -> None:
+        """
+        Save spending within `save_interval_seconds` of a charge or refund
+        """
+        if not self.config.path:
+            return
+        self.dirty = True
+        if self.saving is None or self.saving.done():
+            self.saving = asyncio.create_task(self.flush(self.config.save_interval_seconds))
+
+    async def flush(self, delay: float = 0) -> None:
+        if delay:
+            self.delaying = True
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.delaying = False
+        # Copied on the loop, written in a thread
+        self.dirty = False
+        data = {str(int(w.seconds)): [list(bucket) for bucket in w.buckets] for w in self.windows}
+        try:
+            await asyncio.to_thread(self.save, self.config.path, data)
+        except OSError:
+            self.dirty = True
+            self.logger.exception(f"[bold red]Failed to save spending to {self.config.path}")
+            return
+        if self.dirty and self.saving is asyncio.current_task():
+            # Charged or refunded while saving, the file holds an older snapshot
+            self.saving = asyncio.create_task(self.flush(self.config.save_interval_seconds))
+
+    async def stop(self) -> None:
+        # A save still waiting out its delay is cancelled, one already writing is awaited
+        while self.saving and not self.saving.done():
+            if self.delaying:
+                self.saving.cancel()
+            await asyncio.gather(self.saving, return_exceptions=True)
+        self.saving = None
+        if self.dirty:
+            await self.flush()
+
+    def cost(self, task_type: str) -> float:
+        costs = self.config.costs.get(get_config(self.config_path).goapi.process_mode)
+        return costs.get(task_type, 0) if costs else 0
+
+    def usage(self, now: float | None = None) -> float:
+        """
+        Highest share of a budget spent, 0 when no budget is set
+        """
+        if now is None:
+            now = self.clock()
+        for window in self.windows:
+            window.expire(now)
+        return max(window.usage() for window in self.windows)
+
+    @property
+    def frugal(self) -> bool:
+        frugal = self.usage() >= self.config.soft_limit
+        if frugal != self.was_frugal:
+            self.was_frugal = frugal
+            if frugal:
+                self.logger.warning("[yellow]Budget is close, slowing down and pressing cheaper buttons")
+            else:
+                self.logger.info("[green]Budget has room again")
+        return frugal
+
+    def pace_rate(self) -> float:
+        """
+        Credits per second that keep spending within every limited window
+        """
+        return min(w.limit / w.seconds for w in self.windows if w.limit)
+
+    def buttons(self, count: int) -> int:
+        """
+        Scale button count down linearly between soft_limit and the budget
+        """
+        soft_limit = self.config.soft_limit
+        usage = self.usage()
+        if usage < soft_limit or soft_limit >= 1:
+            return count
+        return max(1, round(count * max(1 - usage, 0) / (1 - soft_limit)))
+
+    async def acquire(self, task_type: str) -> Charge:
+        """
+        Wait until the task fits the budget and charge it
+        :return: Charge, to be refunded if submission fails
+        """
+        cost = self.cost(task_type)
+        if not cost:
+            return Charge(task_type, 0, 0)
+        if task_type not in self.oversized and any(w.limit and cost > w.limit for w in self.windows):
+            self.oversized.add(task_type)
+            self.logger.warning(f"[yellow]{task_type} costs {cost:g}, more than a whole budget window, "
+                                f"submitting it only when the window is empty")
+
+        while True:
+            now = self.clock()
+            usage = self.usage(now)
+            wait_until = max(window.free_at(now, cost) for window in self.windows)
+            pacing = usage >= self.config.soft_limit and any(w.limit for w in self.windows)
+            if pacing:
+                wait_until = max(wait_until, self.next_allowed)
+            if wait_until <= now:
+                break
+            self.logger.debug("Waiting %.1fs for budget to submit %s", wait_until - now, task_type)
+            await asyncio.sleep(wait_until - now)
+
+        for window in self.windows:
+            window.add(now, cost)
+        self.total_spent += cost
+        if pacing:
+            self.next_allowed = max(now, self.next_allowed) + cost / self.pace_rate()
+        if metrics.enabled:
+            metrics.credits_spent.inc(cost, task_type=task_type)
+        self.changed()
+        return Charge(task_type, cost, now)
+
+    def refund(self, charge: Charge) -> None:
+        if not charge.cost:
+            return
+        for window in self.windows:
+            window.refund(charge.at, charge.cost)
+        self.total_spent -= charge.cost
+        if metrics.enabled:
+            metrics.credits_refunded.inc(charge.cost, task_type=charge.task_type)
+        self.changed()
+
+
+_budgets: dict[str, Budget] = {}
+
+
+def get_budget(config_path: str = 'config.yml') -> Budget:
+    budget = _budgets.get(config_path)
+    if budget is None:
+        budget = _budgets[config_path] = Budget(config_path)
+    return budget
@@ -0,0 +1,93 @@
+"""
+Command line entry point. The engine is imported only by the commands that need it, so `--help`
+and `status` start instantly
+
+    python cli.py run
+    python cli.py status
+    python cli.py bench --duration 60 --max-tasks 50 --consumers 50
+    python cli.py simulate --hours 8
+"""
+import importlib
+import json
+import urllib.error
+import urllib.request
+
+import click
+
+
+class LazyGroup(click.Group):
+    """
+    Group whose commands live in other modules and are imported on first use
+    """
+
+    def __init__(self, *args, lazy_commands: dict[str, str] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Command name -> 'module:attribute'
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted([*super().list_commands(ctx), *self.lazy_commands])
+
+    def get_command(self, ctx, name):
+        target = self.lazy_commands.get(name)
+        if target is None:
+            return super().get_command(ctx, name)
+        module, attribute = target.split(':')
+        return getattr(importlib.import_module(module), attribute)
+
+
+@click.group(cls=LazyGroup, lazy_commands={
+    'bench': 'bench:cli',
+    'simulate': 'simulate:cli',
+    'traces': 'tracing:cli',
+})
+def cli():
+    """MidJourney activity emulator"""
+
+
+@cli.command()
+@click.option('--config', 'config_path', default='config.yml', show_default=True)
+def run(config_path):
+    """Run the engine until interrupted (under a coordinator if sharding.workers > 1)"""
+    import asyncio
+
+    from logger import setup_logging
+    from main import main
+
+    setup_logging(config_path)
+    try:
+        asyncio.run(main(config_path))
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.option('--config', 'config_path', default='config.yml', show_default=True)
+@click.option('--url', default=None, help='Status URL, defaults to the metrics host and port of every worker')
+@click.option('--timeout', default=5.0, show_default=True)
+def status(config_path, url, timeout):
+    """Stats of a running engine. It serves them next to metrics, so metrics.enabled has to be on"""
+    from config import get_config
+
+    if url:
+        urls = [url]
+    else:
+        config = get_config(config_path)
+        host = '127.0.0.1' if config.metrics.host in ('0.0.0.0', '::', '') else config.metrics.host
+        urls = [f'http://{host}:{config.metrics.port + i}/status' for i in range(max(config.sharding.workers, 1))]
+
+    statuses = []
+    for status_url in urls:
+        try:
+            with urllib.request.urlopen(status_url, timeout=timeout) as response:
+                statuses.append(json.load(response))
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            statuses.append({"url": status_url, "error": str(e)})
+
+    click.echo(json.dumps(statuses[0] if len(statuses) == 1 else statuses, indent=2))
+    if any('error' in s for s in statuses):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,27 @@
+"""
+JSON codec of the GoAPI hot path: orjson when it is installed (`pip install orjson`), the standard library otherwise
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NAME = 'orjson' if orjson else 'json'
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Compact UTF-8 JSON, ready to be sent as a request body
+    """
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
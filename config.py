@@ -0,0 +1,392 @@
+import asyncio
+import dataclasses
+import logging
+import os
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, Mapping
+from urllib.parse import urlsplit, urlunsplit
+
+import yaml
+from dotenv import load_dotenv
+
+log = logging.getLogger('config')
+
+
+@dataclass(frozen=True)
+class ConnectionConfig:
+    limit: int = 100
+    limit_per_host: int = 0
+    keepalive_timeout_seconds: float = 30
+    dns_cache_ttl_seconds: int = 300
+    prewarm: int = 0
+
+
+@dataclass(frozen=True)
+class RetryConfig:
+    max_attempts: int = 5
+    base_delay_seconds: float = 0.5
+    max_delay_seconds: float = 30
+    retry_statuses: tuple[int, ...] = (429, 500, 502, 503, 504)
+    retry_submit_timeouts: bool = False
+    budget_ratio: float = 0.2
+    budget_burst: float = 10
+    breaker_failures: int = 5
+    breaker_open_seconds: float = 10
+
+
+@dataclass(frozen=True)
+class UpstreamConfig:
+    alpha: float = 0.2
+    eject_failures: int = 5
+    eject_error_rate: float = 0.5
+    min_requests: int = 20
+    probe_interval_seconds: float = 10
+    probe_successes: int = 2
+    probe_timeout_seconds: float = 5
+    sticky_limit: int = 100000
+
+
+@dataclass(frozen=True)
+class GoAPIConfig:
+    process_mode: str = 'fast'
+    http_timeout_seconds: float = 25
+    base_url: str = ''
+    base_urls: tuple[str, ...] = ()
+    urls: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+    connection: ConnectionConfig = field(default_factory=ConnectionConfig)
+    retry: RetryConfig = field(default_factory=RetryConfig)
+    upstream: UpstreamConfig = field(default_factory=UpstreamConfig)
+    token: str | None = field(default=None, repr=False)
+
+
+@dataclass(frozen=True)
+class PromptSourceConfig:
+    path: str = ''
+    mode: str = 'mmap'
+    reservoir_size: int = 10000
+    templates: bool = True
+
+
+@dataclass(frozen=True)
+class TaskConfig:
+    ar: str = '1:1'
+    prompts: tuple[str, ...] = ()
+    prompt_source: PromptSourceConfig = field(default_factory=PromptSourceConfig)
+    use_buttons_range: tuple[int, int] = (1, 4)
+    use_buttons_range_recursive: tuple[int, int] = (1, 3)
+    child_concurrency_per_chain: int = 0
+    child_concurrency: int = 0
+
+
+@dataclass(frozen=True)
+class SchedulerConfig:
+    enabled: bool = False
+    slots: int = 0
+    depth_weights: tuple[float, ...] = (1, 4, 8)
+    weights: Mapping[str, float] = field(default_factory=lambda: MappingProxyType({}))
+    limits: Mapping[str, int] = field(default_factory=lambda: MappingProxyType({}))
+
+
+@dataclass(frozen=True)
+class PollModelConfig:
+    enabled: bool = False
+    path: str = 'poll_model.json'
+    window: int = 500
+    min_samples: int = 20
+    first_poll_quantile: float = 0.05
+    hazard: float = 0.3
+    min_interval_seconds: float = 1
+    max_delay_seconds: float = 10
+    save_interval_seconds: float = 60
+
+
+@dataclass(frozen=True)
+class PollConfig:
+    interval_seconds: float = 1
+    max_fetches_per_second: float = 0
+    early_results_limit: int = 10000
+    max_error_delay_seconds: float = 60
+    task_timeout_seconds: float = 3600
+    model: PollModelConfig = field(default_factory=PollModelConfig)
+
+
+@dataclass(frozen=True)
+class AdmissionConfig:
+    queue_size: int = 0
+    imagines_per_minute: float = 0
+    burst: int = 1
+
+
+@dataclass(frozen=True)
+class AutoscaleConfig:
+    enabled: bool = False
+    min_tasks: int = 1
+    max_tasks: int = 50
+    interval_seconds: float = 30
+    increase: int = 1
+    decrease_factor: float = 0.7
+    max_error_rate: float = 0.02
+    latency_spike_ratio: float = 2.0
+    cooldown_seconds: float = 60
+
+
+@dataclass(frozen=True)
+class BudgetConfig:
+    hourly: float = 0
+    daily: float = 0
+    soft_limit: float = 0.8
+    path: str = 'budget.json'
+    save_interval_seconds: float = 1
+    costs: Mapping[str, Mapping[str, float]] = field(default_factory=lambda: MappingProxyType({}))
+
+
+@dataclass(frozen=True)
+class ArtifactsConfig:
+    enabled: bool = False
+    directory: str = 'artifacts'
+    index: str = 'artifacts/index.tsv'
+    concurrency: int = 4
+    chunk_bytes: int = 65536
+    timeout_seconds: float = 120
+    stop_timeout_seconds: float = 30
+
+
+@dataclass(frozen=True)
+class JournalConfig:
+    enabled: bool = False
+    path: str = 'journal.jsonl'
+    fsync_interval_seconds: float = 1
+
+
+@dataclass(frozen=True)
+class TracingConfig:
+    enabled: bool = False
+    path: str = 'traces.jsonl'
+    sample_rate: float = 0.01
+    max_bytes: int = 50 * 1024 * 1024
+    backups: int = 5
+    flush_interval_seconds: float = 1
+
+
+@dataclass(frozen=True)
+class WebhookConfig:
+    enabled: bool = False
+    host: str = '0.0.0.0'
+    port: int = 8080
+    path: str = '/goapi/webhook'
+    public_url: str = ''
+    secret: str = field(default='', repr=False)
+    fallback_poll_seconds: float = 60
+
+    def __post_init__(self):
+        # Without a secret anyone reaching the port could resolve tasks, without public_url GoAPI can't reach us
+        if self.enabled and not self.public_url:
+            raise ValueError("webhook.enabled requires webhook.public_url")
+        if self.enabled and not self.secret:
+            raise ValueError("webhook.enabled requires webhook.secret or GOAPI_WEBHOOK_SECRET")
+
+    @property
+    def endpoint(self) -> str:
+        return self.public_url.rstrip('/') + self.path
+
+    def payload(self) -> dict:
+        """
+        webhook_endpoint/webhook_secret fields for GoAPI task submissions
+        """
+        if not self.enabled:
+            return {"webhook_endpoint": "", "webhook_secret": ""}
+        return {"webhook_endpoint": self.endpoint, "webhook_secret": self.secret}
+
+
+@dataclass(frozen=True)
+class MetricsConfig:
+    enabled: bool = False
+    host: str = '0.0.0.0'
+    port: int = 9100
+    path: str = '/metrics'
+
+
+@dataclass(frozen=True)
+class ShardingConfig:
+    workers: int = 1
+    stats_interval_seconds: float = 10
+    restart_delay_seconds: float = 1
+    restart_max_delay_seconds: float = 60
+    stop_timeout_seconds: float = 30
+
+
+@dataclass(frozen=True)
+class MockConfig:
+    host: str = '127.0.0.1'
+    port: int = 8090
+    seed: int | None = None
+    response_ms: Mapping | float = 50
+    pending_seconds: Mapping | float = 1
+    completion_seconds: Mapping[str, Mapping | float] = field(default_factory=lambda: MappingProxyType({}))
+    failure_rate: float = 0
+    timeout_rate: float = 0
+    rate_limit_rate: float = 0
+    retry_after_seconds: float = 1
+    image_bytes: int = 65536
+
+
+@dataclass(frozen=True)
+class Config:
+    log_level: str = 'DEBUG'
+    max_tasks: int = 1
+    consumers: int = 1
+    config_reload_seconds: float = 5
+    task: TaskConfig = field(default_factory=TaskConfig)
+    goapi: GoAPIConfig = field(default_factory=GoAPIConfig)
+    poll: PollConfig = field(default_factory=PollConfig)
+    admission: AdmissionConfig = field(default_factory=AdmissionConfig)
+    autoscale: AutoscaleConfig = field(default_factory=AutoscaleConfig)
+    scheduler: SchedulerConfig = field(default_factory=SchedulerConfig)
+    webhook: WebhookConfig = field(default_factory=WebhookConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+    journal: JournalConfig = field(default_factory=JournalConfig)
+    budget: BudgetConfig = field(default_factory=BudgetConfig)
+    artifacts: ArtifactsConfig = field(default_factory=ArtifactsConfig)
+    tracing: TracingConfig = field(default_factory=TracingConfig)
+    sharding: ShardingConfig = field(default_factory=ShardingConfig)
+    mock: MockConfig = field(default_factory=MockConfig)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _build(cls, data: dict | None, **extra):
+    """
+    Build frozen section dataclass from raw yaml dict
+
+    Unknown keys are ignored, missing keys fall back to dataclass defaults,
+    nested dataclass fields are built recursively
+    """
+    data = data or {}
+    kwargs = {}
+    for f in dataclasses.fields(cls):
+        if f.name not in data:
+            continue
+        value = data[f.name]
+        if dataclasses.is_dataclass(f.type):
+            value = _build(f.type, value)
+        kwargs[f.name] = _freeze(value)
+    return cls(**(kwargs | extra))
+
+
+def _rebase(url: str, base_url: str) -> str:
+    parts = urlsplit(url)
+    base = urlsplit(base_url)
+    return urlunsplit((base.scheme, base.netloc, base.path.rstrip('/') + parts.path, parts.query, parts.fragment))
+
+
+def parse_config(raw: dict) -> Config:
+    load_dotenv()
+    goapi = raw.get('goapi') or {}
+    # With several base urls, urls point at the first one and requests are rewritten to the selected one
+    base_url = (goapi.get('base_urls') or [None])[0] or goapi.get('base_url')
+    if base_url:
+        goapi = goapi | {'urls': {k: _rebase(v, base_url) for k, v in goapi.get('urls', {}).items()}}
+    goapi = _build(GoAPIConfig, goapi, token=os.environ.get('GOAPI_TOKEN'))
+    webhook = raw.get('webhook') or {}
+    webhook = _build(WebhookConfig, webhook,
+                     secret=webhook.get('secret') or os.environ.get('GOAPI_WEBHOOK_SECRET', ''))
+    return _build(Config, raw, goapi=goapi, webhook=webhook)
+
+
+class ConfigStore:
+    """
+    Loaded once, re-parsed only when config file mtime changes.
+    Subscribers are called with (old, new) snapshots after every reload.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime: float | None = None
+        self.snapshot: Config | None = None
+        self.subscribers: list[Callable[[Config, Config], None]] = []
+        self.transform: Callable[[Config], Config] | None = None
+        self.load()
+
+    def load(self) -> Config:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path) as f:
+            snapshot = parse_config(yaml.safe_load(f))
+        self.snapshot = self.transform(snapshot) if self.transform else snapshot
+        self.mtime = mtime
+        return self.snapshot
+
+    def set_transform(self, transform: Callable[[Config], Config] | None) -> None:
+        """
+        Apply transform to every loaded snapshot (current one included), e.g. to take a worker's share of limits
+        """
+        self.transform = transform
+        self.load()
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload config if file was modified
+
+        :returns: True if snapshot changed
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+
+        if mtime == self.mtime:
+            return False
+
+        old = self.snapshot
+        try:
+            new = self.load()
+        except Exception:
+            self.mtime = mtime
+            log.exception(f"Failed to reload {self.path}. Keeping previous config")
+            return False
+
+        if new == old:
+            return False
+
+        for callback in list(self.subscribers):
+            # One broken subscriber must not stop the others or the watcher
+            try:
+                callback(old, new)
+            except Exception:
+                log.exception(f"Config subscriber {callback!r} failed to apply {self.path}")
+        return True
+
+    def subscribe(self, callback: Callable[[Config, Config], None]) -> None:
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Config, Config], None]) -> None:
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot.config_reload_seconds)
+            self.reload_if_changed()
+
+
+_stores: dict[str, ConfigStore] = {}
+
+
+def get_store(path: str = 'config.yml') -> ConfigStore:
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = ConfigStore(path)
+    return store
+
+
+def get_config(path: str = 'config.yml') -> Config:
+    """
+    Current config snapshot. No disk I/O after first load
+    """
+    return get_store(path).snapshot
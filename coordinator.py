@@ -0,0 +1,301 @@
+import asyncio
+import dataclasses
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import connection
+from multiprocessing.connection import Connection
+
+from config import Config, ShardingConfig, get_config, get_store
+from enums import TaskStatusEnum
+from goapi import TaskResult
+from logger import reg_logger, setup_logging
+from webhook import WebhookServer
+
+
+def split(total: int, index: int, count: int) -> int:
+    """
+    Share of `total` for worker `index` out of `count`, shares differ by at most 1 and sum up to total
+    """
+    return total // count + (1 if index < total % count else 0)
+
+
+def shard_config(config: Config, index: int, count: int) -> Config:
+    """
+    Worker's view of the config: global limits divided between workers, per-process resources made unique
+    """
+    replace = dataclasses.replace
+    root, ext = os.path.splitext(config.journal.path)
+    model_root, model_ext = os.path.splitext(config.poll.model.path)
+    trace_root, trace_ext = os.path.splitext(config.tracing.path)
+    index_root, index_ext = os.path.splitext(config.artifacts.index)
+    budget_root, budget_ext = os.path.splitext(config.budget.path)
+    child_concurrency = config.task.child_concurrency
+    return replace(
+        config,
+        max_tasks=max(split(config.max_tasks, index, count), 1),
+        consumers=max(split(config.consumers, index, count), 1),
+        task=replace(config.task, child_concurrency=max(split(child_concurrency, index, count), 1)
+                     if child_concurrency else 0),
+        admission=replace(config.admission,
+                          queue_size=split(config.admission.queue_size, index, count),
+                          imagines_per_minute=config.admission.imagines_per_minute / count,
+                          burst=max(split(config.admission.burst, index, count), 1)),
+        scheduler=replace(config.scheduler, slots=max(split(config.scheduler.slots, index, count), 1)
+                          if config.scheduler.slots else 0,
+                          limits={k: max(split(v, index, count), 1) for k, v in config.scheduler.limits.items()}),
+        autoscale=replace(config.autoscale, min_tasks=max(split(config.autoscale.min_tasks, index, count), 1),
+                          max_tasks=max(split(config.autoscale.max_tasks, index, count), 1)),
+        poll=replace(config.poll, max_fetches_per_second=config.poll.max_fetches_per_second / count,
+                     model=replace(config.poll.model, path=f'{model_root}.{index}{model_ext}'
+                                   if config.poll.model.path else '')),
+        metrics=replace(config.metrics, port=config.metrics.port + index),
+        journal=replace(config.journal, path=f'{root}.{index}{ext}'),
+        tracing=replace(config.tracing, path=f'{trace_root}.{index}{trace_ext}'),
+        artifacts=replace(config.artifacts, index=f'{index_root}.{index}{index_ext}',
+                          concurrency=max(split(config.artifacts.concurrency, index, count), 1)),
+        budget=replace(config.budget, hourly=config.budget.hourly / count, daily=config.budget.daily / count,
+                       path=f'{budget_root}.{index}{budget_ext}' if config.budget.path else ''),
+    )
+
+
+def run_worker(config_path: str, index: int, count: int, conn: Connection) -> None:
+    """
+    Worker process entrypoint
+    """
+    get_store(config_path).set_transform(functools.partial(shard_config, index=index, count=count))
+    setup_logging(config_path)
+    try:
+        asyncio.run(worker_main(config_path, index, conn))
+    except KeyboardInterrupt:
+        pass
+
+
+async def worker_main(config_path: str, index: int, conn: Connection) -> None:
+    from main import ActivityEngine
+    from poller import get_poller
+
+    loop = asyncio.get_running_loop()
+    engine = ActivityEngine(config_path, serve_webhook=False)
+    engine_task = asyncio.create_task(engine.run())
+    poller = get_poller(config_path)
+
+    def on_message(message: tuple) -> None:
+        match message:
+            case ('webhook', task_id, status, result):
+                poller.resolve(task_id, status, result)
+            case ('stop',):
+                engine_task.cancel()
+
+    def read() -> None:
+        # Daemon thread: blocking recv must never keep the process alive
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                message = ('stop',)
+            loop.call_soon_threadsafe(on_message, message)
+            if message == ('stop',):
+                return
+
+    threading.Thread(target=read, daemon=True).start()
+
+    async def report() -> None:
+        while True:
+            await asyncio.sleep(get_config(config_path).sharding.stats_interval_seconds)
+            conn.send(('stats', index, engine.stats.snapshot() | {
+                "active_imagine_tasks": engine.active_imagine_tasks,
+                "queued": engine.task_queue.qsize(),
+            }))
+
+    reporter = asyncio.create_task(report())
+    try:
+        await engine_task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        reporter.cancel()
+        try:
+            conn.send(('stats', index, engine.stats.snapshot()))
+        except OSError:
+            pass
+
+
+class Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process: multiprocessing.Process | None = None
+        self.conn: Connection | None = None
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restart_at: float | None = None
+        self.stats: dict = {}
+        # Counters of previous incarnations of this worker
+        self.retired = {"chains_started": 0, "chains_completed": 0, "chains_failed": 0}
+
+    def total(self, key: str) -> int:
+        return self.retired[key] + self.stats.get(key, 0)
+
+
+class ForwardingWebhookServer(WebhookServer):
+    """
+    Receives GoAPI callbacks in the coordinator and broadcasts them to workers,
+    the one that polls the task resolves it, others keep it as an early result
+    """
+
+    def __init__(self, coordinator: 'Coordinator'):
+        super().__init__(coordinator.config_path)
+        self.coordinator = coordinator
+
+    def deliver(self, task_id: str, status: TaskStatusEnum, result: TaskResult) -> None:
+        self.coordinator.broadcast(('webhook', task_id, status, result))
+
+
+class Coordinator:
+    """
+    Runs `sharding.workers` engine processes, each with its own event loop and share of the limits.
+
+    Talks to them over pipes only: collects stats, forwards webhooks, restarts crashed ones
+    """
+    logger = reg_logger('[bold yellow]\[COORDINATOR][/bold yellow]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.context = multiprocessing.get_context('spawn')
+        self.workers: list[Worker] = []
+        self.webhook: ForwardingWebhookServer | None = None
+        self.stopping = False
+
+    @property
+    def config(self) -> ShardingConfig:
+        return get_config(self.config_path).sharding
+
+    @property
+    def count(self) -> int:
+        return len(self.workers)
+
+    def spawn(self, worker: Worker) -> None:
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=run_worker, name=f'engine-{worker.index}',
+                                       args=(self.config_path, worker.index, self.count, child_conn))
+        process.start()
+        child_conn.close()
+
+        worker.process, worker.conn = process, parent_conn
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        self.logger.info(f"[cyan]Worker {worker.index} started (pid {process.pid})")
+
+    def broadcast(self, message: tuple) -> None:
+        for worker in self.workers:
+            if worker.conn and worker.process and worker.process.is_alive():
+                try:
+                    worker.conn.send(message)
+                except OSError:
+                    pass
+
+    def drain(self, worker: Worker) -> None:
+        try:
+            while worker.conn.poll():
+                self.on_message(worker.conn.recv())
+        except (EOFError, OSError):
+            pass
+
+    def on_exit(self, worker: Worker) -> None:
+        exitcode = worker.process.exitcode
+        self.drain(worker)
+        worker.conn.close()
+        worker.process = worker.conn = None
+        for key in worker.retired:
+            worker.retired[key] += worker.stats.get(key, 0)
+        worker.stats = {}
+        if self.stopping:
+            return
+
+        # A worker that ran for a while is considered healthy again
+        if time.monotonic() - worker.started_at > self.config.restart_max_delay_seconds:
+            worker.crashes = 0
+        delay = min(self.config.restart_delay_seconds * 2 ** worker.crashes, self.config.restart_max_delay_seconds)
+        worker.crashes += 1
+        worker.restart_at = time.monotonic() + delay
+        self.logger.error(f"[bold red]Worker {worker.index} exited with code {exitcode}, restarting in {delay:.1f}s")
+
+    def on_message(self, message: tuple) -> None:
+        match message:
+            case ('stats', index, stats):
+                self.workers[index].stats = stats
+
+    async def supervise(self) -> None:
+        last_report = time.monotonic()
+        while True:
+            waitables = {}
+            for worker in self.workers:
+                if worker.process:
+                    waitables[worker.conn] = worker
+                    waitables[worker.process.sentinel] = worker
+            ready = await asyncio.to_thread(connection.wait, list(waitables), 1) if waitables else []
+
+            for item in ready:
+                worker = waitables[item]
+                if item is worker.conn:
+                    self.drain(worker)
+            for item in ready:
+                worker = waitables[item]
+                if worker.process and item == worker.process.sentinel:
+                    worker.process.join()
+                    self.on_exit(worker)
+
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.restart_at is not None and now >= worker.restart_at:
+                    self.spawn(worker)
+
+            if now - last_report >= self.config.stats_interval_seconds:
+                last_report = now
+                self.report()
+
+    def report(self) -> None:
+        started = sum(w.total('chains_started') for w in self.workers)
+        completed = sum(w.total('chains_completed') for w in self.workers)
+        failed = sum(w.total('chains_failed') for w in self.workers)
+        active = sum(w.stats.get('active_imagine_tasks', 0) for w in self.workers)
+        alive = sum(1 for w in self.workers if w.process)
+        p95 = [w.stats['latency']['p95'] for w in self.workers if w.stats.get('latency', {}).get('p95') is not None]
+        self.logger.info(f"[bold cyan]{alive}/{self.count} workers, chains started={started} completed={completed} "
+                         f"failed={failed}, active imagines={active}"
+                         + (f", worst p95={max(p95):.1f}s" if p95 else ""))
+
+    async def stop(self) -> None:
+        self.stopping = True
+        self.broadcast(('stop',))
+        deadline = time.monotonic() + self.config.stop_timeout_seconds
+        for worker in self.workers:
+            if worker.process:
+                await asyncio.to_thread(worker.process.join, max(deadline - time.monotonic(), 0))
+                if worker.process.is_alive():
+                    self.logger.warning(f"[yellow]Worker {worker.index} did not stop in time, terminating")
+                    worker.process.terminate()
+                    await asyncio.to_thread(worker.process.join)
+                self.on_exit(worker)
+
+    async def run(self) -> None:
+        config = get_config(self.config_path)
+        count = min(config.sharding.workers, config.max_tasks)
+        self.logger.info(f"[bold cyan]Starting {count} workers for max_tasks={config.max_tasks}")
+        self.workers = [Worker(index) for index in range(count)]
+
+        if config.webhook.enabled:
+            self.webhook = ForwardingWebhookServer(self)
+            await self.webhook.start()
+
+        try:
+            for worker in self.workers:
+                self.spawn(worker)
+            await self.supervise()
+        finally:
+            await self.stop()
+            if self.webhook:
+                await self.webhook.stop()
+            self.report()
@@ -1,129 +1,222 @@
 import asyncio
-import json
-import os
+import logging
+import time
+from typing import Awaitable, Callable
 
 import aiohttp
-import yaml
-from aiohttp import ClientSession
-from dotenv import load_dotenv
 
+import codec
+from config import GoAPIConfig, get_config
 from enums import TaskStatusEnum
+from http_client import HttpClient
 from logger import reg_logger
+from metrics import metrics
+from retry import get_retry_policy
+from tracing import get_tracer
+from upstreams import get_upstreams
+
+
+class TaskResult:
+    """
+    Fields of a GoAPI task response the engine uses. The rest of the response is dropped right after decoding
+    """
+    __slots__ = ('task_id', 'status', 'progress', 'actions', 'image_url', 'error')
+
+    def __init__(self, task_id: str | None = None, status: str | None = None, progress: float | None = None,
+                 actions: list[str] | None = None, image_url: str | None = None, error: str | None = None):
+        self.task_id = task_id
+        self.status = status
+        self.progress = progress
+        self.actions = actions or []
+        self.image_url = image_url
+        self.error = error
+
+    @classmethod
+    def parse(cls, data) -> 'TaskResult':
+        """
+        :param data: Decoded task response (v2 format), anything else gives an empty result
+        """
+        if not isinstance(data, dict):
+            return cls()
+        result = data.get('task_result')
+        if not isinstance(result, dict):
+            result = {}
+        errors = result.get('error_messages')
+        return cls(task_id=data.get('task_id'), status=data.get('status'), progress=result.get('task_progress'),
+                   actions=result.get('actions'), image_url=result.get('image_url'),
+                   error='; '.join(map(str, errors)) if errors else data.get('message'))
+
+    def __repr__(self):
+        return (f"TaskResult(task_id={self.task_id!r}, status={self.status!r}, progress={self.progress!r}, "
+                f"actions={self.actions!r}, error={self.error!r})")
 
 
 class GoAPI:
     logger = reg_logger('[bold magenta]\[GoAPI][/bold magenta]')
+    # Replaces HTTP when set: async (method, url, payload) -> (response_json, status). Used by simulate.py
+    transport: Callable[[str, str, dict | None], Awaitable[tuple[dict, int]]] | None = None
+
     def __init__(self, config_path='config.yml'):
         self.config_path = config_path
         self.headers = {
-            "X-API-KEY": self.token
+            "X-API-KEY": self.token,
+            "Content-Type": "application/json",
         }
 
     @property
-    def config(self) -> dict:
-        with open(self.config_path) as f:
-            config = yaml.safe_load(f)
-            return config['goapi']
+    def config(self) -> GoAPIConfig:
+        return get_config(self.config_path).goapi
 
     @property
     def process_mode(self) -> str:
-        return self.config['process_mode']
+        return self.config.process_mode
 
     @property
     def timeout(self):
-        return self.config['http_timeout_seconds']
+        return self.config.http_timeout_seconds
 
     @property
     def token(self) -> str:
-        load_dotenv()
-        return os.environ.get('GOAPI_TOKEN')
+        return self.config.token
 
-    async def retry_timeout(self, retries: int = 3, *args, **kwargs):
-        try:
-            resp = await self.request(**kwargs)
+    def endpoint_name(self, url: str) -> str:
+        for name, endpoint_url in self.config.urls.items():
+            if endpoint_url == url:
+                return name
+        return 'other'
 
-            if retries != 3:
-                self.logger.info(f"[green]Succeeded after {3 - retries} retries")
-
-            return resp
-        except asyncio.TimeoutError as e:
-            self.logger.warning(f"Timeouted. Retrying {retries - 1} more times")
-            if retries < 1:
-                raise e
-            return await self.retry_timeout(retries - 1, **kwargs)
-
-    async def request(self, url, payload: dict = None, method='GET', **kwargs) -> tuple[dict, int]:
+    async def request(self, url, payload: dict = None, method='GET', **kwargs) -> tuple[TaskResult, int]:
         """
-        Request url
+        Request url, retrying transient failures according to `goapi.retry`
 
         :param url: Full request url
         :param payload: Optional data (auto json converted)
         :param method: HTTP method ('get', 'post', 'put', 'delete', etc)
         :raises ClientResponseError If status is not 200
-        :returns: Tuple of [response_json, status]
+        :returns: Tuple of [task_result, status]
+        """
+        endpoint = self.endpoint_name(url)
+        # Everything except fetch creates a paid task
+        idempotent = endpoint == 'fetch'
+        return await get_retry_policy(self.config_path).call(
+            endpoint, lambda: self.routed_attempt(url, endpoint, payload, method, **kwargs), idempotent)
+
+    async def routed_attempt(self, url, endpoint: str, payload: dict = None, method='GET',
+                             **kwargs) -> tuple[TaskResult, int]:
+        """
+        Attempt on the upstream selected for this request, when several `base_urls` are configured
         """
+        upstreams = get_upstreams(self.config_path)
+        routed_url, upstream = upstreams.route(url, payload)
+        if upstream is None:
+            return await self.attempt(url, endpoint, payload, method, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            result = await self.attempt(routed_url, endpoint, payload, method, **kwargs)
+        except Exception as e:
+            reason, _, _ = get_retry_policy(self.config_path).classify(e, idempotent=True)
+            upstreams.observe(upstream, loop.time() - started, degraded=reason is not None)
+            raise
+        upstreams.observe(upstream, loop.time() - started, degraded=False)
+
+        task_id = result[0].task_id
+        if endpoint != 'fetch' and task_id:
+            upstreams.bind(task_id, upstream)
+        return result
+
+    async def attempt(self, url, endpoint: str, payload: dict = None, method='GET',
+                      **kwargs) -> tuple[TaskResult, int]:
+        with get_tracer(self.config_path).span('http', endpoint=endpoint):
+            if not metrics.enabled:
+                return await self.send(url, payload, method, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return await self.send(url, payload, method, **kwargs)
+            except asyncio.TimeoutError:
+                metrics.timeouts.inc(endpoint=endpoint)
+                raise
+            except aiohttp.ClientResponseError as e:
+                metrics.request_failures.inc(endpoint=endpoint, reason=str(e.status))
+                raise
+            except aiohttp.ClientError as e:
+                metrics.request_failures.inc(endpoint=endpoint, reason=type(e).__name__)
+                raise
+            finally:
+                metrics.request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+
+    async def send(self, url, payload: dict = None, method='GET', **kwargs) -> tuple[TaskResult, int]:
         method = method.upper()
+        if GoAPI.transport is not None:
+            response_json, status = await GoAPI.transport(method, url, payload)
+            return TaskResult.parse(response_json), status
+
         parsed_args = {}
         if payload:
-            parsed_args['data'] = json.dumps(payload)
-
-        self.logger.debug(f"[bold cyan]Requesting {method} {url} with payload [cyan]{payload}[/cyan]")
-
-        async with ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-            async with session.request(method, url, headers=self.headers, timeout=self.timeout, **parsed_args, **kwargs) as response:
-                response_json = None
-                try:
-                    response_json = await response.json()
-                except Exception:
-                    self.logger.error("[bold red]JSON decode failed"
-                                      f"\nContent: {response.content}"
-                                      f"\nStatus code: {response.status}")
-
-                log = self.logger.debug
+            # Encoded once, aiohttp sends bytes as is
+            parsed_args['data'] = codec.dumps(payload)
+
+        self.logger.debug("[bold cyan]Requesting %s %s with payload [cyan]%s[/cyan]", method, url, payload)
+
+        session = HttpClient.session(self.config_path)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with session.request(method, url, headers=self.headers, timeout=timeout, **parsed_args, **kwargs) as response:
+            body = await response.read()
+            response_json = None
+            try:
+                response_json = codec.loads(body)
+            except ValueError:
+                self.logger.error("[bold red]JSON decode failed"
+                                  f"\nContent: {body.decode(errors='replace')}"
+                                  f"\nStatus code: {response.status}")
+            else:
+                # The body is rendered only when it is going to be logged
                 if not (300 > response.status >= 200):
-                    log = self.logger.error
-                log(f"Response {response.status} JSON: [cyan]{response_json}")
+                    self.logger.error("Response %s JSON: [cyan]%s", response.status, body.decode(errors='replace'))
+                elif self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("Response %s JSON: [cyan]%s", response.status, body.decode(errors='replace'))
 
-                response.raise_for_status()
+            response.raise_for_status()
 
-                return [response_json, response.status]
+            return TaskResult.parse(response_json), response.status
 
-    async def fetch(self, task_id: str) -> tuple[str, dict]:
+    async def fetch(self, task_id: str) -> tuple[TaskStatusEnum, TaskResult]:
         """
         Fetch task progress
 
         :param task_id: Task id to fetch
         :raises ClientResponseError If status is not 200
-        :returns: Tuple of [TaskStatusEnum, goapi_response_json]
+        :returns: Tuple of [TaskStatusEnum, task_result]
         """
 
-        url = self.config['urls']['fetch']
+        if metrics.enabled:
+            metrics.fetches.inc()
+
+        url = self.config.urls['fetch']
         payload = {
             "task_id": task_id
         }
-        response_json, _ = await self.retry_timeout(url=url, method='POST', payload=payload)
+        result, _ = await self.request(url=url, method='POST', payload=payload)
+        return TaskStatusEnum.from_goapi_status(result.status), result
 
-        status = response_json['status']
-        return TaskStatusEnum.from_goapi_status(status), response_json
-
-    async def imagine(self, prompt: str, ar: str) -> tuple[str, dict]:
+    async def imagine(self, prompt: str, ar: str) -> tuple[str | None, TaskResult]:
         """
         Create /imagine
 
         :param prompt: Prompt
         :param ar: Aspect ratio
         :raises ClientResponseError If status is not 200
-        :returns: Tuple of [new_task_id, goapi_response_json]
+        :returns: Tuple of [new_task_id, task_result]
         """
-        url = self.config['urls']['imagine']
+        url = self.config.urls['imagine']
         payload = {
             "prompt": prompt,
             "aspect_ratio": ar,
             "process_mode": self.process_mode,
-            "webhook_endpoint": "",
-            "webhook_secret": ""
-        }
+        } | get_config(self.config_path).webhook.payload()
 
-        response_json, _ = await self.request(url, payload=payload, method='post')
-        return response_json.get('task_id', None), response_json
+        result, _ = await self.request(url, payload=payload, method='post')
+        return result.task_id, result
 
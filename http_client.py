@@ -0,0 +1,83 @@
+import asyncio
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import ClientSession, TCPConnector
+
+from config import GoAPIConfig, get_config
+from logger import reg_logger
+
+
+class HttpClient:
+    """
+    Process-wide pooled HTTP session.
+
+    One long-lived ClientSession with a keep-alive connector is shared by every GoAPI call,
+    so polls reuse already opened TCP+TLS connections instead of handshaking each time.
+    """
+    logger = reg_logger('[bold blue]\[HTTP][/bold blue]')
+    _session: ClientSession | None = None
+
+    @staticmethod
+    def load_config(config_path='config.yml') -> GoAPIConfig:
+        return get_config(config_path).goapi
+
+    @classmethod
+    def session(cls, config_path='config.yml') -> ClientSession:
+        """
+        Get shared session, creating it on first use
+
+        :returns: Shared ClientSession
+        """
+        if cls._session is None or cls._session.closed:
+            cls._session = cls._create_session(cls.load_config(config_path))
+        return cls._session
+
+    @classmethod
+    def _create_session(cls, config: GoAPIConfig) -> ClientSession:
+        connection = config.connection
+        connector = TCPConnector(
+            limit=connection.limit,
+            limit_per_host=connection.limit_per_host,
+            keepalive_timeout=connection.keepalive_timeout_seconds,
+            ttl_dns_cache=connection.dns_cache_ttl_seconds,
+            use_dns_cache=True,
+        )
+        cls.logger.debug(f"[cyan]Created connection pool: limit={connector.limit} "
+                         f"per_host={connector.limit_per_host}")
+        return ClientSession(connector=connector,
+                             timeout=aiohttp.ClientTimeout(total=config.http_timeout_seconds))
+
+    @classmethod
+    async def start(cls, config_path='config.yml') -> None:
+        """
+        Create shared session and pre-warm connections to every configured GoAPI host
+        """
+        config = cls.load_config(config_path)
+        session = cls.session(config_path)
+
+        prewarm = config.connection.prewarm
+        if not prewarm:
+            return
+
+        hosts = {f"{p.scheme}://{p.netloc}/" for p in map(urlsplit, [*config.urls.values(), *config.base_urls])}
+        cls.logger.info(f"[cyan]Pre-warming {prewarm} connections to {len(hosts)} host(s)")
+        await asyncio.gather(*[cls._warm(session, host) for host in hosts for _ in range(prewarm)])
+
+    @classmethod
+    async def _warm(cls, session: ClientSession, url: str) -> None:
+        try:
+            async with session.head(url, allow_redirects=False) as response:
+                await response.read()
+        except Exception as e:
+            cls.logger.warning(f"[yellow]Pre-warm of {url} failed: {e!r}")
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._session is None:
+            return
+
+        if not cls._session.closed:
+            await cls._session.close()
+            cls.logger.info("[cyan]Connection pool closed")
+        cls._session = None
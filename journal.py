@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+from config import JournalConfig, get_config
+from logger import reg_logger
+
+
+class JournalEntry:
+    """
+    Replayed state of one submitted GoAPI task
+    """
+    __slots__ = ('task_id', 'task_type', 'parent', 'chain', 'recursive', 'action', 'actions', 'children_actions',
+                 'closed')
+
+    def __init__(self, task_id: str, task_type: str, parent: str | None, chain: str, recursive: bool,
+                 action: str | None = None):
+        self.task_id = task_id
+        self.task_type = task_type
+        self.parent = parent
+        self.chain = chain
+        self.recursive = recursive
+        # GoAPI action string that created this task, None for imagines
+        self.action = action
+        self.actions: list[str] | None = None
+        self.children_actions: list[str] = []
+        self.closed = False
+
+    @property
+    def is_imagine(self) -> bool:
+        return self.parent is None
+
+    def remaining_actions(self) -> list[str] | None:
+        """
+        Selected actions that were not submitted yet, None if actions were never selected
+        """
+        if self.actions is None:
+            return None
+        submitted = Counter(self.children_actions)
+        remaining = []
+        for action in self.actions:
+            if submitted[action] > 0:
+                submitted[action] -= 1
+            else:
+                remaining.append(action)
+        return remaining
+
+    def records(self) -> list[dict]:
+        records = [{"op": "submitted", "task_id": self.task_id, "task_type": self.task_type, "parent": self.parent,
+                    "chain": self.chain, "recursive": self.recursive, "action": self.action}]
+        if self.actions is not None:
+            records.append({"op": "actions", "task_id": self.task_id, "actions": self.actions})
+        return records
+
+
+class Journal:
+    """
+    Append-only JSONL journal of submitted task_ids, their place in a chain and selected actions.
+
+    Records are buffered and written + fsynced in batches off the event loop.
+    On startup unfinished tasks are replayed so the engine can re-attach to them instead of paying again.
+    """
+    logger = reg_logger('[bold blue]\[JOURNAL][/bold blue]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.buffer: list[str] = []
+        self.flusher: asyncio.Task | None = None
+        self.write_lock = threading.Lock()
+        # A failed write may have left a torn line, the retry starts on a new one
+        self.torn = False
+
+    @property
+    def config(self) -> JournalConfig:
+        return get_config(self.config_path).journal
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    def record(self, op: str, **fields) -> None:
+        if not self.enabled:
+            return
+        self.buffer.append(json.dumps({"op": op, "ts": time.time()} | fields))
+
+    def submitted(self, task_id: str, task_type: str, parent: str | None, chain: str, recursive: bool,
+                  action: str | None = None) -> None:
+        self.record("submitted", task_id=task_id, task_type=task_type, parent=parent, chain=chain,
+                    recursive=recursive, action=action)
+
+    def actions(self, task_id: str, actions: list[str]) -> None:
+        self.record("actions", task_id=task_id, actions=actions)
+
+    def closed(self, task_id: str) -> None:
+        self.record("closed", task_id=task_id)
+
+    def replay(self) -> dict[str, JournalEntry]:
+        entries: dict[str, JournalEntry] = {}
+        if not os.path.exists(self.config.path):
+            return entries
+
+        with open(self.config.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line after a crash
+                    continue
+
+                task_id = record.get('task_id')
+                match record.get('op'):
+                    case 'submitted':
+                        entries[task_id] = JournalEntry(task_id, record['task_type'], record['parent'],
+                                                        record['chain'], record['recursive'], record.get('action'))
+                        parent = entries.get(record['parent'])
+                        if parent:
+                            parent.children_actions.append(record.get('action'))
+                    case 'actions' if task_id in entries and entries[task_id].actions is None:
+                        entries[task_id].actions = record['actions']
+                    case 'closed' if task_id in entries:
+                        entries[task_id].closed = True
+        return entries
+
+    def pending(self) -> list[JournalEntry]:
+        """
+        Unfinished tasks from previous runs. Compacts the journal down to them
+        """
+        if not self.enabled:
+            return []
+
+        entries = self.replay()
+        pending = [e for e in entries.values() if not e.closed]
+        closed_children: dict[str, list[JournalEntry]] = {}
+        for entry in entries.values():
+            if entry.closed and entry.parent:
+                closed_children.setdefault(entry.parent, []).append(entry)
+
+        # Closed children of pending tasks are kept, they tell which selected actions were already submitted
+        tmp_path = self.config.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in pending:
+                for record in entry.records():
+                    f.write(json.dumps(record) + '\n')
+                for child in closed_children.get(entry.task_id, []):
+                    f.write(json.dumps(child.records()[0]) + '\n')
+                    f.write(json.dumps({"op": "closed", "task_id": child.task_id}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.config.path)
+
+        if pending:
+            self.logger.info(f"[bold cyan]Found {len(pending)} unfinished task(s) from previous run")
+        return pending
+
+    def write(self, lines: list[str]) -> None:
+        with self.write_lock, open(self.config.path, 'a') as f:
+            f.write('\n' * self.torn + '\n'.join(lines) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def flush(self) -> None:
+        if not self.buffer:
+            return
+        lines, self.buffer = self.buffer, []
+        try:
+            await asyncio.to_thread(self.write, lines)
+        except OSError:
+            # Kept for the next flush, in front of records added meanwhile
+            self.buffer[:0] = lines
+            self.torn = True
+            raise
+        self.torn = False
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.fsync_interval_seconds)
+            try:
+                await self.flush()
+            except OSError:
+                self.logger.exception("[bold red]Journal write failed")
+
+    def start(self) -> None:
+        if self.enabled and (self.flusher is None or self.flusher.done()):
+            self.flusher = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.flusher:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+            self.flusher = None
+        await self.flush()
+
+
+_journals: dict[str, Journal] = {}
+
+
+def get_journal(config_path: str = 'config.yml') -> Journal:
+    journal = _journals.get(config_path)
+    if journal is None:
+        journal = _journals[config_path] = Journal(config_path)
+    return journal
@@ -1,8 +1,11 @@
-import click
-import yaml
-from rich.logging import RichHandler
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
 import logging
 
+from config import get_config, get_store
+
 logging.getLogger('aiocache').setLevel('INFO')
 logging.getLogger('tortoise').setLevel('INFO')
 logging.getLogger('socketio').setLevel('INFO')
@@ -14,23 +17,6 @@ logging.getLogger('multipart').setLevel('INFO')
 logging.getLogger('telethon').setLevel('INFO')
 logging.getLogger('watchfiles').setLevel('INFO')
 
-with open('config.yml') as f:
-    config = yaml.safe_load(f)
-    level = config.get("log_level", "DEBUG")
-
-logging.basicConfig(
-    level=level,
-    format='',
-    datefmt="[%X]",
-    handlers=[
-        RichHandler(rich_tracebacks=True, tracebacks_suppress=[click], omit_repeated_times=False, markup=True)]
-)
-
-logger = logging.getLogger("rich")
-
-all_loggers = logging.Logger.manager.loggerDict.keys()
-logger.debug(f'[cyan]Loggers: {list(all_loggers)}')
-
 level_to_color = {
     "DEBUG": "cyan",
     "INFO": "green",
@@ -41,24 +27,90 @@ level_to_color = {
 
 
 class Formatter(logging.Formatter):
-    def __init__(self, prefix: str):
-        self.prefix = prefix
-        self.datefmt = "[%X]"
-        self._style = logging.PercentStyle(fmt="")
+    """
+    Renders "{prefix}: {message}". Prefix comes from record fields attached by reg_logger/task_logger
+    """
+
+    def __init__(self):
+        super().__init__(fmt="", datefmt="[%X]")
 
     def format(self, record):
-        levelname = record.levelname
-        color = level_to_color.get(levelname, "white")
-        formatted = "{prefix}: {message}".format(
-            color=color, levelname=levelname, message=record.getMessage(), prefix=self.prefix
-        )
-        return formatted
+        message = record.getMessage()
+
+        task_type = getattr(record, 'task_type', None)
+        if task_type:
+            task_id = getattr(record, 'task_id', None)
+            label = f"{task_id} {task_type}" if task_id else task_type
+            return f"[bold cyan]\\[{label}][/bold cyan]: {message}"
+
+        prefix = getattr(record, 'prefix', None)
+        if prefix:
+            return f"{prefix}: {message}"
+        return message
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread untouched.
+    Message interpolation, markup and tracebacks are rendered there, off the event loop
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener: QueueListener | None = None
+
+
+def setup_logging(config_path: str = 'config.yml') -> None:
+    """
+    Route all logging to a single Rich console handler, fed from a queue by a background thread,
+    at the config's log_level. Called by entry points only: embedding applications keep their own logging
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    import click
+    from rich.logging import RichHandler
+
+    console_handler = RichHandler(rich_tracebacks=True, tracebacks_suppress=[click], omit_repeated_times=False,
+                                  markup=True)
+    console_handler.setFormatter(Formatter())
+
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, console_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logging.basicConfig(level=get_config(config_path).log_level, handlers=[LazyQueueHandler(log_queue)])
+    get_store(config_path).subscribe(on_config_change)
+
+    logger = logging.getLogger("rich")
+    logger.debug('[cyan]Loggers: %s', list(logging.Logger.manager.loggerDict.keys()))
+
+
+_loggers: dict[str, logging.LoggerAdapter] = {}
+task_base_logger = logging.getLogger("rich.task")
+
+
+def reg_logger(prefix) -> logging.LoggerAdapter:
+    """
+    Get logger that prints given prefix. Cached, every call with same prefix returns same object
+    """
+    adapter = _loggers.get(prefix)
+    if adapter is None:
+        adapter = _loggers[prefix] = logging.LoggerAdapter(logging.getLogger("rich.module"), {'prefix': prefix})
+    return adapter
+
 
+def task_logger(task_id: str | None, task_type: str) -> logging.LoggerAdapter:
+    """
+    Lightweight per-task logger. Task context is attached to records as fields, no new Logger/handler
+    """
+    return logging.LoggerAdapter(task_base_logger, {'task_id': task_id, 'task_type': task_type})
 
-def reg_logger(prefix, log_level=level) -> logging.Logger:
-    handler = RichHandler(rich_tracebacks=True, tracebacks_suppress=[click], omit_repeated_times=False, markup=True)
-    handler.setFormatter(Formatter(prefix))
 
-    logger = logging.Logger(prefix, level=log_level)
-    logger.addHandler(handler)
-    return logger
+def on_config_change(old, new):
+    if old.log_level != new.log_level:
+        logging.getLogger().setLevel(new.log_level)
@@ -1,110 +1,444 @@
 import asyncio
+import logging
 import random
-import yaml
-from enums import TaskTypeEnum
-from logger import reg_logger
-from task import Task
+import sys
+import time
+
+from actions import get_registry
+from admission import AdmissionController
+from artifacts import get_artifacts
+from autoscale import Autoscaler
+from budget import get_budget
+from config import Config, get_config, get_store
+from goapi import TaskResult
+from http_client import HttpClient
+from journal import get_journal
+from logger import reg_logger, setup_logging
+from metrics import MetricsServer, metrics
+from poller import get_poller
+from prompts import get_prompt_source
+from retry import get_retry_policy
+from scheduler import get_scheduler
+from semaphore import ResizableSemaphore
+from stats import ChainStats
+from task import Task, get_child_slots, new_chain_slots
+from tracing import get_tracer
+from upstreams import get_upstreams
+from webhook import WebhookServer
+
+
+class ChainResult:
+    """
+    Outcome of a chain queued with ActivityEngine.submit_chain
+    """
+    __slots__ = ('task_id', 'ok', 'seconds')
+
+    def __init__(self, task_id: str | None, ok: bool, seconds: float):
+        # Imagine task id, None if the imagine was never submitted
+        self.task_id = task_id
+        self.ok = ok
+        self.seconds = seconds
+
+    def __repr__(self):
+        return f'ChainResult(task_id={self.task_id!r}, ok={self.ok}, seconds={self.seconds:.1f})'
 
 
 class ActivityEngine:
     logger = reg_logger('[bold yellow]\[ENGINE][/bold yellow]')
 
-    def __init__(self, config_path="config.yml"):
+    def __init__(self, config_path="config.yml", serve_webhook: bool = True):
         self.config_path = config_path
-        self.active_imagine_tasks = 0
-        self.task_queue = asyncio.Queue()
-        self.semaphore = asyncio.Semaphore(self.max_tasks)
+        # Sharded workers get callbacks forwarded by the coordinator instead of listening themselves
+        self.serve_webhook = serve_webhook
+        self.config_store = get_store(config_path)
+        admission = self.config.admission
+        self.admission = AdmissionController(self.max_tasks, admission.imagines_per_minute, admission.burst)
+        self.task_queue = asyncio.Queue(maxsize=admission.queue_size or self.max_tasks)
+        self.semaphore = ResizableSemaphore(self.max_tasks)
+        self.consumer_tasks: set[asyncio.Task] = set()
+        self.consumers_to_stop = 0
+        self.resumed_tasks: set[asyncio.Task] = set()
+        self.producer_task: asyncio.Task | None = None
+        self.watcher: asyncio.Task | None = None
+        # Chains queued by submit_chain -> their results
+        self.chain_waiters: dict[Task, asyncio.Future] = {}
+        # submit_chain callers waiting for an admission credit
+        self.admission_waiters: set[asyncio.Task] = set()
+        self.started = False
+        self.stopping = False
+        self.webhook: WebhookServer | None = None
+        self.metrics_server: MetricsServer | None = None
+        self.stats = ChainStats()
+        self.autoscaler = Autoscaler(self)
 
     @property
-    def config(self) -> dict:
-        with open(self.config_path) as f:
-            config = yaml.safe_load(f)
-            return config
+    def config(self) -> Config:
+        return self.config_store.snapshot
+
+    @property
+    def active_imagine_tasks(self) -> int:
+        return self.admission.in_use
 
     @property
     def max_tasks(self) -> int:
-        return self.config["max_tasks"]
+        return self.config.max_tasks
 
     @property
     def consumers(self) -> int:
-        return self.config["consumers"]
+        return self.config.consumers
 
     def randomize_use_buttons(self) -> int:
-        rnge: list[int] = self.config['task']['use_buttons_range']
+        rnge = self.config.task.use_buttons_range
         return random.randrange(rnge[0], rnge[1])
 
-    async def run(self):
+    def on_config_change(self, old: Config, new: Config):
+        self.logger.info("[bold cyan]Config reloaded")
+
+        if old.max_tasks != new.max_tasks:
+            self.logger.info(f"[yellow]max_tasks {old.max_tasks} -> {new.max_tasks}")
+            self.semaphore.resize(new.max_tasks)
+            self.admission.resize(new.max_tasks)
+
+        if old.task.child_concurrency != new.task.child_concurrency:
+            get_child_slots(self.config_path).resize(new.task.child_concurrency or sys.maxsize)
+
+        if old.artifacts.concurrency != new.artifacts.concurrency:
+            get_artifacts(self.config_path).slots.resize(max(new.artifacts.concurrency, 1))
+
+        if old.goapi.retry != new.goapi.retry:
+            get_retry_policy(self.config_path).reconfigure()
+
+        if old.admission != new.admission:
+            self.admission.bucket.configure(new.admission.imagines_per_minute, new.admission.burst)
+
+        if old.consumers != new.consumers:
+            self.logger.info(f"[yellow]consumers {old.consumers} -> {new.consumers}")
+            self.scale_consumers(new.consumers)
+
+    def apply_concurrency(self, max_tasks: int):
+        """
+        Resize chain concurrency at runtime, consumers keep their configured proportion to max_tasks
+        """
+        self.semaphore.resize(max_tasks)
+        self.admission.resize(max_tasks)
+        self.scale_consumers(max(round(max_tasks * self.consumers / self.max_tasks), 1))
+
+    def scale_consumers(self, target: int):
+        running = len(self.consumer_tasks) - self.consumers_to_stop
+        if target > running:
+            cancel_stops = min(self.consumers_to_stop, target - running)
+            self.consumers_to_stop -= cancel_stops
+            for _ in range(target - running - cancel_stops):
+                self.spawn_consumer()
+        elif target < running:
+            # Consumers exit after their current chain, never in the middle of it
+            self.consumers_to_stop += running - target
+
+    def spawn_consumer(self):
+        consumer = asyncio.create_task(self.consumer())
+        self.consumer_tasks.add(consumer)
+        consumer.add_done_callback(self.consumer_tasks.discard)
+
+    async def start(self, produce: bool = True):
+        """
+        Start background services and consumers. Returns once the engine is running
+
+        :param produce: Keep max_tasks imagines in flight on our own. Without it chains come from submit_chain only
+        """
+        if self.started:
+            raise RuntimeError("Engine already started")
+        self.started = True
         self.logger.info("[bold cyan]Engine starting")
+        try:
+            await HttpClient.start(self.config_path)
+            # Indexing a large prompt file takes a while, do it once before the first imagine and off the loop
+            await asyncio.to_thread(get_prompt_source, self.config_path)
+            if self.config.webhook.enabled and self.serve_webhook:
+                self.webhook = WebhookServer(self.config_path)
+                await self.webhook.start()
+            elif self.config.webhook.enabled:
+                get_poller(self.config_path).fallback_interval = self.config.webhook.fallback_poll_seconds
+            if self.config.metrics.enabled:
+                self.register_gauges()
+                self.metrics_server = MetricsServer(self.config_path, status=self.snapshot)
+                await self.metrics_server.start()
 
-        consumers = [asyncio.create_task(self.consumer()) for _ in range(self.consumers)]
-        consumers.append(asyncio.create_task(self.producer()))
-        await asyncio.gather(*consumers)
+            get_journal(self.config_path).start()
+            get_tracer(self.config_path).start()
+            self.autoscaler.start()
 
-    async def producer(self):
-        self.logger.info("[bold cyan]Producer starting")
+            self.config_store.subscribe(self.on_config_change)
+            self.watcher = asyncio.create_task(self.config_store.watch())
+            self.scale_consumers(self.consumers)
+            await self.resume()
+            if produce:
+                self.producer_task = asyncio.create_task(self.producer())
+        except BaseException:
+            await self.stop(drain=False)
+            raise
 
-        while True:
-            if self.active_imagine_tasks >= self.max_tasks:
-                await asyncio.sleep(1)
+    async def stop(self, drain: bool = True, timeout: float | None = None):
+        """
+        Stop the engine
+
+        :param drain: Stop starting new chains and let queued and running ones finish first
+        :param timeout: Seconds to wait for the drain, unfinished chains are then cancelled
+            (and picked up from the journal by the next run)
+        """
+        if not self.started:
+            return
+
+        self.stopping = True
+        for waiter in self.admission_waiters:
+            waiter.cancel()
+        if self.producer_task:
+            self.producer_task.cancel()
+            await asyncio.gather(self.producer_task, return_exceptions=True)
+            self.producer_task = None
+        if drain:
+            self.logger.info("[bold cyan]Draining %d queued and %d running chain(s)",
+                             self.task_queue.qsize(), self.semaphore.in_use)
+            queue_done = asyncio.create_task(self.task_queue.join())
+            _, pending = await asyncio.wait([queue_done, *self.resumed_tasks], timeout=timeout)
+            if pending:
+                self.logger.warning(f"[yellow]Drain timed out, cancelling {self.semaphore.in_use} chain(s)")
+            queue_done.cancel()
+
+        if self.watcher:
+            self.watcher.cancel()
+            self.watcher = None
+        await self.autoscaler.stop()
+        self.config_store.unsubscribe(self.on_config_change)
+        workers = [*self.consumer_tasks, *self.resumed_tasks]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self.consumers_to_stop = 0
+        for waiter in self.chain_waiters.values():
+            waiter.cancel()
+        self.chain_waiters.clear()
+        await get_journal(self.config_path).stop()
+        await get_tracer(self.config_path).stop()
+        if self.webhook:
+            await self.webhook.stop()
+            self.webhook = None
+        if self.metrics_server:
+            await self.metrics_server.stop()
+            self.metrics_server = None
+        await get_poller(self.config_path).stop()
+        await get_artifacts(self.config_path).stop()
+        await get_budget(self.config_path).stop()
+        await get_upstreams(self.config_path).stop()
+        await HttpClient.close()
+        self.started = False
+        self.stopping = False
+        self.logger.info("[bold cyan]Engine stopped")
+
+    async def run(self):
+        """
+        Run until cancelled
+        """
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop(drain=False)
+
+    async def submit_chain(self) -> ChainResult:
+        """
+        Run one imagine chain. Waits for an admission credit, like the producer does.
+        Cancelling the caller doesn't stop the chain, only the wait for it
+
+        :returns: ChainResult once the chain finishes
+        :raises CancelledError: if the engine stops before the chain finishes
+        """
+        if not self.started or self.stopping:
+            raise RuntimeError("Engine is not started")
+        admitted = asyncio.create_task(self.admission.admit())
+        self.admission_waiters.add(admitted)
+        try:
+            await admitted
+        except asyncio.CancelledError:
+            # The caller was cancelled just as the credit was granted
+            if admitted.done() and not admitted.cancelled() and admitted.exception() is None:
+                self.admission.release()
+            raise
+        finally:
+            self.admission_waiters.discard(admitted)
+        if self.stopping or not self.started:
+            self.admission.release()
+            raise asyncio.CancelledError()
+        task = Task(config_path=self.config_path, task_type="Imagine")
+        result = asyncio.get_running_loop().create_future()
+        self.chain_waiters[task] = result
+        try:
+            await self.task_queue.put(task)
+        except BaseException:
+            self.chain_waiters.pop(task, None)
+            self.admission.release()
+            raise
+        return await asyncio.shield(result)
+
+    def snapshot(self) -> dict:
+        """
+        Chain counters and latency plus current load
+        """
+        return self.stats.snapshot() | {
+            "queued": self.task_queue.qsize(),
+            "imagines_in_flight": self.active_imagine_tasks,
+            "chains_running": self.semaphore.in_use,
+            "max_tasks": self.semaphore.limit,
+            "consumers": len(self.consumer_tasks) - self.consumers_to_stop,
+        }
+
+    def register_gauges(self):
+        poller = get_poller(self.config_path)
+        metrics.gauge('task_queue_depth', 'Imagines waiting for a consumer', self.task_queue.qsize)
+        metrics.gauge('active_imagine_tasks', 'Imagines holding an admission credit', lambda: self.active_imagine_tasks)
+        metrics.gauge('semaphore_in_use', 'Chains holding the engine semaphore', lambda: self.semaphore.in_use)
+        metrics.gauge('semaphore_limit', 'Engine semaphore size', lambda: self.semaphore.limit)
+        metrics.gauge('poll_in_flight', 'Task ids tracked by the poller', lambda: poller.in_flight)
+        scheduler = get_scheduler(self.config_path)
+        metrics.gauge('scheduler_slots_in_use', 'GoAPI tasks holding a scheduler slot', lambda: scheduler.in_use)
+        metrics.gauge('scheduler_waiting', 'Submissions waiting for a scheduler slot', lambda: scheduler.waiting)
+
+    async def resume(self):
+        """
+        Re-attach to tasks left unfinished by a previous run.
+        Imagines go through the queue like new ones, child actions are finished in background
+        """
+        chain_slots: dict[str, asyncio.Semaphore] = {}
+        for entry in get_journal(self.config_path).pending():
+            task = Task.from_journal(entry, self.config_path)
+            if entry.is_imagine:
+                await self.admission.admit()
+                try:
+                    await self.task_queue.put(task)
+                except BaseException:
+                    self.admission.release()
+                    raise
                 continue
 
-            create_tasks = self.max_tasks - self.active_imagine_tasks
-            self.logger.info(f"[yellow]Queue not full. Creating {create_tasks} tasks")
+            if entry.chain not in chain_slots:
+                chain_slots[entry.chain] = new_chain_slots(self.config_path)
+            resumed = asyncio.create_task(self.resume_child(task, chain_slots[entry.chain]))
+            self.resumed_tasks.add(resumed)
+            resumed.add_done_callback(self.resumed_tasks.discard)
 
-            for _ in range(create_tasks):
-                new_task = Task(task_type="Imagine")
-                self.active_imagine_tasks += 1
+    async def resume_child(self, task: Task, chain_slots: asyncio.Semaphore):
+        try:
+            async with chain_slots, get_child_slots(self.config_path):
+                await task.take_slot()
+                finished_task_response = await task.poll_child()
+            await task.continue_chain(finished_task_response, chain_slots)
+        except Exception:
+            self.logger.exception(f"[bold red]Resumed task {task.task_id} failed!")
+
+    async def producer(self):
+        self.logger.info("[bold cyan]Producer starting")
+
+        while True:
+            # Blocks until an imagine finishes or fails and gives its credit back
+            await self.admission.admit()
+            new_task = Task(config_path=self.config_path, task_type="Imagine")
+            try:
                 await self.task_queue.put(new_task)
+            except BaseException:
+                self.admission.release()
+                raise
 
-            self.logger.info(f"[bold green]Created {create_tasks} tasks")
+            self.logger.debug("[yellow]Created task (%d/%d in flight)", self.active_imagine_tasks, self.admission.limit)
 
     async def consumer(self):
         while True:
+            if self.consumers_to_stop > 0:
+                self.consumers_to_stop -= 1
+                return
+
             task = await self.task_queue.get()
             await self.watch_task(task)
             self.task_queue.task_done()
 
     async def watch_task(self, task: Task):
-        try:
-            async with self.semaphore:
-                self.logger.info("[cyan]Watching task")
+        tracer = get_tracer(self.config_path)
+        with tracer.span('chain', root=True, start=task.created) as span:
+            tracer.record('queue_wait', task.created, time.time())
+            started, ok = self.stats.chain_started(), False
+            credit_held = True
+            try:
+                async with tracer.wait('semaphore_wait', self.semaphore):
+                    self.logger.info("[cyan]Watching task")
 
-                async with task as imagine:
-                    imagine: Task
-                    imagine_response: dict = await imagine.start_polling()
-                    self.logger.info("[bold green]Imagine finished. Moving queue")
-                    self.active_imagine_tasks -= 1
+                    async with task as imagine:
+                        imagine: Task
+                        span.set(chain=imagine.task_id)
+                        imagine_response: TaskResult = await imagine.start_polling()
+                        self.logger.info("[bold green]Imagine finished. Moving queue")
+                        self.admission.release()
+                        credit_held = False
 
-                    self.logger.info("[cyan]Proceeding to button actions")
-                    actions_available = imagine_response.get('task_result', {}).get('actions')
-                    if not actions_available:
-                        self.logger.error(f"[bold red]Task {imagine.task_id} error! No actions available!")
-                        return
+                        self.logger.info("[cyan]Proceeding to button actions")
+                        if imagine.resume_actions is not None:
+                            selected = imagine.resume_actions
+                            self.logger.info("Resuming %d remaining action(s)", len(selected))
+                        else:
+                            actions_available = imagine_response.actions
+                            if not actions_available:
+                                self.logger.error(f"[bold red]Task {imagine.task_id} error! No actions available!")
+                                return
 
-                    actions_available = [TaskTypeEnum.from_goapi_action(i) for i in actions_available]
-                    self.logger.info(f"Available actions: {actions_available}")
+                            self.logger.info("Available actions: %s", actions_available)
+                            budget = get_budget(self.config_path)
+                            use_buttons = budget.buttons(self.randomize_use_buttons())
+                            self.logger.info("Using %d buttons", use_buttons)
+                            selected = get_registry(self.config_path).select(actions_available, use_buttons,
+                                                                             cost=budget.cost if budget.frugal else None)
+                            get_journal(self.config_path).actions(imagine.task_id, [i.action for i in selected])
 
-                    selected = []
-                    use_buttons = self.randomize_use_buttons()
-                    self.logger.info(f"Using {use_buttons} buttons")
-                    for _ in range(use_buttons):
-                        rnd = random.choice(actions_available)
-                        actions_available.pop(actions_available.index(rnd))
-                        selected.append(rnd)
+                        if self.logger.isEnabledFor(logging.INFO):
+                            self.logger.info("Selected actions: %s", [i.action for i in selected])
+                        await imagine.complete_actions(do_actions=selected)
 
-                    self.logger.info(f"Selected actions: {[i.value for i in selected]}")
-                    await imagine.complete_actions(do_actions=selected)
+                    self.logger.info("Chain completed")
+                    ok = True
+                    span.set(ok=True)
+            except Exception as ce:
+                self.logger.exception("[bold red]Global chain exception!")
+            except asyncio.CancelledError:
+                # Shutdown, neither completed nor failed
+                started = None
+                raise
+            finally:
+                if credit_held:
+                    # Imagine failed to submit or complete
+                    self.admission.release()
+                waiter = self.chain_waiters.pop(task, None)
+                if waiter is not None and not waiter.done():
+                    if started is None:
+                        waiter.cancel()
+                    else:
+                        waiter.set_result(ChainResult(task.task_id, ok, self.stats.clock() - started))
+                if started is not None:
+                    if task.task_id:
+                        get_journal(self.config_path).closed(task.task_id)
+                    self.stats.chain_finished(started, ok)
+                    if metrics.enabled:
+                        metrics.chains.inc(result='completed' if ok else 'failed')
+                        metrics.chain_seconds.observe(self.stats.clock() - started)
 
-                self.logger.info("Chain completed")
-        except Exception as ce:
-            self.logger.exception("[bold red]Global chain exception!")
 
+async def main(config_path: str = 'config.yml'):
+    if get_config(config_path).sharding.workers > 1:
+        from coordinator import Coordinator
+        await Coordinator(config_path).run()
+        return
 
-async def main():
-    engine = ActivityEngine()
+    engine = ActivityEngine(config_path)
 
     # Blocking main thread
     await engine.run()
 
 
-asyncio.run(main())
+if __name__ == '__main__':
+    setup_logging()
+    asyncio.run(main())
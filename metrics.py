@@ -0,0 +1,180 @@
+import bisect
+from typing import Callable
+
+from aiohttp import web
+
+from config import MetricsConfig, get_config
+from logger import reg_logger
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300, 600)
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(n, '') for n in self.label_names)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, _labels(self.label_names, key), value
+
+
+class Gauge:
+    """
+    Read at scrape time from a callback, costs nothing between scrapes
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, doc: str, read: Callable[[], float]):
+        self.name = name
+        self.doc = doc
+        self.read = read
+
+    def samples(self):
+        yield self.name, '', self.read()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(n, '') for n in self.label_names)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                labels = dict(zip(self.label_names, key)) | {'le': bound}
+                yield f'{self.name}_bucket', _labels(tuple(labels), tuple(labels.values())), cumulative
+            yield f'{self.name}_sum', _labels(self.label_names, key), total
+            yield f'{self.name}_count', _labels(self.label_names, key), cumulative
+
+
+class Metrics:
+    """
+    Process-wide metrics registry.
+    Instrumentation points check `metrics.enabled` first, so disabled metrics cost one attribute lookup
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.registry: dict[str, Counter | Gauge | Histogram] = {}
+
+        self.request_seconds = self.add(Histogram(
+            'goapi_request_seconds', 'GoAPI HTTP request latency', ('endpoint',)))
+        self.task_completion_seconds = self.add(Histogram(
+            'task_completion_seconds', 'Time from polling start to task completion', ('task_type',)))
+        self.chain_seconds = self.add(Histogram(
+            'chain_seconds', 'Whole chain duration in watch_task', ()))
+        self.fetches = self.add(Counter(
+            'goapi_fetch_total', 'GoAPI fetch calls'))
+        self.request_failures = self.add(Counter(
+            'goapi_request_failures_total', 'GoAPI requests that raised or returned non-2xx', ('endpoint', 'reason')))
+        self.timeouts = self.add(Counter(
+            'goapi_timeouts_total', 'GoAPI requests that timed out', ('endpoint',)))
+        self.tasks_failed = self.add(Counter(
+            'task_failed_total', 'TaskFailedException raised by start_polling', ('task_type',)))
+        self.chains = self.add(Counter(
+            'chains_total', 'Finished chains', ('result',)))
+        self.retries = self.add(Counter(
+            'goapi_retries_total', 'GoAPI requests retried after a transient failure', ('endpoint', 'reason')))
+        self.breaker_opened = self.add(Counter(
+            'goapi_breaker_opened_total', 'Times the circuit breaker paused submissions'))
+        self.upstream_requests = self.add(Counter(
+            'goapi_upstream_requests_total', 'GoAPI attempts per upstream base url', ('upstream', 'result')))
+        self.upstream_ejections = self.add(Counter(
+            'goapi_upstream_ejections_total', 'Times an upstream was taken out of rotation', ('upstream',)))
+        self.artifacts = self.add(Counter(
+            'artifacts_total', 'Result images handled by the artifact stage', ('result',)))
+        self.artifact_bytes = self.add(Counter(
+            'artifact_bytes_total', 'Downloaded result image bytes'))
+        self.credits_spent = self.add(Counter(
+            'credits_spent_total', 'Credits charged for submissions', ('task_type',)))
+        self.credits_refunded = self.add(Counter(
+            'credits_refunded_total', 'Credits of submissions that failed to be created', ('task_type',)))
+
+    def add(self, metric):
+        self.registry[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, doc: str, read: Callable[[], float]) -> None:
+        self.add(Gauge(name, doc, read))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.registry.values():
+            lines.append(f'# HELP {metric.name} {metric.doc}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class MetricsServer:
+    logger = reg_logger('[bold blue]\[METRICS][/bold blue]')
+
+    def __init__(self, config_path='config.yml', status: Callable[[], dict] | None = None):
+        self.config_path = config_path
+        # Served as JSON on /status, e.g. ActivityEngine.snapshot
+        self.status = status
+        self.runner: web.AppRunner | None = None
+
+    @property
+    def config(self) -> MetricsConfig:
+        return get_config(self.config_path).metrics
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def handle_status(self, request: web.Request) -> web.Response:
+        return web.json_response(self.status())
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get(self.config.path, self.handle)
+        if self.status:
+            app.router.add_get('/status', self.handle_status)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.config.host, self.config.port).start()
+        metrics.enabled = True
+        self.logger.info(f"[bold green]Serving metrics on {self.config.host}:{self.config.port}{self.config.path}")
+
+    async def stop(self) -> None:
+        metrics.enabled = False
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
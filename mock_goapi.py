@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from typing import Callable, Mapping
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+
+from config import MockConfig, get_config
+from logger import reg_logger, setup_logging
+
+GRID_ACTIONS = [
+    'upscale1', 'upscale2', 'upscale3', 'upscale4',
+    'variation1', 'variation2', 'variation3', 'variation4',
+    'reroll',
+]
+UPSCALED_ACTIONS = [
+    'high_variation', 'low_variation',
+    'outpaint_2x', 'outpaint_1.5x', 'outpaint_custom',
+    'pan_left', 'pan_right', 'pan_up', 'pan_down',
+]
+
+
+def sample(spec: Mapping | float, rng: random.Random) -> float:
+    """
+    Draw value from distribution spec
+
+    :param spec: Number (fixed), {dist: uniform, min, max} or {dist: lognormal, median, sigma}
+    """
+    if not isinstance(spec, Mapping):
+        return float(spec)
+
+    match spec.get('dist'):
+        case 'uniform':
+            return rng.uniform(spec['min'], spec['max'])
+        case 'lognormal':
+            return rng.lognormvariate(math.log(spec['median']), spec['sigma'])
+        case 'exponential':
+            return rng.expovariate(1 / spec['mean'])
+        case _:
+            raise ValueError(f"Unknown distribution {spec}")
+
+
+class MockTask:
+    __slots__ = ('task_id', 'task_type', 'created_at', 'pending', 'duration', 'fails',
+                 'webhook_endpoint', 'webhook_secret')
+
+    def __init__(self, task_type: str, created_at: float, pending: float, duration: float, fails: bool,
+                 webhook_endpoint: str = '', webhook_secret: str = ''):
+        self.task_id = str(uuid.uuid4())
+        self.task_type = task_type
+        self.created_at = created_at
+        self.pending = pending
+        self.duration = duration
+        self.fails = fails
+        self.webhook_endpoint = webhook_endpoint
+        self.webhook_secret = webhook_secret
+
+    @property
+    def finishes_at(self) -> float:
+        return self.created_at + self.pending + self.duration
+
+    def status(self, now: float) -> tuple[str, int]:
+        """
+        :returns: Tuple of [goapi_status, progress_percent]
+        """
+        elapsed = now - self.created_at
+        if elapsed < self.pending:
+            return 'pending', 0
+        if elapsed < self.pending + self.duration:
+            return 'processing', int(100 * (elapsed - self.pending) / self.duration)
+        return ('failed' if self.fails else 'finished'), 100
+
+
+class MockBackend:
+    """
+    In-memory GoAPI task lifecycle: pending -> processing -> finished/failed,
+    timings drawn from MockConfig distributions. No HTTP, clock is injectable
+    """
+
+    def __init__(self, config: MockConfig, clock: Callable[[], float] = time.monotonic):
+        self.config = config
+        self.clock = clock
+        self.rng = random.Random(config.seed)
+        self.tasks: dict[str, MockTask] = {}
+        self.stats: dict[str, int] = {}
+
+    def count(self, key: str) -> None:
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def submit(self, task_type: str, payload: dict) -> tuple[dict, int]:
+        self.count(task_type)
+
+        origin_task_id = payload.get('origin_task_id')
+        if task_type != 'imagine':
+            origin = self.tasks.get(origin_task_id)
+            if not origin or origin.status(self.clock())[0] != 'finished':
+                return {"status": "failed", "message": f"origin task {origin_task_id} is not finished"}, 400
+
+        spec = self.config.completion_seconds.get(task_type, 30)
+        task = MockTask(
+            task_type=task_type,
+            created_at=self.clock(),
+            pending=sample(self.config.pending_seconds, self.rng),
+            duration=max(sample(spec, self.rng), 0.01),
+            fails=self.rng.random() < self.config.failure_rate,
+            webhook_endpoint=payload.get('webhook_endpoint') or '',
+            webhook_secret=payload.get('webhook_secret') or '',
+        )
+        self.tasks[task.task_id] = task
+        return {"task_id": task.task_id, "status": "pending", "message": "success"}, 200
+
+    def fetch(self, task_id: str, image_base: str = '') -> tuple[dict, int]:
+        self.count('fetch')
+
+        task = self.tasks.get(task_id)
+        if not task:
+            return {"status": "failed", "message": f"task {task_id} not found"}, 404
+        return self.render(task, image_base), 200
+
+    def render(self, task: MockTask, image_base: str = '') -> dict:
+        now = self.clock()
+        status, progress = task.status(now)
+        result = {"task_progress": progress, "image_url": "", "actions": [], "error_messages": []}
+
+        if status == 'finished':
+            result['image_url'] = f"{image_base}/mock/images/{task.task_id}.png"
+            result['actions'] = list(UPSCALED_ACTIONS if task.task_type == 'upscale' else GRID_ACTIONS)
+        elif status == 'failed':
+            result['error_messages'] = ["mock failure"]
+
+        return {
+            "task_id": task.task_id,
+            "task_type": task.task_type,
+            "status": status,
+            "process_time": round(max(now - task.created_at - task.pending, 0), 3),
+            "meta": {"created_at": task.created_at},
+            "task_result": result,
+        }
+
+    def roll(self, rate: float) -> bool:
+        return rate > 0 and self.rng.random() < rate
+
+    def image(self, task_id: str) -> bytes:
+        digest = hashlib.sha256(task_id.encode()).digest()
+        repeat = self.config.image_bytes // len(digest) + 1
+        return (digest * repeat)[:self.config.image_bytes]
+
+
+class MockGoAPIServer:
+    """
+    HTTP wrapper serving every endpoint from goapi.urls on top of MockBackend,
+    with configurable response latency, 429s, hanging requests and webhook callbacks
+    """
+    logger = reg_logger('[bold magenta]\[MOCK][/bold magenta]')
+
+    def __init__(self, config_path='config.yml', backend: MockBackend | None = None):
+        self.config_path = config_path
+        self.backend = backend or MockBackend(self.config)
+        self.runner: web.AppRunner | None = None
+        self.session: aiohttp.ClientSession | None = None
+        self.callbacks: set[asyncio.Task] = set()
+
+    @property
+    def config(self) -> MockConfig:
+        return get_config(self.config_path).mock
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        for name, url in get_config(self.config_path).goapi.urls.items():
+            path = urlsplit(url).path
+            if name == 'fetch':
+                app.router.add_post(path, self.guarded(self.handle_fetch))
+            else:
+                app.router.add_post(path, self.guarded(self.submit_handler(name)))
+        app.router.add_get('/mock/images/{task_id}.png', self.handle_image)
+        app.router.add_get('/mock/stats', self.handle_stats)
+        app.router.add_route('HEAD', '/', self.handle_head)
+        return app
+
+    def guarded(self, handler):
+        async def wrapper(request: web.Request) -> web.Response:
+            backend = self.backend
+            await asyncio.sleep(sample(self.config.response_ms, backend.rng) / 1000)
+
+            if not request.headers.get('X-API-KEY'):
+                return web.json_response({"status": "failed", "message": "missing X-API-KEY"}, status=401)
+
+            if backend.roll(self.config.rate_limit_rate):
+                backend.count('429')
+                return web.json_response({"status": "failed", "message": "too many requests"}, status=429,
+                                         headers={"Retry-After": str(self.config.retry_after_seconds)})
+
+            if backend.roll(self.config.timeout_rate):
+                backend.count('timeout')
+                await asyncio.sleep(get_config(self.config_path).goapi.http_timeout_seconds + 5)
+
+            try:
+                payload = json.loads(await request.text() or '{}')
+            except ValueError:
+                return web.json_response({"status": "failed", "message": "invalid json"}, status=400)
+
+            return await handler(request, payload)
+
+        return wrapper
+
+    def submit_handler(self, task_type: str):
+        async def handler(request: web.Request, payload: dict) -> web.Response:
+            response, status = self.backend.submit(task_type, payload)
+            if status == 200:
+                self.schedule_callback(self.backend.tasks[response['task_id']], self.image_base(request))
+            return web.json_response(response, status=status)
+
+        return handler
+
+    async def handle_fetch(self, request: web.Request, payload: dict) -> web.Response:
+        response, status = self.backend.fetch(payload.get('task_id'), self.image_base(request))
+        return web.json_response(response, status=status)
+
+    async def handle_image(self, request: web.Request) -> web.Response:
+        task_id = request.match_info['task_id']
+        if task_id not in self.backend.tasks:
+            raise web.HTTPNotFound()
+        self.backend.count('image')
+        return web.Response(body=self.backend.image(task_id), content_type='image/png')
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.backend.stats)
+
+    async def handle_head(self, request: web.Request) -> web.Response:
+        return web.Response()
+
+    @staticmethod
+    def image_base(request: web.Request) -> str:
+        return str(request.url.origin())
+
+    def schedule_callback(self, task: MockTask, image_base: str) -> None:
+        if not task.webhook_endpoint:
+            return
+        callback = asyncio.create_task(self.callback(task, image_base))
+        self.callbacks.add(callback)
+        callback.add_done_callback(self.callbacks.discard)
+
+    async def callback(self, task: MockTask, image_base: str) -> None:
+        await asyncio.sleep(max(task.finishes_at - self.backend.clock(), 0))
+        try:
+            async with self.session.post(task.webhook_endpoint, json=self.backend.render(task, image_base),
+                                         headers={"X-Webhook-Secret": task.webhook_secret}) as response:
+                await response.read()
+            self.backend.count('webhook')
+        except Exception as e:
+            self.logger.warning(f"[yellow]Webhook for {task.task_id} failed: {e!r}")
+
+    async def start(self, host: str | None = None, port: int | None = None) -> None:
+        self.session = aiohttp.ClientSession()
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        host, port = host or self.config.host, port or self.config.port
+        await web.TCPSite(self.runner, host, port).start()
+        self.logger.info(f"[bold green]Mock GoAPI listening on http://{host}:{port}")
+
+    async def stop(self) -> None:
+        for callback in list(self.callbacks):
+            callback.cancel()
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+
+async def main():
+    server = MockGoAPIServer()
+    await server.start()
+
+    # Blocking main thread
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    asyncio.run(main())
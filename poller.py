@@ -0,0 +1,287 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+from collections import OrderedDict
+
+import aiohttp
+
+from config import PollConfig, get_config
+from enums import TaskStatusEnum
+from goapi import GoAPI, TaskResult
+from logger import reg_logger
+from pollmodel import CompletionModel
+from tracing import Span, current, get_tracer
+
+
+class PollEntry:
+    __slots__ = ('task_id', 'future', 'deadline', 'fetching', 'polls', 'errors', 'span', 'model_key', 'started',
+                 'checked', 'progress', 'previous_progress')
+
+    def __init__(self, task_id: str, future: asyncio.Future, span: Span | None = None, model_key: str | None = None,
+                 started: float = 0.0):
+        self.task_id = task_id
+        self.future = future
+        self.deadline = 0.0
+        self.fetching = False
+        self.polls = 0
+        # Failed fetches in a row
+        self.errors = 0
+        # Span of whoever started watching, parent of fetch spans
+        self.span = span
+        # Completion model inputs: elapsed times are seconds since `started`
+        self.model_key = model_key
+        self.started = started
+        self.checked = 0.0
+        self.progress: tuple[float, float] | None = None
+        self.previous_progress: tuple[float, float] | None = None
+
+
+class Poller:
+    """
+    Single scheduler for every in-flight task_id.
+
+    Keeps a deadline heap of next poll times, paces fetches under a global rate cap
+    and resolves one future per task_id when GoAPI reports it finished.
+    A failed fetch only puts the task back on the heap with backoff: the task is already paid for,
+    so it fails only on a terminal status, a fetch GoAPI refuses (4xx) or `task_timeout_seconds`.
+    """
+    logger = reg_logger('[bold green]\[POLLER][/bold green]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.goapi = GoAPI(config_path)
+        self.entries: dict[str, PollEntry] = {}
+        self.heap: list[tuple[float, int, str]] = []
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.next_slot = 0.0
+        self.runner: asyncio.Task | None = None
+        self.fetches: set[asyncio.Task] = set()
+        # Slow safety-net interval, set while task completions are pushed to us (webhooks)
+        self.fallback_interval: float | None = None
+        # Results that arrived before anyone started watching the task
+        self.early_results: OrderedDict[str, tuple[TaskStatusEnum, TaskResult]] = OrderedDict()
+        self.fetch_count = 0
+        self.resolved_count = 0
+        self.model = CompletionModel(config_path)
+
+    @property
+    def config(self) -> PollConfig:
+        return get_config(self.config_path).poll
+
+    @property
+    def interval(self) -> float:
+        return self.fallback_interval or self.config.interval_seconds
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.entries)
+
+    def watch(self, task_id: str, delay: float | None = None, task_type: str | None = None) -> asyncio.Future:
+        """
+        Start tracking task_id. Repeated calls for the same id share one future and one fetch stream
+
+        :param task_id: GoAPI task id
+        :param delay: Seconds before first poll (defaults to completion model estimate or poll interval)
+        :param task_type: Task type, selects the completion time distribution
+        :returns: Future resolved with tuple of [TaskStatusEnum, task_result]
+        """
+        entry = self.entries.get(task_id)
+        if entry:
+            return entry.future
+
+        loop = asyncio.get_running_loop()
+        early = self.early_results.pop(task_id, None)
+        if early:
+            self.resolved_count += 1
+            future = loop.create_future()
+            future.set_result(early)
+            return future
+
+        model_key = None
+        if task_type:
+            model_key = self.model.key(get_config(self.config_path).goapi.process_mode, task_type)
+        entry = PollEntry(task_id, loop.create_future(), current(), model_key, loop.time())
+        self.entries[task_id] = entry
+        if delay is None:
+            delay = self.first_delay(entry)
+        self.schedule(entry, delay)
+        self.ensure_running()
+        return entry.future
+
+    def use_model(self, entry: PollEntry) -> bool:
+        return entry.model_key is not None and self.fallback_interval is None and self.config.model.enabled
+
+    def first_delay(self, entry: PollEntry) -> float:
+        delay = self.model.first_delay(entry.model_key) if self.use_model(entry) else None
+        return self.interval if delay is None else delay
+
+    def next_delay(self, entry: PollEntry) -> float:
+        delay = None
+        if self.use_model(entry):
+            delay = self.model.next_delay(entry.model_key, entry.checked - entry.started, entry.progress,
+                                          entry.previous_progress)
+        return self.interval if delay is None else delay
+
+    def schedule(self, entry: PollEntry, delay: float) -> None:
+        entry.deadline = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self.heap, (entry.deadline, next(self.sequence), entry.task_id))
+        self.wakeup.set()
+
+    def resolve(self, task_id: str, status: TaskStatusEnum, response: TaskResult,
+                completed_at: float | None = None) -> bool:
+        """
+        Finish task_id from outside of the poll loop.
+        Results for untracked ids are kept until someone starts watching them
+
+        :param completed_at: Loop time the task completed at, defaults to now
+        :returns: True if task_id was tracked
+        """
+        entry = self.entries.pop(task_id, None)
+        if not entry:
+            self.early_results[task_id] = (status, response)
+            while len(self.early_results) > self.config.early_results_limit:
+                self.early_results.popitem(last=False)
+            return False
+
+        if entry.model_key is not None and status == TaskStatusEnum.COMPLETED:
+            if completed_at is None:
+                completed_at = asyncio.get_running_loop().time()
+            self.model.observe(entry.model_key, completed_at - entry.started)
+        self.resolved_count += 1
+        if not entry.future.done():
+            entry.future.set_result((status, response))
+        return True
+
+    def error_delay(self, entry: PollEntry) -> float:
+        delay = min(self.interval * 2 ** entry.errors, self.config.max_error_delay_seconds)
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def refused(error: Exception) -> bool:
+        # Unknown task id, bad API key: fetching again won't help
+        return isinstance(error, aiohttp.ClientResponseError) and 400 <= error.status < 500 and error.status != 429
+
+    def expired(self, entry: PollEntry, now: float) -> bool:
+        timeout = self.config.task_timeout_seconds
+        if not timeout or now - entry.started < timeout:
+            return False
+        self.fail(entry.task_id, asyncio.TimeoutError(f"Task {entry.task_id} did not finish in {timeout:.0f}s"))
+        return True
+
+    def fail(self, task_id: str, exc: BaseException) -> None:
+        entry = self.entries.pop(task_id, None)
+        if entry and not entry.future.done():
+            entry.future.set_exception(exc)
+
+    def ensure_running(self) -> None:
+        if self.runner is None or self.runner.done():
+            # Fresh context: the loop must not inherit the span of the task that happened to start it
+            self.runner = asyncio.create_task(self.run(), context=contextvars.Context())
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.heap:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            deadline, _, task_id = self.heap[0]
+            delay = deadline - loop.time()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.heap)
+            entry = self.entries.get(task_id)
+            if not entry or entry.fetching or entry.deadline != deadline:
+                # Stale heap item: task resolved or rescheduled since
+                continue
+
+            await self.throttle()
+            entry.fetching = True
+            fetch = asyncio.create_task(self.fetch(entry))
+            self.fetches.add(fetch)
+            fetch.add_done_callback(self.fetches.discard)
+
+    async def throttle(self) -> None:
+        rate = self.config.max_fetches_per_second
+        if not rate:
+            return
+
+        now = asyncio.get_running_loop().time()
+        slot = max(self.next_slot, now)
+        self.next_slot = slot + 1 / rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def fetch(self, entry: PollEntry) -> None:
+        entry.polls += 1
+        self.fetch_count += 1
+        self.logger.debug("Checking %s status (poll #%d)...", entry.task_id, entry.polls)
+        try:
+            with get_tracer(self.config_path).span('fetch', parent=entry.span, poll=entry.polls):
+                status, response = await self.goapi.fetch(entry.task_id)
+        except Exception as e:
+            if self.entries.get(entry.task_id) is not entry:
+                return
+            if self.refused(e):
+                self.fail(entry.task_id, e)
+                return
+            if self.expired(entry, asyncio.get_running_loop().time()):
+                return
+            entry.errors += 1
+            delay = self.error_delay(entry)
+            self.logger.warning(f"[yellow]Fetch of {entry.task_id} failed ({e!r}), next check in {delay:.1f}s")
+            self.schedule(entry, delay)
+            return
+        finally:
+            entry.fetching = False
+
+        if self.entries.get(entry.task_id) is not entry:
+            return
+
+        entry.errors = 0
+        now = asyncio.get_running_loop().time()
+        if status == TaskStatusEnum.IN_PROGRESS:
+            if self.expired(entry, now):
+                return
+            progress = response.progress
+            if isinstance(progress, (int, float)) and progress > 0:
+                entry.previous_progress, entry.progress = entry.progress, (now - entry.started, progress)
+            entry.checked = now
+            self.schedule(entry, self.next_delay(entry))
+            return
+
+        # Completed somewhere since the previous check
+        self.resolve(entry.task_id, status, response, completed_at=(max(entry.checked, entry.started) + now) / 2)
+
+    async def stop(self) -> None:
+        await self.model.stop()
+        tasks = [t for t in [self.runner, *self.fetches] if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for entry in self.entries.values():
+            entry.future.cancel()
+        self.entries.clear()
+        self.heap.clear()
+        self.runner = None
+
+
+_pollers: dict[str, Poller] = {}
+
+
+def get_poller(config_path: str = 'config.yml') -> Poller:
+    poller = _pollers.get(config_path)
+    if poller is None:
+        poller = _pollers[config_path] = Poller(config_path)
+    return poller
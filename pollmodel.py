@@ -0,0 +1,130 @@
+import asyncio
+import json
+import math
+import os
+from bisect import bisect_right
+from collections import deque
+
+from config import PollModelConfig, get_config
+from logger import reg_logger
+
+
+class CompletionModel:
+    """
+    Online completion time distribution per (process_mode, task_type): the last `window` observed durations,
+    seconds from the start of polling to completion. Saved to `path` between runs
+    """
+    logger = reg_logger('[bold green]\[POLL MODEL][/bold green]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.samples: dict[str, deque[float]] = {}
+        # Sorted copies of samples, rebuilt on demand after new observations
+        self.ordered: dict[str, list[float]] = {}
+        self.dirty = False
+        self.saving: asyncio.Task | None = None
+        self.saved_at: float | None = None
+        self.load()
+
+    @property
+    def config(self) -> PollModelConfig:
+        return get_config(self.config_path).poll.model
+
+    @staticmethod
+    def key(process_mode: str, task_type: str) -> str:
+        return f'{process_mode}/{task_type}'
+
+    def load(self) -> None:
+        path = self.config.path
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            self.logger.exception(f"[bold red]Failed to load {path}, starting from scratch")
+            return
+        for key, values in data.items():
+            self.samples[key] = deque(values, maxlen=self.config.window)
+        self.logger.info(f"[cyan]Loaded completion times for {len(self.samples)} task type(s)")
+
+    def save(self) -> None:
+        path = self.config.path
+        data = {key: list(values) for key, values in self.samples.items()}
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def observe(self, key: str, seconds: float) -> None:
+        samples = self.samples.get(key)
+        if samples is None or samples.maxlen != self.config.window:
+            samples = self.samples[key] = deque(samples or (), maxlen=self.config.window)
+        samples.append(seconds)
+        self.ordered.pop(key, None)
+        self.dirty = True
+        self.maybe_save()
+
+    def maybe_save(self) -> None:
+        config = self.config
+        if not config.path or (self.saving and not self.saving.done()):
+            return
+        now = asyncio.get_running_loop().time()
+        if self.saved_at is None:
+            self.saved_at = now
+        elif now - self.saved_at >= config.save_interval_seconds:
+            self.saved_at = now
+            self.dirty = False
+            self.saving = asyncio.create_task(asyncio.to_thread(self.save))
+
+    async def stop(self) -> None:
+        if self.saving:
+            await asyncio.gather(self.saving, return_exceptions=True)
+        if self.dirty and self.config.path:
+            self.dirty = False
+            await asyncio.to_thread(self.save)
+
+    def quantile_after(self, key: str, elapsed: float, q: float) -> float | None:
+        """
+        Time until the `q` quantile of completion, given the task is still running after `elapsed` seconds.
+        None if there are too few observations or all of them were shorter than `elapsed`
+        """
+        samples = self.samples.get(key)
+        if not samples or len(samples) < self.config.min_samples:
+            return None
+        ordered = self.ordered.get(key)
+        if ordered is None:
+            ordered = self.ordered[key] = sorted(samples)
+
+        start = bisect_right(ordered, elapsed)
+        remaining = len(ordered) - start
+        if not remaining:
+            return None
+        return ordered[start + max(math.ceil(q * remaining) - 1, 0)] - elapsed
+
+    def first_delay(self, key: str) -> float | None:
+        delay = self.quantile_after(key, 0, self.config.first_poll_quantile)
+        return None if delay is None else self.clamp(delay)
+
+    def next_delay(self, key: str, elapsed: float, progress: tuple[float, float] | None,
+                   previous: tuple[float, float] | None) -> float | None:
+        """
+        Delay before the next poll of a task still running after `elapsed` seconds
+
+        :param progress: (elapsed, percent) of the latest fetch, if GoAPI reported progress
+        :param previous: (elapsed, percent) of the fetch before it
+        """
+        config = self.config
+        delay = self.quantile_after(key, elapsed, config.hazard)
+        if progress and 0 < progress[1] < 100:
+            # Extrapolate linearly from the last two readings, from the start of polling if there is one reading only
+            since, done = previous if previous and previous[1] < progress[1] else (0, 0)
+            rate = (progress[1] - done) / max(progress[0] - since, 1e-6)
+            remaining = (100 - progress[1]) / rate
+            delay = remaining if delay is None else min(delay, remaining)
+        if delay is None:
+            return None if len(self.samples.get(key) or ()) < config.min_samples else config.max_delay_seconds
+        return self.clamp(delay)
+
+    def clamp(self, delay: float) -> float:
+        config = self.config
+        return min(max(delay, config.min_interval_seconds), config.max_delay_seconds)
@@ -0,0 +1,247 @@
+import asyncio
+import gzip
+import mmap
+import random
+import re
+import sys
+from abc import ABC, abstractmethod
+from array import array
+from typing import Iterable
+
+from config import Config, PromptSourceConfig, get_config, get_store
+from logger import reg_logger
+
+logger = reg_logger('[bold blue]\[PROMPTS][/bold blue]')
+
+# {red|green|blue} picks one option per prompt, braces without "|" are left as is
+TEMPLATE = re.compile(r'\{([^{}]*\|[^{}]*)\}')
+
+
+class Template:
+    """
+    Prompt with {a|b|c} alternatives, parsed once
+    """
+    __slots__ = ('parts',)
+
+    def __init__(self, text: str):
+        # Even items are literal text, odd items are tuples of options
+        self.parts = [tuple(p.split('|')) if i % 2 else p for i, p in enumerate(TEMPLATE.split(text))]
+
+    def expand(self) -> str:
+        return ''.join(random.choice(p) if isinstance(p, tuple) else p for p in self.parts)
+
+
+def compile_prompt(text: str, templates: bool) -> str | Template:
+    if templates and TEMPLATE.search(text):
+        return Template(text)
+    return text
+
+
+def ar_suffix(ar: str) -> str:
+    return f' --ar {ar}'
+
+
+def warn_ar(count: int) -> None:
+    if count:
+        logger.warning(f"[bold yellow]{count} prompt(s) contain '--ar'. It is highly NOT recommended to use '--ar' "
+                       f"in prompts! System adds specified ar automatically")
+
+
+class PromptSource(ABC):
+    """
+    Endless random prompts, with --ar already applied
+    """
+
+    @abstractmethod
+    def sample(self) -> str:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class ListPromptSource(PromptSource):
+    """
+    Prompts held in memory: task.prompts from config or a reservoir of a stream
+    """
+
+    def __init__(self, prompts: Iterable[str], ar: str, templates: bool = True):
+        self.prompts = []
+        with_ar = 0
+        for prompt in prompts:
+            if "--ar" in prompt:
+                with_ar += 1
+            else:
+                prompt += ar_suffix(ar)
+            self.prompts.append(compile_prompt(prompt, templates))
+        if not self.prompts:
+            raise ValueError("No prompts to sample from")
+        warn_ar(with_ar)
+
+    def sample(self) -> str:
+        prompt = random.choice(self.prompts)
+        return prompt if isinstance(prompt, str) else prompt.expand()
+
+
+class MmapPromptSource(PromptSource):
+    """
+    One prompt per line of a text file. The file is memory-mapped and indexed by line offsets once,
+    so every sample is O(1) and only touched pages are read
+    """
+
+    def __init__(self, path: str, ar: str, templates: bool = True):
+        self.file = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"Prompt file {path} is empty")
+
+        self.suffix = ar_suffix(ar)
+        self.templates = templates
+        # Start offset of every non-empty line, the file end closes the last one
+        self.offsets = array('Q')
+        self.ends = array('Q')
+        # Lines that already contain --ar, usually none
+        self.with_ar: set[int] = set()
+        self.index()
+
+    def index(self) -> None:
+        mm, size = self.mm, len(self.mm)
+        start = 0
+        while start < size:
+            end = mm.find(b'\n', start)
+            if end == -1:
+                end = size
+            line_end = end - 1 if end > start and mm[end - 1] == 13 else end
+            if line_end > start and not mm[start:line_end].isspace():
+                self.offsets.append(start)
+                self.ends.append(line_end)
+            start = end + 1
+
+        if not self.offsets:
+            raise ValueError("No prompts to sample from")
+
+        position = mm.find(b'--ar')
+        while position != -1:
+            self.with_ar.add(self.line_at(position))
+            position = mm.find(b'--ar', position + 1)
+        warn_ar(len(self.with_ar))
+        logger.info(f"[cyan]Indexed {len(self.offsets)} prompts")
+
+    def line_at(self, position: int) -> int:
+        low, high = 0, len(self.offsets) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.offsets[middle] <= position:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def sample(self) -> str:
+        i = random.randrange(len(self.offsets))
+        prompt = self.mm[self.offsets[i]:self.ends[i]].decode('utf-8', errors='replace').strip()
+        if i not in self.with_ar:
+            prompt += self.suffix
+        prompt = compile_prompt(prompt, self.templates)
+        return prompt if isinstance(prompt, str) else prompt.expand()
+
+    def close(self) -> None:
+        self.mm.close()
+        self.file.close()
+
+
+def reservoir(lines: Iterable[str], size: int) -> list[str]:
+    """
+    Uniform sample of `size` lines from a stream of unknown length in one pass (Algorithm R)
+    """
+    sample: list[str] = []
+    seen = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        seen += 1
+        if len(sample) < size:
+            sample.append(line)
+        else:
+            j = random.randrange(seen)
+            if j < size:
+                sample[j] = line
+    logger.info(f"[cyan]Sampled {len(sample)} of {seen} streamed prompts")
+    return sample
+
+
+def open_stream(path: str):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def load_source(config: Config) -> PromptSource:
+    task = config.task
+    source: PromptSourceConfig = task.prompt_source
+    if not source.path:
+        return ListPromptSource(task.prompts, task.ar, source.templates)
+    if source.mode == 'mmap':
+        return MmapPromptSource(source.path, task.ar, source.templates)
+    if source.mode == 'reservoir':
+        stream = open_stream(source.path)
+        try:
+            return ListPromptSource(reservoir(stream, source.reservoir_size), task.ar, source.templates)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+    raise ValueError(f"Unknown prompt source mode {source.mode}")
+
+
+_sources: dict[str, PromptSource] = {}
+# Latest reload per config, loading in a thread
+_reloads: dict[str, asyncio.Task] = {}
+
+
+def swap_source(config_path: str, source: PromptSource) -> None:
+    previous = _sources.get(config_path)
+    _sources[config_path] = source
+    if previous:
+        previous.close()
+
+
+async def reload_source(config_path: str, config: Config) -> None:
+    """
+    Load the new source off the loop (indexing a large file takes a while), keep sampling the old one meanwhile
+    """
+    try:
+        source = await asyncio.to_thread(load_source, config)
+    except (OSError, ValueError):
+        logger.exception("[bold red]Failed to reload prompts. Keeping previous ones")
+        return
+    finally:
+        superseded = _reloads.get(config_path) is not asyncio.current_task()
+        if not superseded:
+            del _reloads[config_path]
+    if superseded:
+        source.close()
+        return
+    swap_source(config_path, source)
+
+
+def on_config_change(config_path: str, old: Config, new: Config) -> None:
+    if (old.task.prompts, old.task.ar, old.task.prompt_source) == (new.task.prompts, new.task.ar,
+                                                                   new.task.prompt_source):
+        return
+    # Streams can't be read twice, keep the reservoir unless the source itself changed
+    if new.task.prompt_source.path == '-' and old.task.prompt_source == new.task.prompt_source:
+        return
+    _reloads[config_path] = asyncio.create_task(reload_source(config_path, new))
+
+
+def get_prompt_source(config_path: str = 'config.yml') -> PromptSource:
+    source = _sources.get(config_path)
+    if source is None:
+        source = _sources[config_path] = load_source(get_config(config_path))
+        get_store(config_path).subscribe(lambda old, new: on_config_change(config_path, old, new))
+    return source
@@ -0,0 +1,234 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, TypeVar
+
+import aiohttp
+
+from config import RetryConfig, get_config
+from logger import reg_logger
+from metrics import metrics
+
+T = TypeVar('T')
+
+# Statuses GoAPI answers before creating a task. After 500/502/504 the task may exist already
+NOT_CREATED_STATUSES = (429, 503)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Retry-After header in seconds, either delta-seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """
+    Per-endpoint retry budget. Every request earns `ratio` retries, up to `burst`,
+    so during an outage retries add at most `ratio` extra load instead of multiplying it
+    """
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def deposit(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` degraded responses in a row and holds submissions for `open_seconds`.
+    Then a single probe is let through: success closes the breaker, failure opens it again
+    """
+    logger = reg_logger('[bold red]\[BREAKER][/bold red]')
+
+    def __init__(self, failures: int, open_seconds: float):
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self.consecutive_failures = 0
+        self.opened_until: float | None = None
+        self.probing = False
+        self.probe_finished = asyncio.Event()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_until is not None
+
+    def configure(self, failures: int, open_seconds: float) -> None:
+        self.failures = failures
+        self.open_seconds = open_seconds
+
+    async def wait(self) -> bool:
+        """
+        Wait until a submission may be sent
+        :return: True if the caller is the half-open probe and must call `finish_probe`
+        """
+        loop = asyncio.get_running_loop()
+        while self.opened_until is not None:
+            remaining = self.opened_until - loop.time()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            elif not self.probing:
+                self.probing = True
+                self.probe_finished.clear()
+                return True
+            else:
+                await self.probe_finished.wait()
+        return False
+
+    def finish_probe(self) -> None:
+        self.probing = False
+        self.probe_finished.set()
+
+    def success(self, probe: bool = False) -> None:
+        self.consecutive_failures = 0
+        if probe:
+            self.opened_until = None
+            self.logger.warning("[bold green]GoAPI recovered, circuit closed")
+
+    def failure(self, probe: bool = False, hold: float | None = None) -> None:
+        self.consecutive_failures += 1
+        if probe or (self.failures and self.consecutive_failures >= self.failures):
+            self.open(max(self.open_seconds, hold or 0))
+        elif hold:
+            # GoAPI told us exactly how long to back off
+            self.open(hold)
+
+    def open(self, seconds: float) -> None:
+        until = asyncio.get_running_loop().time() + seconds
+        if self.opened_until is None:
+            self.logger.warning(f"[bold red]GoAPI degraded, pausing submissions for {seconds:.1f}s")
+            if metrics.enabled:
+                metrics.breaker_opened.inc()
+        self.opened_until = max(self.opened_until or 0, until)
+
+
+class RetryPolicy:
+    """
+    Retries GoAPI calls with exponential backoff and full jitter, honouring Retry-After.
+
+    Fetches are idempotent and are retried on timeouts and connection errors too.
+    Submissions are retried only when GoAPI surely did not create the task (429/503, connect failures)
+    and wait for the circuit breaker before being sent. Timeouts and other 5xx may come after the task was
+    created, so they are retried for submissions only with `retry_submit_timeouts`.
+    """
+    logger = reg_logger('[bold magenta]\[RETRY][/bold magenta]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        config = self.config
+        self.budgets: dict[str, RetryBudget] = {}
+        self.breaker = CircuitBreaker(config.breaker_failures, config.breaker_open_seconds)
+        # Called with (endpoint, seconds, degradation reason or None) after every attempt
+        self.observers: list[Callable[[str, float, str | None], None]] = []
+
+    @property
+    def config(self) -> RetryConfig:
+        return get_config(self.config_path).goapi.retry
+
+    def budget(self, endpoint: str) -> RetryBudget:
+        budget = self.budgets.get(endpoint)
+        if budget is None:
+            budget = self.budgets[endpoint] = RetryBudget(self.config.budget_ratio, self.config.budget_burst)
+        return budget
+
+    def reconfigure(self) -> None:
+        config = self.config
+        self.breaker.configure(config.breaker_failures, config.breaker_open_seconds)
+        for budget in self.budgets.values():
+            budget.ratio = config.budget_ratio
+            budget.burst = config.budget_burst
+
+    def classify(self, error: Exception, idempotent: bool) -> tuple[str | None, bool, float | None]:
+        """
+        :return: Tuple of [degradation reason or None, retryable, Retry-After seconds]
+        """
+        if isinstance(error, asyncio.TimeoutError):
+            return 'timeout', idempotent or self.config.retry_submit_timeouts, None
+        if isinstance(error, aiohttp.ClientResponseError):
+            if error.status not in self.config.retry_statuses:
+                return None, False, None
+            retry_after = parse_retry_after(error.headers.get('Retry-After')) if error.headers else None
+            retryable = idempotent or error.status in NOT_CREATED_STATUSES or self.config.retry_submit_timeouts
+            return str(error.status), retryable, retry_after
+        if isinstance(error, aiohttp.ClientConnectorError):
+            # Nothing was sent
+            return type(error).__name__, True, None
+        if isinstance(error, aiohttp.ClientError):
+            return type(error).__name__, idempotent, None
+        return None, False, None
+
+    def backoff(self, attempt: int, retry_after: float | None) -> float:
+        config = self.config
+        delay = random.uniform(0, min(config.max_delay_seconds, config.base_delay_seconds * 2 ** attempt))
+        if retry_after is not None:
+            delay += retry_after
+        return delay
+
+    async def call(self, endpoint: str, send: Callable[[], Awaitable[T]], idempotent: bool) -> T:
+        budget = self.budget(endpoint)
+        budget.deposit()
+
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            probe = False if idempotent else await self.breaker.wait()
+            started = loop.time()
+            try:
+                result = await send()
+            except Exception as e:
+                reason, retryable, retry_after = self.classify(e, idempotent)
+                for observer in self.observers:
+                    observer(endpoint, loop.time() - started, reason)
+                if reason is None:
+                    raise
+
+                self.breaker.failure(probe, hold=retry_after if reason == '429' else None)
+                attempt += 1
+                if not retryable or attempt >= self.config.max_attempts or not budget.withdraw():
+                    raise
+
+                delay = self.backoff(attempt, retry_after)
+                self.logger.warning(f"[yellow]{endpoint}: {reason}, retry {attempt}/{self.config.max_attempts - 1} "
+                                    f"in {delay:.2f}s")
+                if metrics.enabled:
+                    metrics.retries.inc(endpoint=endpoint, reason=reason)
+                await asyncio.sleep(delay)
+            else:
+                for observer in self.observers:
+                    observer(endpoint, loop.time() - started, None)
+                self.breaker.success(probe)
+                if attempt:
+                    self.logger.info(f"[green]{endpoint}: succeeded after {attempt} retries")
+                return result
+            finally:
+                if probe:
+                    self.breaker.finish_probe()
+
+
+_policies: dict[str, RetryPolicy] = {}
+
+
+def get_retry_policy(config_path: str = 'config.yml') -> RetryPolicy:
+    policy = _policies.get(config_path)
+    if policy is None:
+        policy = _policies[config_path] = RetryPolicy(config_path)
+    return policy
@@ -0,0 +1,131 @@
+import asyncio
+from collections import deque
+
+from config import Config, SchedulerConfig, get_config, get_store
+from logger import reg_logger
+
+
+class Lane:
+    """
+    Waiters for one (task type, chain depth) pair
+    """
+    __slots__ = ('task_type', 'depth', 'waiters', 'finish')
+
+    def __init__(self, task_type: str, depth: int):
+        self.task_type = task_type
+        self.depth = depth
+        self.waiters: deque[asyncio.Future] = deque()
+        # Virtual finish tag of the last slot granted to this lane, start tag of the next one
+        self.finish = 0.0
+
+
+class Scheduler:
+    """
+    Shared pool of GoAPI task slots, handed out between lanes by weighted fair queuing.
+
+    Every submission (imagine or button) takes a slot from submit until completion. Lanes are per task type
+    and chain depth (0 - imagine, 1 - button on an imagine, 2 - recursive button). A lane's share grows with
+    `depth_weights` and its type's `weights`, so running chains get finished before new ones start,
+    and `limits` caps concurrent tasks of a type so slow types can't take over the pool
+    """
+    logger = reg_logger('[bold yellow]\[SCHEDULER][/bold yellow]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.lanes: dict[tuple[str, int], Lane] = {}
+        self.in_use = 0
+        self.type_in_use: dict[str, int] = {}
+        self.virtual_time = 0.0
+        get_store(config_path).subscribe(self.on_config_change)
+
+    @property
+    def config(self) -> SchedulerConfig:
+        return get_config(self.config_path).scheduler
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(lane.waiters) for lane in self.lanes.values())
+
+    def on_config_change(self, old: Config, new: Config) -> None:
+        if old.scheduler != new.scheduler:
+            self.dispatch()
+
+    def weight(self, lane: Lane) -> float:
+        config = self.config
+        depth_weights = config.depth_weights
+        depth_weight = depth_weights[min(lane.depth, len(depth_weights) - 1)] if depth_weights else 1
+        return max(depth_weight * config.weights.get(lane.task_type, 1), 1e-9)
+
+    def runnable(self, lane: Lane) -> bool:
+        limit = self.config.limits.get(lane.task_type)
+        return not limit or self.type_in_use.get(lane.task_type, 0) < limit
+
+    def dispatch(self) -> None:
+        slots = self.config.slots
+        while not slots or self.in_use < slots:
+            # Start-time fair queuing: serve the lowest start tag. A lane that was idle starts at the
+            # current virtual time, so it neither hoards credit nor waits behind busy lanes' backlog
+            best, best_start = None, 0.0
+            for lane in self.lanes.values():
+                while lane.waiters and lane.waiters[0].done():
+                    lane.waiters.popleft()
+                if not lane.waiters or not self.runnable(lane):
+                    continue
+                start = max(lane.finish, self.virtual_time)
+                if best is None or start < best_start:
+                    best, best_start = lane, start
+            if best is None:
+                return
+
+            self.virtual_time = best_start
+            best.finish = best_start + 1 / self.weight(best)
+            self.in_use += 1
+            self.type_in_use[best.task_type] = self.type_in_use.get(best.task_type, 0) + 1
+            best.waiters.popleft().set_result(True)
+
+    async def acquire(self, task_type: str, depth: int) -> bool:
+        """
+        Wait for a slot in the (task_type, depth) lane
+
+        :returns: False if the scheduler is disabled and nothing has to be released
+        """
+        if not self.enabled:
+            return False
+        lane = self.lanes.get((task_type, depth))
+        if lane is None:
+            lane = self.lanes[task_type, depth] = Lane(task_type, depth)
+
+        future = asyncio.get_running_loop().create_future()
+        lane.waiters.append(future)
+        self.dispatch()
+        if future.done():
+            return True
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted right before cancellation
+                self.release(task_type)
+            raise
+        return True
+
+    def release(self, task_type: str) -> None:
+        self.in_use -= 1
+        self.type_in_use[task_type] -= 1
+        if not self.type_in_use[task_type]:
+            del self.type_in_use[task_type]
+        self.dispatch()
+
+
+_schedulers: dict[str, Scheduler] = {}
+
+
+def get_scheduler(config_path: str = 'config.yml') -> Scheduler:
+    scheduler = _schedulers.get(config_path)
+    if scheduler is None:
+        scheduler = _schedulers[config_path] = Scheduler(config_path)
+    return scheduler
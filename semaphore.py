@@ -0,0 +1,74 @@
+import asyncio
+from collections import deque
+
+
+class ResizableSemaphore:
+    """
+    Semaphore whose limit can be changed at runtime.
+    Shrinking never interrupts holders, new acquirers just wait until usage drops below the new limit.
+    """
+
+    def __init__(self, value: int):
+        self._limit = value
+        self._in_use = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def locked(self) -> bool:
+        return self._in_use >= self._limit
+
+    async def acquire(self) -> bool:
+        if not self._waiters and self._in_use < self._limit:
+            self._in_use += 1
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted right before cancellation
+                self.release()
+            elif future in self._waiters:
+                self._waiters.remove(future)
+            raise
+        return True
+
+    def release(self) -> None:
+        if self._in_use <= 0:
+            raise ValueError("ResizableSemaphore released too many times")
+        self._in_use -= 1
+        self._wake()
+
+    def resize(self, value: int) -> None:
+        if value < 1:
+            raise ValueError("Semaphore limit must be positive")
+        self._limit = value
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_use < self._limit:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._in_use += 1
+            future.set_result(True)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
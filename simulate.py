@@ -0,0 +1,223 @@
+"""
+Discrete-event simulation of the real ActivityEngine against the in-memory GoAPI backend.
+
+The event loop runs on a virtual clock: whenever nothing is ready it jumps straight to the next timer,
+so hours of polling and task completion take seconds. Completion times, failures, 429s and timeouts
+come from the `mock` section of the config
+
+    python simulate.py --hours 8 --max-tasks 50 --consumers 50 --buttons 1 4 --recursive 1 3
+"""
+import asyncio
+import dataclasses
+import json
+import os
+import random
+import selectors
+import time
+from typing import Mapping
+from urllib.parse import urlsplit
+
+import aiohttp
+import click
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from config import Config, get_config, get_store
+
+
+class VirtualSelector(selectors.DefaultSelector):
+    """
+    Never sleeps while timers are pending: advances the loop clock by the timeout instead.
+    Real fds (thread wakeups) are still checked, and waited for when there is no timer at all
+    """
+
+    def __init__(self, loop: 'VirtualClockLoop'):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            return super().select(None)
+        self.loop.virtual_time += timeout
+        return []
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        self.virtual_time = 0.0
+        super().__init__(VirtualSelector(self))
+
+    def time(self) -> float:
+        return self.virtual_time
+
+
+class SimulatedTransport:
+    """
+    Stands in for HTTP in GoAPI.send: same latency, 429s and timeouts as MockGoAPIServer, no sockets
+    """
+
+    def __init__(self, config_path: str, backend):
+        from mock_goapi import sample
+
+        self.config_path = config_path
+        self.backend = backend
+        self.sample = sample
+        self.endpoints = {urlsplit(url).path: name for name, url in get_config(config_path).goapi.urls.items()}
+        self.requests: dict[str, int] = {}
+
+    async def __call__(self, method: str, url: str, payload: dict | None) -> tuple[dict, int]:
+        config = get_config(self.config_path)
+        backend = self.backend
+        endpoint = self.endpoints.get(urlsplit(url).path, 'other')
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+        await asyncio.sleep(self.sample(config.mock.response_ms, backend.rng) / 1000)
+
+        if backend.roll(config.mock.rate_limit_rate):
+            backend.count('429')
+            raise self.error(method, url, 429, {"Retry-After": str(config.mock.retry_after_seconds)})
+
+        if backend.roll(config.mock.timeout_rate):
+            backend.count('timeout')
+            await asyncio.sleep(config.goapi.http_timeout_seconds)
+            raise asyncio.TimeoutError()
+
+        payload = payload or {}
+        if endpoint == 'fetch':
+            response, status = backend.fetch(payload.get('task_id'))
+        else:
+            response, status = backend.submit(endpoint, payload)
+        if status >= 400:
+            raise self.error(method, url, status)
+        return response, status
+
+    @staticmethod
+    def error(method: str, url: str, status: int, headers: Mapping | None = None) -> aiohttp.ClientResponseError:
+        headers = CIMultiDictProxy(CIMultiDict(headers or {}))
+        request_info = aiohttp.RequestInfo(URL(url), method, CIMultiDictProxy(CIMultiDict()), URL(url))
+        return aiohttp.ClientResponseError(request_info, (), status=status, message='simulated', headers=headers)
+
+
+def simulation_config(config: Config, max_tasks: int | None, consumers: int | None, buttons, recursive,
+                      log_level: str) -> Config:
+    """
+    Run parameters on top of the base config. Everything that would leave the process is switched off
+    """
+    replace = dataclasses.replace
+    task = config.task
+    return replace(
+        config,
+        log_level=log_level,
+        max_tasks=max_tasks or config.max_tasks,
+        consumers=consumers or config.consumers,
+        task=replace(task, use_buttons_range=tuple(buttons or task.use_buttons_range),
+                     use_buttons_range_recursive=tuple(recursive or task.use_buttons_range_recursive)),
+        goapi=replace(config.goapi, connection=replace(config.goapi.connection, prewarm=0)),
+        webhook=replace(config.webhook, enabled=False),
+        metrics=replace(config.metrics, enabled=False),
+        journal=replace(config.journal, enabled=False),
+        artifacts=replace(config.artifacts, enabled=False),
+        poll=replace(config.poll, model=replace(config.poll.model, path='')),
+        budget=replace(config.budget, path=''),
+        tracing=replace(config.tracing, enabled=False),
+    )
+
+
+async def simulate(config_path: str, hours: float) -> dict:
+    from main import ActivityEngine
+    from mock_goapi import MockBackend
+    from goapi import GoAPI
+    from budget import get_budget
+    from stats import ChainStats
+
+    loop = asyncio.get_running_loop()
+    backend = MockBackend(get_config(config_path).mock, clock=loop.time)
+    transport = GoAPI.transport = SimulatedTransport(config_path, backend)
+
+    engine = ActivityEngine(config_path)
+    engine.stats = ChainStats(clock=loop.time)
+    get_budget(config_path).clock = loop.time
+
+    wall_started = time.perf_counter()
+    try:
+        await asyncio.wait_for(engine.run(), hours * 3600)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        GoAPI.transport = None
+    wall = time.perf_counter() - wall_started
+
+    stats = engine.stats
+    budget = get_budget(config_path)
+    simulated = loop.time()
+    finished = stats.chains_completed + stats.chains_failed
+    return {
+        "simulated_hours": simulated / 3600,
+        "wall_seconds": wall,
+        "speedup": simulated / wall if wall else None,
+        "chains_started": stats.chains_started,
+        "chains_completed": stats.chains_completed,
+        "chains_failed": stats.chains_failed,
+        "chains_per_hour": stats.chains_completed / (simulated / 3600) if simulated else None,
+        "chain_latency_seconds": stats.latency(),
+        "requests": transport.requests,
+        "requests_per_hour": sum(transport.requests.values()) / (simulated / 3600) if simulated else None,
+        "fetches_per_chain": transport.requests.get('fetch', 0) / finished if finished else None,
+        # Submissions by task type: what the run would be billed for
+        "submitted": {k: v for k, v in backend.stats.items() if k not in ('fetch', '429', 'timeout')},
+        "credits_spent": budget.total_spent,
+        "credits_per_hour": budget.total_spent / (simulated / 3600) if simulated else None,
+        "chains_per_credit": stats.chains_completed / budget.total_spent if budget.total_spent else None,
+    }
+
+
+@click.command()
+@click.option('--config', 'config_path', default='config.yml', show_default=True,
+              help='Base config, its mock section defines completion times and failure rates')
+@click.option('--hours', default=1.0, show_default=True, help='Simulated time to run')
+@click.option('--max-tasks', type=int, default=None)
+@click.option('--consumers', type=int, default=None)
+@click.option('--buttons', nargs=2, type=int, default=None, help='use_buttons_range override')
+@click.option('--recursive', nargs=2, type=int, default=None, help='use_buttons_range_recursive override')
+@click.option('--seed', type=int, default=None, help='Seed engine choices (backend uses mock.seed)')
+@click.option('--log-level', default='CRITICAL', show_default=True,
+              help='Failed tasks log errors, which slows the run down')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Write JSON report here')
+def cli(config_path, hours, max_tasks, consumers, buttons, recursive, seed, log_level, output):
+    """Simulate hours of operation on a virtual clock"""
+    os.environ.setdefault('GOAPI_TOKEN', 'simulate')
+    store = get_store(config_path)
+    store.set_transform(lambda c: simulation_config(c, max_tasks, consumers, buttons, recursive, log_level))
+    if seed is not None:
+        random.seed(seed)
+
+    from logger import setup_logging
+    setup_logging(config_path)
+
+    with asyncio.Runner(loop_factory=VirtualClockLoop) as runner:
+        results = runner.run(simulate(config_path, hours))
+
+    config = store.snapshot
+    report = {
+        "params": {
+            "hours": hours,
+            "max_tasks": config.max_tasks,
+            "consumers": config.consumers,
+            "use_buttons_range": config.task.use_buttons_range,
+            "use_buttons_range_recursive": config.task.use_buttons_range_recursive,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    click.echo(text)
+
+
+if __name__ == '__main__':
+    cli()
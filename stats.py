@@ -0,0 +1,62 @@
+import math
+import time
+from collections import deque
+from typing import Callable
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """
+    Nearest-rank percentile
+
+    :param values: Samples (any order)
+    :param q: Percentile in [0, 100]
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Rounded first, so float noise (0.95 * 100 = 95.00000000000001) doesn't move the rank up
+    rank = max(math.ceil(round(q / 100 * len(ordered), 9)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class ChainStats:
+    """
+    Counters and recent chain durations of an ActivityEngine
+    """
+
+    def __init__(self, keep_last: int = 100000, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.started_at = clock()
+        self.chains_started = 0
+        self.chains_completed = 0
+        self.chains_failed = 0
+        self.chain_durations: deque[float] = deque(maxlen=keep_last)
+
+    def chain_started(self) -> float:
+        self.chains_started += 1
+        return self.clock()
+
+    def chain_finished(self, started: float, ok: bool) -> None:
+        if ok:
+            self.chains_completed += 1
+            self.chain_durations.append(self.clock() - started)
+        else:
+            self.chains_failed += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime": self.clock() - self.started_at,
+            "chains_started": self.chains_started,
+            "chains_completed": self.chains_completed,
+            "chains_failed": self.chains_failed,
+            "latency": self.latency(),
+        }
+
+    def latency(self) -> dict:
+        durations = list(self.chain_durations)
+        return {
+            "p50": percentile(durations, 50),
+            "p95": percentile(durations, 95),
+            "p99": percentile(durations, 99),
+            "mean": sum(durations) / len(durations) if durations else None,
+        }
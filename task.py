@@ -1,71 +1,163 @@
 import asyncio
+import logging
 import random
-
-import yaml
-
-from enums import TaskStatusEnum, TaskTypeEnum
-from goapi import GoAPI
-from logger import logger, reg_logger
+import sys
+import time
+
+from config import TaskConfig, get_config
+from actions import Action, get_registry
+from artifacts import get_artifacts
+from budget import get_budget
+from enums import TaskStatusEnum
+from goapi import GoAPI, TaskResult
+from journal import JournalEntry, get_journal
+from logger import task_logger
+from metrics import metrics
+from poller import get_poller
+from prompts import get_prompt_source
+from scheduler import get_scheduler
+from semaphore import ResizableSemaphore
+from tracing import get_tracer
 
 
 class TaskFailedException(Exception):
-    def __init__(self, response: dict):
+    def __init__(self, response: TaskResult):
         self.response = response
 
     def __str__(self):
         return "Task failed with response: {}".format(self.response)
 
 
+_child_slots: dict[str, ResizableSemaphore] = {}
+
+
+def get_child_slots(config_path: str = 'config.yml') -> ResizableSemaphore:
+    """
+    Process-wide limit of concurrently running child actions (all chains together)
+    """
+    slots = _child_slots.get(config_path)
+    if slots is None:
+        limit = get_config(config_path).task.child_concurrency or sys.maxsize
+        slots = _child_slots[config_path] = ResizableSemaphore(limit)
+    return slots
+
+
+def new_chain_slots(config_path: str = 'config.yml') -> asyncio.Semaphore:
+    """
+    Limit of concurrently running child actions of one chain, shared by all its levels
+    """
+    return asyncio.Semaphore(get_config(config_path).task.child_concurrency_per_chain or sys.maxsize)
+
+
 class Task:
-    def __init__(self, config_path='config.yml', task_type: str = "Unknown", existing_task_id=None):
-        self.logger = logger
+    def __init__(self, config_path='config.yml', task_type: str = "Unknown", existing_task_id=None,
+                 parent_id: str | None = None, chain_id: str | None = None, recursive: bool = False, depth: int = 0):
         self.task_id = existing_task_id
         self.task_type = task_type
+        self.logger = task_logger(existing_task_id, task_type)
+
+        # Place in the chain, used by the journal
+        self.parent_id = parent_id
+        self.chain_id = chain_id or existing_task_id
+        self.recursive = recursive
+        # 0 for imagines, +1 per button press. Selects the scheduler lane
+        self.depth = depth
+        self.slot_held = False
 
-        if existing_task_id:
-            self.logger = reg_logger(f"[bold cyan]\[{existing_task_id} {task_type}][/bold cyan]")
+        # Set for tasks re-attached from the journal after a restart
+        self.resumed = False
+        self.resume_actions: list[Action] | None = None
 
-        self.goapi = GoAPI()
+        self.goapi = GoAPI(config_path)
         self.config_path = config_path
+        # Epoch seconds, start of the chain's queue wait span
+        self.created = time.time()
+
+    @classmethod
+    def from_journal(cls, entry: JournalEntry, config_path='config.yml') -> 'Task':
+        """
+        Re-attach to a task submitted by a previous run, without submitting it again
+        """
+        # Buttons on imagines are the recursive ones
+        depth = 0 if entry.is_imagine else 1 if entry.recursive else 2
+        task = cls(config_path=config_path, task_type=entry.task_type, existing_task_id=entry.task_id,
+                   parent_id=entry.parent, chain_id=entry.chain, recursive=entry.recursive, depth=depth)
+        task.resumed = True
+        remaining = entry.remaining_actions()
+        if remaining is not None:
+            registry = get_registry(config_path)
+            task.resume_actions = [a for a in map(registry.get, remaining) if a is not None]
+        return task
 
     @property
-    def config(self) -> dict:
-        with open(self.config_path) as f:
-            config = yaml.safe_load(f)
-            return config['task']
+    def config(self) -> TaskConfig:
+        return get_config(self.config_path).task
 
     @property
     def ar(self) -> str:
-        return self.config['ar']
+        return self.config.ar
 
     def generate_prompt(self) -> str:
-        prompt = random.choice(self.config['prompts'])
-        if "--ar" in prompt:
-            self.logger.warning(
-                "[bold yellow]It is highly NOT recommended to use '--ar' in prompts! System will add specified ar automatically!")
-        else:
-            prompt += f' --ar {self.ar}'
+        return get_prompt_source(self.config_path).sample()
+
+    async def take_slot(self) -> None:
+        """
+        Wait for a scheduler slot, held until the task completes
+        """
+        with get_tracer(self.config_path).span('slot_wait', lane=self.task_type, depth=self.depth):
+            self.slot_held = await get_scheduler(self.config_path).acquire(self.task_type, self.depth)
 
-        return prompt
+    def free_slot(self) -> None:
+        if self.slot_held:
+            self.slot_held = False
+            get_scheduler(self.config_path).release(self.task_type)
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         self.logger.info("Closing task...")
+        self.free_slot()
 
-        if exc_type:
+        if exc_type and not issubclass(exc_type, asyncio.CancelledError):
             self.logger.error('[bold red]Task closed with exception', exc_info=(exc_type, exc_val, exc_tb))
 
-        return self
+        # Never suppress: the engine has to see chain failures and cancellation
+        return False
 
     async def __aenter__(self):
+        if self.resumed:
+            self.logger.info("[cyan]Resuming task from journal")
+            await self.take_slot()
+            return self
         if self.task_id:
             raise ValueError("Task already started")
 
         self.logger.info("[cyan]Starting task...")
 
-        task_id, _ = await self.goapi.imagine(prompt=self.generate_prompt(), ar=self.ar)
-
-        self.logger = reg_logger(f"[bold cyan]\[{task_id} {self.task_type}][/bold cyan]")
+        await self.take_slot()
+        budget = get_budget(self.config_path)
+        tracer = get_tracer(self.config_path)
+        try:
+            with tracer.span('budget_wait'):
+                charge = await budget.acquire(self.task_type)
+            try:
+                with tracer.span('submit', task_type=self.task_type):
+                    task_id, response = await self.goapi.imagine(prompt=self.generate_prompt(), ar=self.ar)
+            except BaseException:
+                budget.refund(charge)
+                raise
+            if not task_id:
+                budget.refund(charge)
+                self.logger.error("[bold red]Failed to gather task_id from [cyan]%s", response)
+                raise TaskFailedException(response=response)
+        except BaseException:
+            # __aexit__ is not called when __aenter__ fails
+            self.free_slot()
+            raise
+
+        self.logger = task_logger(task_id, self.task_type)
         self.task_id = task_id
+        self.chain_id = task_id
+        self.recursive = True
+        get_journal(self.config_path).submitted(task_id, self.task_type, parent=None, chain=task_id, recursive=True)
         self.logger.info("[bold green]Imagine started successfully!")
 
         return self
@@ -80,85 +172,156 @@ class Task:
             raise ValueError("Task not started")
 
         self.logger.info("[cyan]Waiting for task to complete...")
+        started = time.monotonic()
+
+        try:
+            with get_tracer(self.config_path).span('poll', task_type=self.task_type):
+                # Shielded: the future is shared by everyone watching this task_id
+                poll = get_poller(self.config_path).watch(self.task_id, task_type=self.task_type)
+                status, status_response = await asyncio.shield(poll)
+        finally:
+            self.free_slot()
+
+        if status == TaskStatusEnum.FAILED:
+            self.logger.error("[bold red]Task failed! => [cyan]%s", status_response)
+            if metrics.enabled:
+                metrics.tasks_failed.inc(task_type=self.task_type)
+            raise TaskFailedException(response=status_response)
+
+        if metrics.enabled:
+            metrics.task_completion_seconds.observe(time.monotonic() - started, task_type=self.task_type)
+        self.logger.info("[bold green]Task completed")
+
+        artifacts = get_artifacts(self.config_path)
+        if artifacts.enabled:
+            artifacts.submit(self.task_id, status_response)
+        return status_response
+
+    async def complete_actions(self, do_actions: list[Action], do_recursive: bool = True,
+                               chain_slots: asyncio.Semaphore | None = None) -> None:
+        """
+        Run selected actions concurrently as a task tree
 
-        while True:
-            await asyncio.sleep(1)
-            self.logger.debug("Checking task status...")
-            status, status_response = await self.goapi.fetch(self.task_id)
-
-            if status == TaskStatusEnum.FAILED:
-                self.logger.error(f"[bold red]Task failed! => [cyan]{status_response}")
-                raise TaskFailedException(response=status_response)
-
-            if status == TaskStatusEnum.COMPLETED:
-                self.logger.info("[bold green]Task completed")
-                return status_response
-
-    async def complete_actions(self, do_actions: list[TaskTypeEnum], do_recursive: bool = True) -> None:
+        :param do_actions: Actions to press on this task
+        :param do_recursive: Also press buttons on every finished child
+        :param chain_slots: Per-chain concurrency limit, shared by all levels of one chain
+        """
         if not self.task_id:
             raise ValueError("Task not ready for completing actions")
 
-        occupied_indexes = {}
-        for action in do_actions:
-            payload = action.__payload__(origin_task_id=self.task_id, occupied_indexes=occupied_indexes.get(action))
-            if not payload:
-                continue
-
-            if payload.get('index') and action.is_onetime:
-                self.logger.info(f"[yellow]Included {payload['index']} to occupied indexes")
-                occupied_indexes.setdefault(action, [])
-                occupied_indexes[action].append(payload['index'])
-
-            url = action.__goapi_url__()
-            if not url:
-                self.logger.error(f"[bold yellow]GoAPI URL not found for {action}")
-                continue
-
-            self.logger.info(f"Requesting [yellow]{action}[/yellow] on [cyan]{url}[/cyan] "
-                             f"\nwith payload [cyan]{payload}[/cyan]")
-
-            create_task_response, _ = await self.goapi.request(url=url, method='POST', payload=payload)
-            if not create_task_response.get('task_id'):
-                self.logger.error(f"[bold red]Failed to gather task_id from [cyan]{create_task_response}")
-                continue
-
-            task = Task(existing_task_id=create_task_response['task_id'], task_type=action.value.capitalize())
-
-            try:
-                finished_task_response = await task.start_polling()
-            except TaskFailedException as tf:
-                self.logger.error(f"[bold red]Child task uuid={task.task_id} failed!")
-                self.logger.error(f"JSON: [cyan]{tf.response}")
-                continue
-
-            if not do_recursive:
-                self.logger.info(f"[bold green]Child task {task.task_id} ({task.task_type}) finished. Chain completed!")
-                return
-
-            self.logger.info(f"[bold green]Child task {task.task_id} finished. Recursively completing actions")
+        if chain_slots is None:
+            chain_slots = new_chain_slots(self.config_path)
+
+        branches = [self.complete_action(action, do_recursive, chain_slots) for action in do_actions]
+        results = await asyncio.gather(*branches, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for error in errors[1:]:
+            self.logger.error(f"[bold red]Child action failed: {error!r}")
+        if errors:
+            raise errors[0]
+
+    async def complete_action(self, action: Action, do_recursive: bool, chain_slots: asyncio.Semaphore) -> None:
+        tracer = get_tracer(self.config_path)
+        with tracer.span('action', action=action.action, task_type=action.task_type):
+            # Slots are held only while our own child runs, never across recursion, so levels can't deadlock
+            child_slots = get_child_slots(self.config_path)
+            async with tracer.wait('slot_wait', chain_slots), tracer.wait('slot_wait', child_slots):
+                scheduler = get_scheduler(self.config_path)
+                with tracer.span('slot_wait', lane=action.task_type, depth=self.depth + 1):
+                    slot_held = await scheduler.acquire(action.task_type, self.depth + 1)
+                try:
+                    payload = action.payload(self.task_id)
+                    self.logger.info("Requesting [yellow]%s[/yellow] on [cyan]%s[/cyan] \nwith payload "
+                                     "[cyan]%s[/cyan]", action, action.url, payload)
+
+                    budget = get_budget(self.config_path)
+                    with tracer.span('budget_wait'):
+                        charge = await budget.acquire(action.task_type)
+                    try:
+                        with tracer.span('submit', task_type=action.task_type):
+                            create_task_response, _ = await self.goapi.request(url=action.url, method='POST',
+                                                                               payload=payload)
+                    except BaseException:
+                        budget.refund(charge)
+                        raise
+                    if not create_task_response.task_id:
+                        budget.refund(charge)
+                        self.logger.error("[bold red]Failed to gather task_id from [cyan]%s", create_task_response)
+                        return
+
+                    task = Task(config_path=self.config_path, existing_task_id=create_task_response.task_id,
+                                task_type=action.task_type, parent_id=self.task_id, chain_id=self.chain_id,
+                                recursive=do_recursive, depth=self.depth + 1)
+                    # The child frees the slot once it completes
+                    task.slot_held, slot_held = slot_held, False
+                    get_journal(self.config_path).submitted(task.task_id, task.task_type, parent=self.task_id,
+                                                            chain=self.chain_id, recursive=do_recursive,
+                                                            action=action.action)
+
+                    finished_task_response = await task.poll_child()
+                finally:
+                    if slot_held:
+                        scheduler.release(action.task_type)
+
+            await task.continue_chain(finished_task_response, chain_slots)
+
+    async def poll_child(self) -> TaskResult | None:
+        """
+        Wait for a child action to finish
+        :return: status fetch response, None if the child failed
+        """
+        try:
+            return await self.start_polling()
+        except TaskFailedException as tf:
+            self.logger.error("[bold red]Child task uuid=%s failed!", self.task_id)
+            self.logger.error("JSON: [cyan]%s", tf.response)
+            return None
+
+    async def continue_chain(self, finished_task_response: TaskResult | None, chain_slots: asyncio.Semaphore) -> None:
+        """
+        Press buttons on a finished recursive child, then close it in the journal
+        """
+        cancelled = False
+        try:
+            if finished_task_response is not None:
+                await self.press_recursive(finished_task_response, chain_slots)
+        except asyncio.CancelledError:
+            # Left open, the next run picks it up from the journal
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                get_journal(self.config_path).closed(self.task_id)
+
+    async def press_recursive(self, finished_task_response: TaskResult, chain_slots: asyncio.Semaphore) -> None:
+        if not self.recursive:
+            self.logger.info("[bold green]Child task finished")
+            return
+
+        if self.resume_actions is not None:
+            selected = self.resume_actions
+            self.logger.info("[bold green]Child task finished. Resuming %d remaining action(s)", len(selected))
+        else:
+            self.logger.info("[bold green]Child task finished. Recursively completing actions")
 
-            actions_available = finished_task_response.get('task_result', {}).get('actions')
+            actions_available = finished_task_response.actions
             if not actions_available:
-                self.logger.error(f"[bold red]Task {task.task_id} error! No actions available!. Continuing to next action")
-                continue
-
-            actions_available = [TaskTypeEnum.from_goapi_action(i) for i in actions_available]
-            actions_available = [i for i in actions_available if i is not None]
-            self.logger.info(f"Available actions: {actions_available}")
+                self.logger.error("[bold red]Task error! No actions available!")
+                return
 
-            selected = []
-            use_buttons = self.randomize_use_buttons()
+            self.logger.info("Available actions: %s", actions_available)
+            budget = get_budget(self.config_path)
+            use_buttons = budget.buttons(self.randomize_use_buttons())
             self.logger.info(f"Using {use_buttons} buttons recursively")
-            for _ in range(use_buttons):
-                rnd = random.choice(actions_available)
-                actions_available.pop(actions_available.index(rnd))
-                selected.append(rnd)
-
-            self.logger.info(f"Selected actions: {[i.value for i in selected]}")
-            await task.complete_actions(do_actions=selected, do_recursive=False)
+            selected = get_registry(self.config_path).select(actions_available, use_buttons,
+                                                             cost=budget.cost if budget.frugal else None)
+            get_journal(self.config_path).actions(self.task_id, [i.action for i in selected])
 
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("Selected actions: %s", [i.action for i in selected])
+        await self.complete_actions(do_actions=selected, do_recursive=False, chain_slots=chain_slots)
 
     def randomize_use_buttons(self) -> int:
-        rnge: list[int] = self.config['use_buttons_range_recursive']
+        rnge = self.config.use_buttons_range_recursive
         return random.randrange(rnge[0], rnge[1])
 
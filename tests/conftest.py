@@ -0,0 +1,40 @@
+import pytest
+import yaml
+
+from goapi import GoAPI
+
+
+@pytest.fixture
+def make_config(tmp_path, monkeypatch):
+    """
+    Writes config.yml with the given sections into a temp dir and returns its path.
+    Singletons are keyed by config path, so every test gets fresh ones
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('GOAPI_TOKEN', 'test')
+
+    def make(**sections) -> str:
+        path = tmp_path / 'config.yml'
+        path.write_text(yaml.safe_dump(sections))
+        return str(path)
+
+    return make
+
+
+@pytest.fixture
+def transport():
+    """
+    Replaces GoAPI HTTP with `transport.handler(method, url, payload)`
+    """
+    class Transport:
+        handler = None
+        calls: list[tuple[str, str, dict | None]] = []
+
+        async def __call__(self, method, url, payload):
+            self.calls.append((method, url, payload))
+            return await self.handler(method, url, payload)
+
+    fake = GoAPI.transport = Transport()
+    fake.calls = []
+    yield fake
+    GoAPI.transport = None
@@ -0,0 +1,42 @@
+import pytest
+
+from actions import ActionRegistry
+
+URLS = {name: f'http://goapi.test/{name}' for name in ['upscale', 'variation', 'reroll', 'pan', 'outpaint']}
+
+
+@pytest.fixture
+def registry(make_config):
+    return ActionRegistry(make_config(goapi={'urls': URLS}))
+
+
+def test_unknown_actions_are_skipped(registry):
+    selected = registry.select(['upscale1', 'high_variation', 'reroll'], 5)
+    assert sorted(a.action for a in selected) == ['reroll', 'upscale1']
+
+
+def test_select_picks_distinct_actions(registry):
+    actions = ['upscale1', 'upscale2', 'variation1', 'variation2', 'reroll']
+    selected = registry.select(actions, 3)
+    assert len({a.action for a in selected}) == 3
+    assert {a.action for a in selected} <= set(actions)
+
+
+def test_select_prefers_cheap_actions_when_priced(registry):
+    costs = {'Upscale': 2, 'Variation': 8, 'Reroll': 8}
+    selected = registry.select(['variation1', 'upscale1', 'reroll', 'upscale2'], 2, cost=costs.get)
+    assert sorted(a.action for a in selected) == ['upscale1', 'upscale2']
+
+
+def test_payload_is_compiled_with_url_and_choices(registry):
+    action = registry.get('outpaint_custom')
+    assert action.url == URLS['outpaint']
+    payload = action.payload('t1')
+    assert payload['origin_task_id'] == 't1'
+    assert payload['zoom_ratio'] in ('1.25', '1.75')
+
+
+def test_actions_without_url_are_dropped(make_config):
+    registry = ActionRegistry(make_config(goapi={'urls': {'upscale': URLS['upscale']}}))
+    assert registry.get('upscale1') is not None
+    assert registry.get('reroll') is None
@@ -0,0 +1,69 @@
+import asyncio
+import os
+
+from aiohttp import web
+
+from artifacts import ArtifactStore
+from goapi import TaskResult
+from http_client import HttpClient
+
+IMAGE = b'\x89PNG' + bytes(range(256)) * 16
+
+
+async def serve_image() -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    async def image(request):
+        return web.Response(body=IMAGE)
+
+    app.router.add_get('/image.png', image)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/image.png'
+
+
+def download(store: ArtifactStore, task_id: str):
+    async def run():
+        runner, url = await serve_image()
+        try:
+            store.submit(task_id, TaskResult(task_id, image_url=url))
+            await asyncio.gather(*store.downloads)
+        finally:
+            await HttpClient.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def part_files(directory: str) -> list[str]:
+    return [name for _, _, names in os.walk(directory) for name in names if name.endswith('.part')]
+
+
+def test_unreadable_index_does_not_block_downloads(make_config, monkeypatch):
+    config_path = make_config(artifacts={'enabled': True, 'directory': 'images', 'index': 'index.tsv'})
+    store = ArtifactStore(config_path)
+
+    def read_fails(path):
+        raise PermissionError(path)
+
+    monkeypatch.setattr(store, 'read_index', read_fails)
+    download(store, 't1')
+    assert store.submitted == {'t1'}
+    assert sum(len(names) for _, _, names in os.walk('images')) == 1
+    with open('index.tsv') as f:
+        assert f.read().startswith('t1\t')
+
+
+def test_failed_store_is_retried_later(make_config, monkeypatch):
+    config_path = make_config(artifacts={'enabled': True, 'directory': 'images', 'index': 'index.tsv'})
+    store = ArtifactStore(config_path)
+
+    def store_fails(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, 'store', store_fails)
+    download(store, 't1')
+    assert store.submitted == set()
+    assert part_files('images') == []
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from budget import Budget, SpendWindow
+
+COSTS = {'fast': {'Imagine': 8, 'Upscale': 4}}
+
+
+@pytest.fixture
+def config_path(make_config):
+    return make_config(budget={'hourly': 100, 'daily': 1000, 'costs': COSTS, 'save_interval_seconds': 0})
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_window_expires_old_buckets():
+    window = SpendWindow(3600, 100)
+    window.add(0, 10)
+    window.add(1800, 5)
+    window.expire(3600)
+    assert window.spent == 5
+    assert [start for start, _ in window.buckets] == [1800]
+
+
+def test_refund_goes_to_the_charged_bucket():
+    window = SpendWindow(3600, 100)
+    window.add(0, 8)
+    window.add(120, 4)
+    window.refund(0, 8)
+    assert list(window.buckets) == [[0, 0], [120, 4]]
+    assert window.spent == 4
+
+
+def test_refund_of_expired_bucket_is_ignored():
+    window = SpendWindow(3600, 100)
+    window.add(0, 8)
+    window.add(3600, 4)
+    window.expire(3600)
+    window.refund(0, 8)
+    assert window.spent == 4
+    assert all(spent >= 0 for _, spent in window.buckets)
+
+
+def test_free_at_waits_for_oldest_spending_to_expire():
+    window = SpendWindow(3600, 10)
+    window.add(0, 6)
+    window.add(600, 4)
+    assert window.free_at(700, 0) == 700
+    assert window.free_at(700, 5) == 3600
+    assert window.free_at(700, 7) == 4200
+
+
+def test_acquire_charges_and_refund_gives_back(config_path):
+    async def run():
+        budget = Budget(config_path)
+        budget.clock = Clock()
+        charge = await budget.acquire('Imagine')
+        assert charge.cost == 8
+        assert budget.windows[0].spent == 8
+        budget.refund(charge)
+        assert budget.windows[0].spent == 0
+        assert budget.total_spent == 0
+        await budget.stop()
+
+    asyncio.run(run())
+
+
+def test_unpriced_tasks_are_free(config_path):
+    async def run():
+        budget = Budget(config_path)
+        charge = await budget.acquire('Reroll')
+        budget.refund(charge)
+        return budget.total_spent
+
+    assert asyncio.run(run()) == 0
+
+
+def test_spending_survives_restart(config_path):
+    async def run():
+        first = Budget(config_path)
+        await first.acquire('Imagine')
+        await first.acquire('Upscale')
+        await first.stop()
+        return Budget(config_path)
+
+    second = asyncio.run(run())
+    assert second.windows[0].spent == 12
+    assert second.windows[1].spent == 12
+
+
+def test_expired_spending_is_not_loaded(config_path):
+    # Loaded by the wall clock, before a test clock could be set
+    now = time.time()
+    with open('budget.json', 'w') as f:
+        json.dump({"3600": [[now - 7200, 50]], "86400": [[now - 7200, 50]]}, f)
+    budget = Budget(config_path)
+    assert budget.windows[0].spent == 0
+    assert budget.windows[1].spent == 50
+
+
+def test_buttons_scale_down_past_soft_limit(config_path):
+    budget = Budget(config_path)
+    budget.clock = Clock()
+    assert budget.buttons(4) == 4
+    budget.windows[0].add(budget.clock(), 90)
+    assert budget.buttons(4) == 2
+    budget.windows[0].add(budget.clock(), 10)
+    assert budget.buttons(4) == 1
+
+
+def test_task_over_the_whole_limit_waits_for_an_empty_window():
+    window = SpendWindow(3600, 1)
+    assert window.free_at(0, 2) == 0
+    window.add(0, 2)
+    assert window.free_at(60, 2) == 3600
+
+
+def test_task_over_the_whole_limit_is_held_back(make_config):
+    config_path = make_config(budget={'hourly': 1, 'costs': COSTS, 'path': ''})
+
+    async def run():
+        budget = Budget(config_path)
+        budget.clock = Clock()
+        await budget.acquire('Imagine')
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(budget.acquire('Imagine'), 0.1)
+        return budget.total_spent
+
+    assert asyncio.run(run()) == 8
+
+
+def test_charge_during_save_is_persisted_on_stop(config_path, monkeypatch):
+    saving = threading.Event()
+
+    def save(path, data):
+        saving.wait()
+        Budget.save(path, data)
+
+    async def run():
+        budget = Budget(config_path)
+        monkeypatch.setattr(budget, 'save', save)
+        await budget.acquire('Imagine')
+        for _ in range(5):
+            await asyncio.sleep(0)
+        # The first save is blocked in its thread with one imagine in the snapshot
+        first = budget.saving
+        await budget.acquire('Upscale')
+        saving.set()
+        await first
+        await budget.stop()
+
+    asyncio.run(run())
+    assert Budget(config_path).windows[0].spent == 12
@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import pytest
+
+from journal import Journal, get_journal
+from task import Task, TaskFailedException
+
+
+@pytest.fixture
+def config_path(make_config):
+    return make_config(journal={'enabled': True, 'path': 'journal.jsonl'})
+
+
+def write_records(*records: dict) -> None:
+    with open('journal.jsonl', 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def submitted(task_id: str, parent: str | None = None, action: str | None = None) -> dict:
+    return {"op": "submitted", "task_id": task_id, "task_type": "Imagine" if parent is None else "Upscale",
+            "parent": parent, "chain": parent or task_id, "recursive": parent is None, "action": action}
+
+
+def test_records_are_replayed_after_flush(config_path):
+    journal = Journal(config_path)
+    journal.submitted('i1', 'Imagine', parent=None, chain='i1', recursive=True)
+    journal.actions('i1', ['upscale1', 'variation2'])
+    asyncio.run(journal.stop())
+
+    entries = Journal(config_path).replay()
+    assert list(entries) == ['i1']
+    assert entries['i1'].is_imagine
+    assert entries['i1'].actions == ['upscale1', 'variation2']
+
+
+def test_disabled_journal_records_nothing(make_config):
+    journal = Journal(make_config(journal={'enabled': False, 'path': 'journal.jsonl'}))
+    journal.submitted('i1', 'Imagine', parent=None, chain='i1', recursive=True)
+    assert not journal.buffer
+    assert journal.pending() == []
+
+
+def test_pending_skips_closed_chains(config_path):
+    write_records(submitted('i1'), {"op": "closed", "task_id": "i1"}, submitted('i2'))
+    assert [e.task_id for e in Journal(config_path).pending()] == ['i2']
+
+
+def test_remaining_actions_exclude_submitted_children(config_path):
+    write_records(
+        submitted('i1'),
+        {"op": "actions", "task_id": "i1", "actions": ["upscale1", "upscale1", "variation2"]},
+        submitted('c1', parent='i1', action='upscale1'),
+        {"op": "closed", "task_id": "c1"},
+    )
+    pending = {e.task_id: e for e in Journal(config_path).pending()}
+    assert pending['i1'].remaining_actions() == ['upscale1', 'variation2']
+    assert pending['i1'].children_actions == ['upscale1']
+
+
+def test_torn_last_line_is_ignored(config_path):
+    write_records(submitted('i1'))
+    with open('journal.jsonl', 'a') as f:
+        f.write('{"op": "submitted", "task_')
+    assert [e.task_id for e in Journal(config_path).pending()] == ['i1']
+
+
+def test_pending_compacts_the_journal(config_path):
+    write_records(
+        submitted('i1'),
+        {"op": "actions", "task_id": "i1", "actions": ["upscale1", "variation2"]},
+        submitted('c1', parent='i1', action='upscale1'),
+        {"op": "closed", "task_id": "c1"},
+        submitted('i2'),
+        {"op": "closed", "task_id": "i2"},
+    )
+    before = Journal(config_path).pending()
+    with open('journal.jsonl') as f:
+        ops = [(r['op'], r['task_id']) for r in map(json.loads, f)]
+    assert ('submitted', 'i2') not in ops
+
+    after = Journal(config_path).pending()
+    assert [e.task_id for e in after] == [e.task_id for e in before] == ['i1']
+    assert after[0].remaining_actions() == ['variation2']
+
+
+def test_failed_submission_is_not_journaled(make_config, transport):
+    config_path = make_config(journal={'enabled': True, 'path': 'journal.jsonl'},
+                              task={'prompts': ['a cat']}, goapi={'urls': {'imagine': 'http://goapi.test/imagine'}})
+
+    async def handler(method, url, payload):
+        return {"status": "failed", "message": "no credits"}, 200
+
+    async def run():
+        with pytest.raises(TaskFailedException):
+            async with Task(config_path=config_path, task_type='Imagine'):
+                pass
+
+    transport.handler = handler
+    asyncio.run(run())
+    assert len(transport.calls) == 1
+    assert get_journal(config_path).buffer == []
+
+
+def test_failed_write_is_retried_on_next_flush(config_path, monkeypatch):
+    journal = Journal(config_path)
+    write = journal.write
+    failures = []
+
+    def failing_write(lines):
+        if not failures:
+            failures.append(lines)
+            with open('journal.jsonl', 'a') as f:
+                f.write('{"op": "submi')
+            raise OSError("disk full")
+        write(lines)
+
+    monkeypatch.setattr(journal, 'write', failing_write)
+    journal.submitted('i1', 'Imagine', parent=None, chain='i1', recursive=True)
+    with pytest.raises(OSError):
+        asyncio.run(journal.flush())
+    journal.actions('i1', ['upscale1'])
+    asyncio.run(journal.flush())
+
+    entries = Journal(config_path).replay()
+    assert list(entries) == ['i1']
+    assert entries['i1'].actions == ['upscale1']
@@ -0,0 +1,90 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from enums import TaskStatusEnum
+from poller import Poller
+
+
+def response_error(status: int) -> aiohttp.ClientResponseError:
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+@pytest.fixture
+def config_path(make_config):
+    return make_config(
+        goapi={'retry': {'max_attempts': 1}, 'urls': {'fetch': 'http://goapi.test/fetch'}},
+        poll={'interval_seconds': 0.01, 'max_error_delay_seconds': 0.05, 'task_timeout_seconds': 5},
+    )
+
+
+def test_failed_fetch_is_polled_again(config_path, transport):
+    async def handler(method, url, payload):
+        if len(transport.calls) <= 3:
+            raise response_error(503)
+        return {"task_id": payload['task_id'], "status": "finished", "task_result": {"actions": ["upscale1"]}}, 200
+
+    async def run():
+        poller = Poller(config_path)
+        try:
+            return await asyncio.wait_for(poller.watch('t1'), 5)
+        finally:
+            await poller.stop()
+
+    transport.handler = handler
+    status, result = asyncio.run(run())
+    assert status == TaskStatusEnum.COMPLETED
+    assert result.actions == ["upscale1"]
+    assert len(transport.calls) == 4
+
+
+def test_refused_fetch_fails_the_task(config_path, transport):
+    async def handler(method, url, payload):
+        raise response_error(404)
+
+    async def run():
+        poller = Poller(config_path)
+        try:
+            return await asyncio.wait_for(poller.watch('t1'), 5)
+        finally:
+            await poller.stop()
+
+    transport.handler = handler
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(run())
+    assert len(transport.calls) == 1
+
+
+def test_task_fails_after_timeout(make_config, transport):
+    config_path = make_config(
+        goapi={'urls': {'fetch': 'http://goapi.test/fetch'}},
+        poll={'interval_seconds': 0.01, 'task_timeout_seconds': 0.1},
+    )
+
+    async def handler(method, url, payload):
+        return {"task_id": payload['task_id'], "status": "processing", "task_result": {"task_progress": 10}}, 200
+
+    async def run():
+        poller = Poller(config_path)
+        try:
+            return await asyncio.wait_for(poller.watch('t1'), 5)
+        finally:
+            await poller.stop()
+
+    transport.handler = handler
+    with pytest.raises(asyncio.TimeoutError, match='did not finish'):
+        asyncio.run(run())
+
+
+def test_early_result_resolves_watch(config_path, transport):
+    async def run():
+        poller = Poller(config_path)
+        poller.resolve('t1', TaskStatusEnum.FAILED, None)
+        try:
+            return await poller.watch('t1')
+        finally:
+            await poller.stop()
+
+    assert asyncio.run(run()) == (TaskStatusEnum.FAILED, None)
+    assert not transport.calls
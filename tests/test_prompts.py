@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from prompts import ListPromptSource, MmapPromptSource, PromptSource, reservoir
+
+
+def mmap_source(tmp_path, content: bytes) -> MmapPromptSource:
+    path = tmp_path / 'prompts.txt'
+    path.write_bytes(content)
+    return MmapPromptSource(str(path), '16:9', templates=False)
+
+
+def indexed(source: MmapPromptSource) -> list[bytes]:
+    return [source.mm[start:end] for start, end in zip(source.offsets, source.ends)]
+
+
+def samples(source: PromptSource, count: int = 200) -> set[str]:
+    random.seed(1)
+    return {source.sample() for _ in range(count)}
+
+
+def test_source_without_sample_fails_at_construction():
+    class Broken(PromptSource):
+        pass
+
+    with pytest.raises(TypeError):
+        Broken()
+
+
+def test_crlf_lines_are_indexed_without_carriage_return(tmp_path):
+    source = mmap_source(tmp_path, b'a cat\r\na dog\r\n')
+    assert indexed(source) == [b'a cat', b'a dog']
+    assert samples(source) == {'a cat --ar 16:9', 'a dog --ar 16:9'}
+
+
+def test_blank_lines_are_skipped(tmp_path):
+    source = mmap_source(tmp_path, b'\n\na cat\n   \n\r\n\t\na dog\n\n')
+    assert indexed(source) == [b'a cat', b'a dog']
+
+
+def test_last_line_without_newline(tmp_path):
+    source = mmap_source(tmp_path, b'a cat\na dog')
+    assert indexed(source) == [b'a cat', b'a dog']
+    assert samples(source) == {'a cat --ar 16:9', 'a dog --ar 16:9'}
+
+
+def test_ar_lines_keep_their_own_ar(tmp_path):
+    source = mmap_source(tmp_path, b'a cat --ar 1:1\n\na dog\r\na fox --ar 2:3')
+    assert source.with_ar == {0, 2}
+    assert samples(source) == {'a cat --ar 1:1', 'a dog --ar 16:9', 'a fox --ar 2:3'}
+
+
+def test_line_at_finds_the_line_of_every_position(tmp_path):
+    content = b'\nab\n\ncd\r\nef'
+    source = mmap_source(tmp_path, content)
+    assert list(source.offsets) == [1, 5, 9]
+    lines = [source.line_at(position) for position in range(len(content))]
+    assert lines == [0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2]
+
+
+def test_file_without_prompts_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        mmap_source(tmp_path, b'\n \r\n')
+    with pytest.raises(ValueError):
+        mmap_source(tmp_path, b'')
+
+
+def test_list_source_appends_ar():
+    source = ListPromptSource(['a cat', 'a dog --ar 1:1'], '16:9', templates=False)
+    assert samples(source) == {'a cat --ar 16:9', 'a dog --ar 1:1'}
+
+
+def test_reservoir_keeps_every_line_of_a_short_stream():
+    assert sorted(reservoir(['b\n', '\n', 'a\r\n', '  '], 10)) == ['a', 'b']
+
+
+def test_reservoir_sample_is_uniform():
+    random.seed(1)
+    counts = dict.fromkeys(range(10), 0)
+    for _ in range(2000):
+        for line in reservoir(map(str, range(10)), 3):
+            counts[int(line)] += 1
+    # 600 expected per line
+    assert all(500 < count < 700 for count in counts.values())
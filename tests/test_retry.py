@@ -0,0 +1,171 @@
+import asyncio
+
+import aiohttp
+import pytest
+from multidict import CIMultiDict
+
+from retry import CircuitBreaker, RetryBudget, RetryPolicy, parse_retry_after
+
+
+def response_error(status: int, **headers) -> aiohttp.ClientResponseError:
+    return aiohttp.ClientResponseError(None, (), status=status, headers=CIMultiDict(headers))
+
+
+@pytest.fixture
+def policy(make_config):
+    def make(**retry) -> RetryPolicy:
+        retry = {'base_delay_seconds': 0, 'max_delay_seconds': 0} | retry
+        return RetryPolicy(make_config(goapi={'retry': retry}))
+
+    return make
+
+
+@pytest.mark.parametrize('status', [500, 502, 504])
+def test_submissions_are_not_retried_on_errors_after_creation(policy, status):
+    reason, retryable, _ = policy().classify(response_error(status), idempotent=False)
+    assert reason == str(status)
+    assert not retryable
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_submissions_are_retried_when_task_was_not_created(policy, status):
+    _, retryable, _ = policy().classify(response_error(status), idempotent=False)
+    assert retryable
+
+
+def test_retry_submit_timeouts_covers_gateway_errors(policy):
+    retry = policy(retry_submit_timeouts=True)
+    assert retry.classify(response_error(502), idempotent=False)[1]
+    assert retry.classify(asyncio.TimeoutError(), idempotent=False)[1]
+
+
+def test_fetches_are_retried_on_every_transient_error(policy):
+    retry = policy()
+    for error in [response_error(500), response_error(502), asyncio.TimeoutError(), aiohttp.ServerDisconnectedError()]:
+        reason, retryable, _ = retry.classify(error, idempotent=True)
+        assert reason and retryable
+
+
+def test_other_statuses_are_not_degradation(policy):
+    assert policy().classify(response_error(404), idempotent=True) == (None, False, None)
+
+
+def test_retry_after_is_honoured(policy):
+    _, _, retry_after = policy().classify(response_error(429, **{'Retry-After': '7'}), idempotent=False)
+    assert retry_after == 7
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after('-1') == 0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
+
+def test_call_retries_until_success(policy):
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise response_error(503)
+        return 'ok'
+
+    assert asyncio.run(policy().call('imagine', send, idempotent=False)) == 'ok'
+    assert len(attempts) == 3
+
+
+def test_call_does_not_retry_submission_on_gateway_error(policy):
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        raise response_error(502)
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(policy().call('imagine', send, idempotent=False))
+    assert len(attempts) == 1
+
+
+def test_call_stops_at_max_attempts(policy):
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(policy(max_attempts=3).call('fetch', send, idempotent=True))
+    assert len(attempts) == 3
+
+
+def test_call_stops_when_budget_is_empty(policy):
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(policy(budget_ratio=0, budget_burst=1).call('fetch', send, idempotent=True))
+    # One retry from the burst, then the budget is empty
+    assert len(attempts) == 2
+
+
+def test_observers_see_every_attempt(policy):
+    retry = policy()
+    seen = []
+    retry.observers.append(lambda endpoint, seconds, reason: seen.append((endpoint, reason)))
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise response_error(429)
+        return 'ok'
+
+    asyncio.run(retry.call('imagine', send, idempotent=False))
+    assert seen == [('imagine', '429'), ('imagine', None)]
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, burst=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 1
+
+
+def test_breaker_opens_after_consecutive_failures():
+    async def run():
+        breaker = CircuitBreaker(failures=2, open_seconds=10)
+        breaker.failure()
+        assert not breaker.is_open
+        breaker.success()
+        breaker.failure()
+        assert not breaker.is_open
+        breaker.failure()
+        assert breaker.is_open
+
+    asyncio.run(run())
+
+
+def test_breaker_lets_one_probe_through():
+    async def run():
+        breaker = CircuitBreaker(failures=1, open_seconds=0)
+        breaker.failure()
+        assert await breaker.wait()
+        waiter = asyncio.create_task(breaker.wait())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        breaker.success(probe=True)
+        breaker.finish_probe()
+        assert await waiter is False
+        assert not breaker.is_open
+
+    asyncio.run(run())
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from scheduler import Scheduler
+
+
+@pytest.fixture
+def make_scheduler(make_config):
+    def make(**scheduler) -> Scheduler:
+        return Scheduler(make_config(scheduler={'enabled': True} | scheduler))
+
+    return make
+
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_disabled_scheduler_grants_nothing_to_release(make_config):
+    scheduler = Scheduler(make_config(scheduler={'enabled': False, 'slots': 1}))
+    assert asyncio.run(scheduler.acquire('Imagine', 0)) is False
+    assert scheduler.in_use == 0
+
+
+def test_slots_are_limited(make_scheduler):
+    async def run():
+        scheduler = make_scheduler(slots=1)
+        assert await scheduler.acquire('Imagine', 0)
+        waiter = asyncio.create_task(scheduler.acquire('Imagine', 0))
+        await settle()
+        assert not waiter.done()
+        scheduler.release('Imagine')
+        assert await waiter
+        assert scheduler.in_use == 1
+
+    asyncio.run(run())
+
+
+def test_deeper_lanes_go_first(make_scheduler):
+    async def run():
+        scheduler = make_scheduler(slots=1, depth_weights=[1, 4, 8])
+        await scheduler.acquire('Imagine', 0)
+        order = []
+
+        async def wait(task_type, depth):
+            await scheduler.acquire(task_type, depth)
+            order.append(depth)
+
+        waiters = [asyncio.create_task(wait('Imagine', 0)), asyncio.create_task(wait('Upscale', 2))]
+        await settle()
+        scheduler.release('Imagine')
+        await settle()
+        scheduler.release('Upscale')
+        await asyncio.gather(*waiters)
+        return order
+
+    assert asyncio.run(run()) == [2, 0]
+
+
+def test_lanes_share_slots_by_weight(make_scheduler):
+    async def run():
+        scheduler = make_scheduler(slots=1, depth_weights=[1], weights={'Upscale': 4})
+        await scheduler.acquire('Imagine', 0)
+        granted = []
+
+        async def wait(task_type):
+            await scheduler.acquire(task_type, 0)
+            granted.append(task_type)
+
+        waiters = [asyncio.create_task(wait(t)) for t in ['Imagine', 'Upscale'] * 20]
+        await settle()
+        held = 'Imagine'
+        for _ in range(20):
+            scheduler.release(held)
+            await settle()
+            held = granted[-1]
+        for task in waiters:
+            task.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return granted
+
+    granted = asyncio.run(run())
+    assert granted.count('Upscale') == 16
+    assert granted.count('Imagine') == 4
+
+
+def test_type_limits_leave_slots_to_others(make_scheduler):
+    async def run():
+        scheduler = make_scheduler(slots=5, limits={'Pan': 1})
+        assert await scheduler.acquire('Pan', 1)
+        pan = asyncio.create_task(scheduler.acquire('Pan', 1))
+        await settle()
+        assert not pan.done()
+        assert await scheduler.acquire('Upscale', 1)
+        scheduler.release('Pan')
+        assert await pan
+        assert scheduler.type_in_use == {'Pan': 1, 'Upscale': 1}
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_leak_a_slot(make_scheduler):
+    async def run():
+        scheduler = make_scheduler(slots=1)
+        await scheduler.acquire('Imagine', 0)
+        waiter = asyncio.create_task(scheduler.acquire('Imagine', 0))
+        await settle()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release('Imagine')
+        assert scheduler.in_use == 0
+        assert scheduler.waiting == 0
+
+    asyncio.run(run())
@@ -0,0 +1,20 @@
+import pytest
+
+from stats import percentile
+
+
+@pytest.mark.parametrize('values, q, expected', [
+    (list(range(102)), 50, 50),
+    (list(range(100)), 50, 49),
+    (list(range(100)), 95, 94),
+    (list(range(1, 101)), 99, 99),
+    (list(range(1, 101)), 100, 100),
+    ([3, 1, 2], 0, 1),
+    ([5], 50, 5),
+])
+def test_percentile_is_nearest_rank(values, q, expected):
+    assert percentile(values, q) == expected
+
+
+def test_percentile_of_nothing():
+    assert percentile([], 50) is None
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from upstreams import UpstreamPool
+
+A, B = 'http://a.test', 'http://b.test'
+
+
+@pytest.fixture
+def pool(make_config):
+    config_path = make_config(goapi={
+        'base_urls': [A, B],
+        'urls': {'imagine': 'http://goapi.test/mj/v2/imagine', 'fetch': 'http://goapi.test/mj/v2/fetch'},
+        'upstream': {'eject_failures': 3, 'min_requests': 5, 'eject_error_rate': 0.5, 'probe_interval_seconds': 60},
+    })
+    return UpstreamPool(config_path)
+
+
+def test_urls_are_routed_to_the_fastest_upstream(pool):
+    a, b = pool.upstreams
+    pool.observe(a, 0.5, degraded=False)
+    pool.observe(b, 0.1, degraded=False)
+    url, upstream = pool.route(A + '/mj/v2/imagine', {"prompt": "cat"})
+    assert upstream is b
+    assert url == B + '/mj/v2/imagine'
+
+
+def test_tasks_stick_to_the_upstream_that_created_them(pool):
+    a, b = pool.upstreams
+    pool.observe(a, 0.5, degraded=False)
+    pool.observe(b, 0.1, degraded=False)
+    pool.bind('t1', a)
+    assert pool.route(A + '/mj/v2/fetch', {"task_id": "t1"})[1] is a
+    assert pool.route(A + '/mj/v2/upscale', {"origin_task_id": "t1"})[1] is a
+
+
+def test_consecutive_failures_eject(pool):
+    async def run():
+        a, b = pool.upstreams
+        for _ in range(3):
+            pool.observe(a, 1, degraded=True)
+        assert not a.healthy
+        assert pool.choose() is b
+        await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_last_healthy_upstream_is_never_ejected(pool):
+    async def run():
+        a, b = pool.upstreams
+        for upstream in (a, b):
+            for _ in range(3):
+                pool.observe(upstream, 1, degraded=True)
+        assert [u.healthy for u in pool.upstreams] == [False, True]
+        await pool.stop()
+
+    asyncio.run(run())
+
+
+def test_single_upstream_is_not_routed(make_config):
+    pool = UpstreamPool(make_config(goapi={'base_urls': [A]}))
+    assert pool.route(A + '/mj/v2/fetch', {"task_id": "t1"}) == (A + '/mj/v2/fetch', None)
@@ -0,0 +1,270 @@
+"""
+Sampled per-chain tracing.
+
+Spans are finished as JSON lines: {"trace", "span", "parent", "name", "ts", "dur", "pid", "attrs"},
+ts/dur in microseconds. A chain is sampled as a whole when its root span starts, spans outside
+a sampled chain cost one context variable lookup.
+
+    python tracing.py chrome traces.jsonl -o trace.json   # chrome://tracing, Perfetto
+    python tracing.py folded traces.jsonl -o traces.folded  # flamegraph.pl, speedscope
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+import click
+
+from config import TracingConfig, get_config
+from logger import reg_logger
+
+_current: ContextVar['Span | None'] = ContextVar('span', default=None)
+
+
+def current() -> 'Span | None':
+    """
+    Innermost open span of the running task, None outside of a sampled chain
+    """
+    return _current.get()
+
+
+class NoopSpan:
+    """
+    Stands in for spans that are not sampled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+NOOP = NoopSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'attrs', 'start', 'token')
+
+    def __init__(self, tracer: 'Tracer', trace_id: str, parent_id: str | None, name: str, attrs: dict,
+                 start: float | None = None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time() if start is None else start
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current.reset(self.token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer.export(self, time.time())
+        return False
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+
+class Wait:
+    """
+    `async with` a semaphore, recording time spent acquiring it as a span
+    """
+    __slots__ = ('tracer', 'name', 'lock')
+
+    def __init__(self, tracer: 'Tracer', name: str, lock):
+        self.tracer = tracer
+        self.name = name
+        self.lock = lock
+
+    async def __aenter__(self):
+        with self.tracer.span(self.name):
+            await self.lock.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.lock.release()
+        return False
+
+
+class Tracer:
+    """
+    Collects finished spans and appends them to a size-rotated JSONL file off the event loop
+    """
+    logger = reg_logger('[bold blue]\[TRACING][/bold blue]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.buffer: list[str] = []
+        self.flusher: asyncio.Task | None = None
+        self.write_lock = threading.Lock()
+        # Own generator: sampling must not shift seeded engine randomness
+        self.rng = random.Random()
+        self.pid = os.getpid()
+
+    @property
+    def config(self) -> TracingConfig:
+        return get_config(self.config_path).tracing
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    def span(self, name: str, root: bool = False, parent: Span | None = None, start: float | None = None,
+             **attrs) -> Span | NoopSpan:
+        """
+        :param root: Start a new trace, sampled at `sample_rate`. Other spans are recorded only inside a sampled trace
+        :param parent: Explicit parent, for work done in another asyncio task (defaults to the current span)
+        :param start: Epoch seconds the span began at, if it began before this call
+        """
+        if root:
+            config = self.config
+            if not config.enabled or self.rng.random() >= config.sample_rate:
+                return NOOP
+            return Span(self, os.urandom(8).hex(), None, name, attrs, start)
+
+        parent = parent or _current.get()
+        if parent is None:
+            return NOOP
+        return Span(self, parent.trace_id, parent.span_id, name, attrs, start)
+
+    def wait(self, name: str, lock) -> Wait:
+        return Wait(self, name, lock)
+
+    def record(self, name: str, start: float, end: float, **attrs) -> None:
+        """
+        Span that already happened, under the current one
+        """
+        parent = _current.get()
+        if parent is not None:
+            self.export(Span(self, parent.trace_id, parent.span_id, name, attrs, start), end)
+
+    def export(self, span: Span, end: float) -> None:
+        self.buffer.append(json.dumps({
+            "trace": span.trace_id, "span": span.span_id, "parent": span.parent_id, "name": span.name,
+            "ts": int(span.start * 1e6), "dur": int((end - span.start) * 1e6), "pid": self.pid, "attrs": span.attrs,
+        }))
+
+    def rotate(self) -> None:
+        config = self.config
+        for i in range(config.backups - 1, 0, -1):
+            if os.path.exists(f'{config.path}.{i}'):
+                os.replace(f'{config.path}.{i}', f'{config.path}.{i + 1}')
+        if config.backups:
+            os.replace(config.path, f'{config.path}.1')
+        else:
+            os.unlink(config.path)
+
+    def write(self, lines: list[str]) -> None:
+        config = self.config
+        with self.write_lock:
+            if config.max_bytes and os.path.exists(config.path) and os.path.getsize(config.path) >= config.max_bytes:
+                self.rotate()
+            with open(config.path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    async def flush(self) -> None:
+        if not self.buffer:
+            return
+        lines, self.buffer = self.buffer, []
+        await asyncio.to_thread(self.write, lines)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.flush_interval_seconds)
+            try:
+                await self.flush()
+            except OSError:
+                self.logger.exception("[bold red]Trace write failed")
+
+    def start(self) -> None:
+        if self.enabled and (self.flusher is None or self.flusher.done()):
+            self.flusher = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.flusher:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+            self.flusher = None
+        await self.flush()
+
+
+_tracers: dict[str, Tracer] = {}
+
+
+def get_tracer(config_path: str = 'config.yml') -> Tracer:
+    tracer = _tracers.get(config_path)
+    if tracer is None:
+        tracer = _tracers[config_path] = Tracer(config_path)
+    return tracer
+
+
+def read_spans(paths) -> list[dict]:
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue
+    return spans
+
+
+@click.group()
+def cli():
+    """Convert exported spans for visualization"""
+
+
+@cli.command()
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o', type=click.File('w'), default='-')
+def chrome(paths, output):
+    """Chrome trace event format, one timeline row per chain"""
+    rows: dict[str, int] = {}
+    events = []
+    for span in read_spans(paths):
+        row = rows.setdefault(span['trace'], len(rows) + 1)
+        events.append({"name": span['name'], "ph": "X", "ts": span['ts'], "dur": span['dur'], "pid": span['pid'],
+                       "tid": row, "args": span['attrs'] | {"trace": span['trace']}})
+    json.dump({"traceEvents": events}, output)
+
+
+@cli.command()
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o', type=click.File('w'), default='-')
+def folded(paths, output):
+    """Folded stacks weighted by self time in microseconds"""
+    spans = {span['span']: span for span in read_spans(paths)}
+    self_time = {span_id: span['dur'] for span_id, span in spans.items()}
+    for span in spans.values():
+        if span['parent'] in self_time:
+            self_time[span['parent']] -= span['dur']
+
+    stacks: dict[str, int] = {}
+    for span_id, span in spans.items():
+        names = []
+        while span is not None:
+            names.append(span['name'])
+            span = spans.get(span['parent'])
+        stack = ';'.join(reversed(names))
+        stacks[stack] = stacks.get(stack, 0) + max(self_time[span_id], 0)
+    for stack, weight in sorted(stacks.items()):
+        output.write(f'{stack} {weight}\n')
+
+
+if __name__ == '__main__':
+    cli()
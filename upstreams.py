@@ -0,0 +1,182 @@
+import asyncio
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config import Config, UpstreamConfig, get_config, get_store
+from http_client import HttpClient
+from logger import reg_logger
+from metrics import metrics
+
+
+class Upstream:
+    """
+    One GoAPI base URL with its smoothed latency and error rate
+    """
+    __slots__ = ('base_url', 'latency', 'error_rate', 'failures', 'healthy', 'requests')
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        # Consecutive degraded responses
+        self.failures = 0
+        self.healthy = True
+        self.requests = 0
+
+    def score(self) -> float:
+        # Unknown latency is tried first, so every upstream gets measured
+        return (self.latency or 0) * (1 + 10 * self.error_rate)
+
+    def __repr__(self):
+        return self.base_url
+
+
+class UpstreamPool:
+    """
+    Routes GoAPI requests between equivalent `goapi.base_urls`.
+
+    New tasks go to the healthy upstream with the lowest latency (penalized by error rate). A task's fetches,
+    and buttons pressed on it, stay on the upstream that created it. An upstream is taken out of rotation
+    after `eject_failures` degraded responses in a row or when its error rate passes `eject_error_rate`,
+    and comes back after `probe_successes` probes in a row succeed
+    """
+    logger = reg_logger('[bold magenta]\[UPSTREAMS][/bold magenta]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.upstreams: list[Upstream] = []
+        # task_id -> upstream that created it
+        self.sticky: OrderedDict[str, Upstream] = OrderedDict()
+        self.prober: asyncio.Task | None = None
+        self.build(get_config(config_path))
+        get_store(config_path).subscribe(self.on_config_change)
+
+    @property
+    def config(self) -> UpstreamConfig:
+        return get_config(self.config_path).goapi.upstream
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.upstreams) > 1
+
+    @property
+    def primary(self) -> str:
+        return self.upstreams[0].base_url if self.upstreams else ''
+
+    def build(self, config: Config) -> None:
+        existing = {u.base_url: u for u in self.upstreams}
+        self.upstreams = [existing.get(url.rstrip('/')) or Upstream(url) for url in config.goapi.base_urls]
+
+    def on_config_change(self, old: Config, new: Config) -> None:
+        if old.goapi.base_urls != new.goapi.base_urls:
+            self.build(new)
+
+    def choose(self) -> Upstream:
+        healthy = [u for u in self.upstreams if u.healthy]
+        # Everything is down: keep trying the least bad one rather than stopping
+        return min(healthy or self.upstreams, key=Upstream.score)
+
+    def route(self, url: str, payload: dict | None) -> tuple[str, Upstream | None]:
+        """
+        :returns: Tuple of [url rewritten to the selected upstream, the upstream]
+        """
+        if not self.enabled or not url.startswith(self.primary):
+            return url, None
+        task_id = payload and (payload.get('task_id') or payload.get('origin_task_id'))
+        upstream = self.sticky.get(task_id) if task_id else None
+        if upstream is None:
+            upstream = self.choose()
+        return upstream.base_url + url[len(self.primary):], upstream
+
+    def bind(self, task_id: str, upstream: Upstream) -> None:
+        self.sticky[task_id] = upstream
+        self.sticky.move_to_end(task_id)
+        while len(self.sticky) > self.config.sticky_limit:
+            self.sticky.popitem(last=False)
+
+    def observe(self, upstream: Upstream, seconds: float, degraded: bool) -> None:
+        config = self.config
+        alpha = config.alpha
+        upstream.requests += 1
+        upstream.error_rate += alpha * ((1 if degraded else 0) - upstream.error_rate)
+        if degraded:
+            upstream.failures += 1
+        else:
+            upstream.failures = 0
+            upstream.latency = seconds if upstream.latency is None else upstream.latency + alpha * (
+                    seconds - upstream.latency)
+        if metrics.enabled:
+            metrics.upstream_requests.inc(upstream=upstream.base_url, result='degraded' if degraded else 'ok')
+
+        if upstream.healthy and (upstream.failures >= config.eject_failures or (
+                upstream.requests >= config.min_requests and upstream.error_rate >= config.eject_error_rate)):
+            self.eject(upstream)
+
+    def eject(self, upstream: Upstream) -> None:
+        if sum(u.healthy for u in self.upstreams) <= 1:
+            # Never empty the rotation
+            return
+        upstream.healthy = False
+        self.logger.warning(f"[yellow]{upstream} taken out of rotation: {upstream.failures} failures in a row, "
+                            f"{upstream.error_rate:.0%} errors")
+        if metrics.enabled:
+            metrics.upstream_ejections.inc(upstream=upstream.base_url)
+        if self.prober is None or self.prober.done():
+            self.prober = asyncio.create_task(self.probe_loop())
+
+    async def probe(self, upstream: Upstream) -> float | None:
+        """
+        :returns: Response time, None if the upstream did not answer or answered with 5xx
+        """
+        session = HttpClient.session(self.config_path)
+        timeout = aiohttp.ClientTimeout(total=self.config.probe_timeout_seconds)
+        started = time.perf_counter()
+        try:
+            async with session.head(upstream.base_url + '/', allow_redirects=False, timeout=timeout) as response:
+                await response.read()
+                if response.status >= 500:
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+        return time.perf_counter() - started
+
+    async def probe_loop(self) -> None:
+        successes: dict[str, int] = {}
+        while any(not u.healthy for u in self.upstreams):
+            await asyncio.sleep(self.config.probe_interval_seconds)
+            for upstream in [u for u in self.upstreams if not u.healthy]:
+                seconds = await self.probe(upstream)
+                if seconds is None:
+                    successes[upstream.base_url] = 0
+                    continue
+                successes[upstream.base_url] = successes.get(upstream.base_url, 0) + 1
+                if successes[upstream.base_url] >= self.config.probe_successes:
+                    # Back with a clean record, latency from the probe
+                    upstream.healthy = True
+                    upstream.failures = 0
+                    upstream.error_rate = 0.0
+                    upstream.latency = seconds
+                    successes.pop(upstream.base_url)
+                    self.logger.info(f"[green]{upstream} is back in rotation")
+
+    async def stop(self) -> None:
+        if self.prober:
+            self.prober.cancel()
+            await asyncio.gather(self.prober, return_exceptions=True)
+            self.prober = None
+
+    def hosts(self) -> set[str]:
+        return {f"{p.scheme}://{p.netloc}/" for p in map(urlsplit, (u.base_url for u in self.upstreams))}
+
+
+_pools: dict[str, UpstreamPool] = {}
+
+
+def get_upstreams(config_path: str = 'config.yml') -> UpstreamPool:
+    pool = _pools.get(config_path)
+    if pool is None:
+        pool = _pools[config_path] = UpstreamPool(config_path)
+    return pool
@@ -0,0 +1,89 @@
+import hmac
+
+from aiohttp import web
+
+from config import WebhookConfig, get_config
+import codec
+from enums import TaskStatusEnum
+from goapi import TaskResult
+from logger import reg_logger
+from poller import Poller, get_poller
+
+
+class WebhookServer:
+    """
+    Embedded receiver for GoAPI task callbacks.
+
+    Completed/failed callbacks resolve the waiting poll futures directly,
+    the poller drops to slow fallback polling for callbacks that never arrive.
+    """
+    logger = reg_logger('[bold blue]\[WEBHOOK][/bold blue]')
+
+    def __init__(self, config_path='config.yml'):
+        self.config_path = config_path
+        self.runner: web.AppRunner | None = None
+        self.received = 0
+
+    @property
+    def config(self) -> WebhookConfig:
+        return get_config(self.config_path).webhook
+
+    @property
+    def poller(self) -> Poller:
+        return get_poller(self.config_path)
+
+    def verify(self, request: web.Request) -> bool:
+        if not self.config.secret:
+            return False
+        secret = request.headers.get('X-Webhook-Secret', '')
+        return hmac.compare_digest(secret.encode(), self.config.secret.encode())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.verify(request):
+            self.logger.warning(f"[yellow]Rejected webhook from {request.remote}: bad secret")
+            return web.json_response({"error": "forbidden"}, status=403)
+
+        try:
+            body = await request.json(loads=codec.loads)
+        except Exception:
+            return web.json_response({"error": "invalid json"}, status=400)
+
+        # Unified API wraps the task into "data", v2 sends it as is
+        result = TaskResult.parse(body.get('data', body) if isinstance(body, dict) else None)
+        task_id = result.task_id
+        if not task_id:
+            return web.json_response({"error": "task_id missing"}, status=400)
+
+        try:
+            status = TaskStatusEnum.from_goapi_status(result.status)
+        except ValueError:
+            self.logger.warning(f"[yellow]Unknown status in webhook for {task_id}: {result.status}")
+            return web.json_response({"ok": True})
+
+        self.received += 1
+        if status != TaskStatusEnum.IN_PROGRESS:
+            self.logger.debug("Webhook: %s -> %s", task_id, status.value)
+            self.deliver(task_id, status, result)
+
+        return web.json_response({"ok": True})
+
+    def deliver(self, task_id: str, status: TaskStatusEnum, result: TaskResult) -> None:
+        self.poller.resolve(task_id, status, result)
+
+    async def start(self) -> None:
+        config = self.config
+        app = web.Application()
+        app.router.add_post(config.path, self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, config.host, config.port).start()
+
+        self.poller.fallback_interval = config.fallback_poll_seconds
+        self.logger.info(f"[bold green]Listening on {config.host}:{config.port}{config.path} "
+                         f"(endpoint {config.endpoint})")
+
+    async def stop(self) -> None:
+        self.poller.fallback_interval = None
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None